@@ -0,0 +1,185 @@
+"""
+Measure the throughput of ReoptClient at different numbers of simultaneous
+jobs.
+
+By default the jobs go to a mock REopt server started in this process (see
+mock_reopt.py). Set REOPT_URL to benchmark against another server instead,
+e.g. a mock started separately:
+
+    python benchmark_reopt.py --jobs 100 --max-reopt-threads 1 5 10 20
+    REOPT_URL=http://localhost:8765 python benchmark_reopt.py
+
+Latency is the time from a job being submitted to REopt to its results being
+written. It doesn't include the time a job waits for a free slot.
+"""
+import argparse
+import collections
+import contextlib
+import io
+import os
+import re
+import tempfile
+import time
+
+import numpy as np
+
+import http_session
+import mock_reopt
+import scenarios
+
+# Site of the benchmark payloads.
+LATITUDE = 46.88
+LONGITUDE = -96.79
+
+
+def make_payloads(num_jobs, timesteps_per_hour=1, seed=0):
+    """
+    Make REopt payloads with random loads with Simulation.make_reopt_payload,
+    so they're the payloads a sweep sends apart from the loads.
+    """
+    rng = np.random.default_rng(seed)
+    simulation = scenarios.Simulation(
+        location={}, building_parameters={},
+        reopt_parameters={"Scenario": {"Site": {}}}, weatherfile=None,
+        climate_zone=None, latitude=LATITUDE, longitude=LONGITUDE,
+        timezone=None)
+    simulation.reopt_timesteps_per_hour = timesteps_per_hour
+    return [
+        simulation.make_reopt_payload(
+            loads_kw=rng.uniform(0.2, 3, 8760 * timesteps_per_hour))
+        for _ in range(num_jobs)
+    ]
+
+
+def benchmark(payloads, max_jobs, output_dir, poll_interval=0.5,
+              max_poll_interval=5, timeout=500, rate_limit=0, burst=10,
+              verbose=False):
+    """
+    Run the payloads through a ReoptClient.
+
+    :param float rate_limit: Requests per hour allowed by the client, 0 for
+        no limit.
+    :param int burst: Requests the client can make back to back.
+    :return: dictionary of the wall time, the ReoptClient.job_stats of the
+        jobs that succeeded, a Counter of the errors of the others and the
+        session's RateLimiter
+    """
+    http_session.configure("reopt", rate_limit=rate_limit, burst=burst)
+    output = contextlib.nullcontext() if verbose else \
+        contextlib.redirect_stdout(io.StringIO())
+    with output:
+        client = scenarios.ReoptClient(
+            api_key=os.environ.get("NREL_DEV_KEY", "mock"), max_jobs=max_jobs,
+            poll_interval=poll_interval, max_poll_interval=max_poll_interval,
+            timeout=timeout)
+        start = time.monotonic()
+        futures = [
+            client.submit(
+                payload, os.path.join(output_dir, f"{max_jobs}-{i}.json"))
+            for i, payload in enumerate(payloads)
+        ]
+        client.close()
+        seconds = time.monotonic() - start
+
+    errors = collections.Counter(
+        error_kind(future.exception())
+        for future in futures if future.exception() is not None)
+    return {"seconds": seconds, "job_stats": client.job_stats,
+            "errors": errors,
+            "rate_limiter": http_session.get_session("reopt").rate_limiter}
+
+
+def error_kind(exception):
+    """
+    Describe an exception without the parts specific to the job, so the
+    errors of different jobs can be counted together.
+    """
+    message = re.sub(r"^Job \S+ ", "", str(exception)).split(". ")[0]
+    return f"{type(exception).__name__}: {message}"
+
+
+def report(max_jobs, result):
+    stats = result["job_stats"]
+    latencies = [job["seconds"] for job in stats]
+    line = (
+        f"{max_jobs:>4} threads: {len(stats)} jobs in "
+        f"{round(result['seconds'], 1)} s, "
+        f"{round(len(stats) / result['seconds'], 2)} jobs/s"
+    )
+    if latencies:
+        p50, p99 = np.percentile(latencies, [50, 99])
+        polls = sum(job["polls"] for job in stats)
+        megabytes = sum(job["bytes"] for job in stats) / 10**6
+        line += (
+            f", latency p50 {round(p50, 2)} s p99 {round(p99, 2)} s, "
+            f"{polls} polls, {round(megabytes, 1)} MB"
+        )
+    line += f", {sum(result['errors'].values())} errors"
+    print(line)
+    print(f"      {result['rate_limiter'].summary()}")
+    for kind, count in result["errors"].most_common():
+        print(f"      {count} x {kind}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark REopt job submission and polling.")
+    parser.add_argument('--jobs', default=50, type=int,
+                        help="Number of jobs to run at each thread count.")
+    parser.add_argument('--max-reopt-threads', default=[1, 5, 10, 20],
+                        type=int, nargs='+',
+                        help="Numbers of simultaneous jobs to try.")
+    parser.add_argument('--timesteps-per-hour', default=1, type=int,
+                        help="Time steps per hour of the loads posted.")
+    parser.add_argument('--poll-interval', default=0.5, type=float,
+                        help="Seconds to wait before the second poll.")
+    parser.add_argument('--max-poll-interval', default=5, type=float,
+                        help="Longest number of seconds between polls.")
+    parser.add_argument('--rate-limit', default=0, type=float,
+                        help="Requests per hour allowed by the client, 0 for "
+                             "no limit.")
+    parser.add_argument('--burst', default=10, type=int,
+                        help="Requests the client can make back to back.")
+    parser.add_argument('--latency', default=2, type=float,
+                        help="Median solve time of the mock, in seconds.")
+    parser.add_argument('--spread', default=0.5, type=float,
+                        help="Standard deviation of the mock's log solve "
+                             "time.")
+    parser.add_argument('--failure-rate', default=0, type=float,
+                        help="Fraction of submissions the mock fails.")
+    parser.add_argument('--non-optimal-rate', default=0, type=float,
+                        help="Fraction of mock jobs that aren't optimal.")
+    parser.add_argument('--server-rate-limit', default=0, type=int,
+                        help="Requests the mock allows per rate window, 0 for "
+                             "no limit.")
+    parser.add_argument('--server-rate-window', default=3600, type=float,
+                        help="Seconds in the mock's rate limit window.")
+    parser.add_argument('--verbose', action='store_true',
+                        help="Print the output of every job.")
+    args = parser.parse_args()
+
+    mock = None
+    if 'REOPT_URL' not in os.environ:
+        mock = mock_reopt.MockReopt(
+            latency=args.latency, spread=args.spread,
+            failure_rate=args.failure_rate,
+            non_optimal_rate=args.non_optimal_rate,
+            rate_limit=args.server_rate_limit,
+            rate_window=args.server_rate_window, seed=0)
+        scenarios.REOPT_URL = mock.start()
+    print(f"Benchmarking {args.jobs} jobs against {scenarios.REOPT_URL}")
+
+    payloads = make_payloads(args.jobs, args.timesteps_per_hour)
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            for max_jobs in args.max_reopt_threads:
+                result = benchmark(
+                    payloads, max_jobs, output_dir,
+                    poll_interval=args.poll_interval,
+                    max_poll_interval=args.max_poll_interval,
+                    rate_limit=args.rate_limit, burst=args.burst,
+                    verbose=args.verbose)
+                report(max_jobs, result)
+    finally:
+        if mock is not None:
+            mock.stop()
@@ -0,0 +1,82 @@
+"""
+Measure the runtime and peak memory of the time series queries in
+poster_graphs.ipynb.
+
+    python benchmark_timeseries.py --workers 8
+    python benchmark_timeseries.py --legacy
+
+Peak memory is what tracemalloc sees allocated, which includes the pandas and
+NumPy buffers.
+"""
+import argparse
+import contextlib
+import io
+import time
+import tracemalloc
+
+import results_processor
+
+# Queries made by poster_graphs.ipynb.
+WORKLOADS = {
+    "stochastic": dict(
+        locations=['Fargo', 'Richmond', 'Phoenix'],
+        schedules_types=['stochastic'],
+        building_nums=list(range(1, 11)),
+        occupant_types=[None, '000', '111', '222', '333'], hvac_setbacks=[5],
+        timesteps_per_hour=2),
+    "default": dict(
+        locations=['Fargo', 'Richmond', 'Phoenix'],
+        schedules_types=['default'],
+        building_nums=[1],
+        occupant_types=[None], hvac_setbacks=[0], timesteps_per_hour=2),
+}
+
+
+def benchmark(results, workload, **kwargs):
+    """
+    Run a workload and return its frame, runtime in seconds and peak memory
+    in bytes.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            frame = results.get_electricity_usage_and_occupancy(
+                **WORKLOADS[workload], **kwargs)
+        runtime = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return frame, runtime, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark get_electricity_usage_and_occupancy.")
+    parser.add_argument('--results-dir', default='reopt_results',
+                        help="REopt output folder.")
+    parser.add_argument('--run-dir', default='run',
+                        help="URBANopt run folder.")
+    parser.add_argument('--workers', default=1, type=int,
+                        help="Number of runs to read at once.")
+    parser.add_argument('--executor', default='process',
+                        choices=['process', 'thread'],
+                        help="Pool to read the runs on.")
+    parser.add_argument('--legacy', action='store_true',
+                        help="Concatenate and pivot instead of batching.")
+    args = parser.parse_args()
+
+    results = results_processor.Results(args.results_dir, args.run_dir)
+    for workload in WORKLOADS:
+        try:
+            frame, runtime, peak = benchmark(
+                results, workload, batched=not args.legacy,
+                workers=args.workers, executor=args.executor)
+        except ValueError as e:
+            print(f"{workload}: {e}")
+            continue
+        print(
+            f"{workload}: {frame.shape[0]} rows x {frame.shape[1]} columns "
+            f"in {round(runtime, 2)} s, peak memory "
+            f"{round(peak / 10**6, 1)} MB, frame "
+            f"{round(frame.memory_usage(deep=True).sum() / 10**6, 1)} MB")
@@ -0,0 +1,236 @@
+"""
+Fast readers for the URBANopt default feature reports.
+
+Feature reports can be ingested once into a compressed Parquet file next to
+the CSV, with a typed datetime index. Readers then load only the columns
+they need from the memory-mapped Parquet file, and fall back on the CSV for
+reports that haven't been ingested.
+
+Ingesting needs pyarrow. To ingest all the reports in the run folder:
+
+    python feature_reports.py run --jobs 8
+"""
+import argparse
+import concurrent.futures
+import csv
+import functools
+import os
+
+import numpy as np
+import pandas as pd
+
+# Name of the folder the default feature reports are written to by the
+# workflow in mappers/base_workflow.osw.
+FEATURE_REPORT_FOLDER = "014_default_feature_reports"
+
+FEATURE_REPORT_FILENAME = "default_feature_reports.csv"
+
+# Name of the datetime index column.
+DATETIME = "Datetime"
+
+FACILITY_ELECTRICITY = "Electricity:Facility(kWh)"
+
+
+def feature_report_csv(run_dir, scenario, building_num):
+    """
+    Return the path of the default feature report CSV for a building.
+
+    Falls back on searching the building folder if the report isn't in the
+    usual folder.
+    """
+    building_dir = os.path.join(run_dir, scenario, str(building_num))
+    report_csv = os.path.join(
+        building_dir, FEATURE_REPORT_FOLDER, FEATURE_REPORT_FILENAME)
+    if os.path.exists(report_csv):
+        return report_csv
+    report_folder = [
+        f for f in os.listdir(building_dir) if 'default_feature_reports' in f
+    ][0]
+    return os.path.join(building_dir, report_folder, FEATURE_REPORT_FILENAME)
+
+
+def parquet_filename(report_csv):
+    return os.path.splitext(report_csv)[0] + ".parquet"
+
+
+def has_parquet(report_csv):
+    """
+    Return True if the report has been ingested since the CSV last changed.
+    """
+    try:
+        return os.path.getmtime(parquet_filename(report_csv)) >= \
+            os.path.getmtime(report_csv)
+    except FileNotFoundError:
+        return False
+
+
+def report_timestep(report_csv):
+    """
+    Return the number of seconds between the first two rows of a feature
+    report, without parsing the rest of the datetime index.
+    """
+    if has_parquet(report_csv):
+        index = read_report(report_csv, columns=[]).index
+        return (index[1] - index[0]).total_seconds()
+    with open(report_csv, "r", newline="") as f:
+        reader = csv.reader(f)
+        next(reader)
+        first = next(reader)[0]
+        second = next(reader)[0]
+    return (pd.Timestamp(second) - pd.Timestamp(first)).total_seconds()
+
+
+def report_columns(report_csv):
+    """
+    Return the names of the data columns in a feature report.
+    """
+    if has_parquet(report_csv):
+        import pyarrow.parquet as pq
+        return [
+            name for name in pq.read_schema(parquet_filename(report_csv)).names
+            if name != DATETIME
+        ]
+    with open(report_csv, "r", newline="") as f:
+        return next(csv.reader(f))[1:]
+
+
+def read_report(report_csv, columns=None):
+    """
+    Read a feature report into a DataFrame with a DatetimeIndex.
+
+    :param lst columns: Columns to read, defaults to all of them.
+    :rtype: pandas.DataFrame
+    """
+    if has_parquet(report_csv):
+        import pyarrow.parquet as pq
+        if columns is not None:
+            columns = [DATETIME] + list(columns)
+        table = pq.read_table(
+            parquet_filename(report_csv), columns=columns, memory_map=True)
+        return table.to_pandas().set_index(DATETIME)
+
+    if columns is None:
+        usecols = None
+    else:
+        usecols = [0] + [report_columns(report_csv).index(c) + 1
+                         for c in columns]
+    report = pd.read_csv(report_csv, index_col=0, usecols=usecols)
+    report.index = pd.to_datetime(report.index)
+    report.index.name = DATETIME
+    return report
+
+
+def read_column(report_csv, column):
+    """
+    Read a single numeric column of a feature report.
+
+    :rtype: numpy.ndarray
+    """
+    if has_parquet(report_csv):
+        import pyarrow.parquet as pq
+        table = pq.read_table(
+            parquet_filename(report_csv), columns=[column], memory_map=True)
+        return table.column(column).to_numpy()
+    return pd.read_csv(
+        report_csv, usecols=[column], dtype={column: np.float64},
+        engine="c"
+    )[column].to_numpy()
+
+
+def ingest(report_csv, compression="zstd"):
+    """
+    Convert a feature report CSV to a compressed Parquet file next to it.
+
+    :return: Path of the Parquet file
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    report = pd.read_csv(report_csv, index_col=0)
+    report.index = pd.to_datetime(report.index)
+    report.index.name = DATETIME
+    # Store the index as a plain column so it can be selected like the others.
+    table = pa.Table.from_pandas(report.reset_index(), preserve_index=False)
+    filename = parquet_filename(report_csv)
+    # Write to a temporary file so readers never see a partial file.
+    pq.write_table(table, filename + ".tmp", compression=compression)
+    os.replace(filename + ".tmp", filename)
+    return filename
+
+
+def find_reports(run_dir):
+    """
+    Return the paths of all the feature report CSVs in a run folder.
+    """
+    reports = []
+    for root, _, files in os.walk(run_dir):
+        if FEATURE_REPORT_FILENAME in files and \
+                'default_feature_reports' in os.path.basename(root):
+            reports.append(os.path.join(root, FEATURE_REPORT_FILENAME))
+    return sorted(reports)
+
+
+def ingest_all(run_dir, jobs=1, force=False):
+    """
+    Ingest all the feature reports in a run folder that haven't been
+    ingested yet.
+
+    :param int jobs: Number of reports to convert at once.
+    :param bool force: Ingest reports even if they're already up to date.
+    :return: List of the Parquet files written
+    """
+    reports = [
+        report for report in find_reports(run_dir)
+        if force or not has_parquet(report)
+    ]
+    if jobs > 1:
+        with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+            return list(pool.map(ingest, reports, chunksize=8))
+    return [ingest(report) for report in reports]
+
+
+def read_facility_kw(report_csv, timesteps_per_hour):
+    """
+    Return the facility electricity use of a feature report in kW, rounded to
+    the nearest watt.
+
+    Reports are cached on their path, modification time and size, so reading
+    the same report again is free. The returned array is read-only.
+
+    :param str report_csv: Path of the feature report
+    :param int timesteps_per_hour: Timesteps per hour the building was
+        simulated with. A RuntimeError is raised if the report doesn't match.
+    :rtype: numpy.ndarray
+    """
+    stat = os.stat(report_csv)
+    return _read_facility_kw(
+        report_csv, stat.st_mtime_ns, stat.st_size, timesteps_per_hour)
+
+
+@functools.lru_cache(maxsize=256)
+def _read_facility_kw(report_csv, mtime_ns, size, timesteps_per_hour):
+    # Check and make sure the timestep matches what we expect.
+    if not (3600 / timesteps_per_hour == report_timestep(report_csv)):
+        raise RuntimeError(
+            f"Mismatch in simulated timestep vs. scenario timestep in "
+            f"{report_csv}")
+    loads = np.round(
+        read_column(report_csv, FACILITY_ELECTRICITY) * timesteps_per_hour, 3
+    )
+    loads.setflags(write=False)
+    return loads
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert feature reports to Parquet files.")
+    parser.add_argument('run_dir', nargs='?', default='run',
+                        help="URBANopt run folder to ingest.")
+    parser.add_argument('--jobs', default=1, type=int,
+                        help="Number of reports to convert at once.")
+    parser.add_argument('--force', action='store_true',
+                        help="Convert reports that are already up to date.")
+    args = parser.parse_args()
+
+    written = ingest_all(args.run_dir, jobs=args.jobs, force=args.force)
+    print(f"Ingested {len(written)} feature reports in {args.run_dir}")
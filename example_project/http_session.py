@@ -0,0 +1,284 @@
+"""
+Shared HTTP sessions for the REopt and URDB APIs.
+
+Sessions keep their connections alive in a pool so repeated calls to the same
+host skip the TCP and TLS handshakes, retry failed calls with backoff, and
+apply a default timeout to every request.
+
+Every request made through a session takes a token from the session's
+`RateLimiter` first, so all the threads using a session together stay under
+its rate limit. A 429 response pauses the whole session for as long as its
+Retry-After header asks before the request is retried, so a session with no
+rate limit set, or one set too high, still backs off to the server's quota.
+
+The defaults can be changed with environment variables or by calling
+`configure` before the session is first used.
+"""
+import datetime
+import email.utils
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Number of connections kept alive per host.
+POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 20))
+# Number of times to retry a failed request.
+RETRIES = int(os.environ.get("HTTP_RETRIES", 3))
+# Retries wait backoff_factor * 2 ** (retry number - 1) seconds.
+BACKOFF_FACTOR = float(os.environ.get("HTTP_BACKOFF_FACTOR", 0.5))
+# Seconds to wait to connect and to wait for a response.
+CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 10))
+READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", 60))
+
+# Requests per hour allowed per session, 0 for no limit.
+RATE_LIMIT = float(os.environ.get("HTTP_RATE_LIMIT", 0))
+# Number of requests that can be made back to back under the rate limit.
+RATE_BURST = int(os.environ.get("HTTP_RATE_BURST", 10))
+# Number of times to retry a request that was rejected with a 429.
+THROTTLE_RETRIES = int(os.environ.get("HTTP_THROTTLE_RETRIES", 5))
+# Seconds to pause a session after a 429 without a Retry-After header.
+THROTTLE_PAUSE = float(os.environ.get("HTTP_THROTTLE_PAUSE", 60))
+
+# Status codes that are worth retrying. 429s are retried by the rate limiter.
+RETRY_STATUSES = (500, 502, 503, 504)
+
+_sessions = {}
+_settings = {}
+_lock = threading.Lock()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that applies a default timeout to requests that don't set one.
+    """
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the rate of requests made by any number of threads.
+
+    The bucket holds up to *burst* tokens and refills at the rate limit. Each
+    request takes a token, waiting for one if the bucket is empty. When the
+    server rejects a request with a 429, no tokens are handed out until its
+    Retry-After has passed, and then only one, so the first request after the
+    pause checks whether the quota has recovered before the others follow.
+    """
+
+    def __init__(self, per_hour=RATE_LIMIT, burst=RATE_BURST,
+                 pause=THROTTLE_PAUSE):
+        """
+        :param float per_hour: Requests allowed per hour, 0 for no limit.
+        :param int burst: Number of requests that can be made back to back.
+        :param float pause: Seconds to pause after a 429 response that
+            doesn't say how long to wait.
+        """
+        self.rate = per_hour / 3600
+        self.burst = max(1, burst)
+        self.pause = pause
+        self.tokens = self.burst
+        # Statistics.
+        self.requests = 0
+        self.throttled = 0
+        self.seconds_waited = 0.0
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a request can be made.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if not self.rate:
+                        self.requests += 1
+                        return
+                    self._refill(now)
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        self.requests += 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                self.seconds_waited += wait
+            time.sleep(wait)
+
+    def throttle(self, retry_after=None):
+        """
+        Pause all requests after the server rejected one for exceeding its
+        rate limit.
+
+        :param float retry_after: Seconds the server asked to wait.
+        """
+        with self._lock:
+            now = time.monotonic()
+            pause = self.pause if retry_after is None else retry_after
+            self._paused_until = max(self._paused_until, now + pause)
+            self.tokens = 1
+            self._updated = self._paused_until
+            self.throttled += 1
+
+    def update(self, response):
+        """
+        Don't hand out more tokens than the requests the server says remain
+        in its quota, from the X-RateLimit-Remaining header of *response*.
+        """
+        try:
+            remaining = float(response.headers["X-RateLimit-Remaining"])
+        except (KeyError, ValueError):
+            return
+        with self._lock:
+            self.tokens = min(self.tokens, remaining)
+
+    def summary(self):
+        return (
+            f"{self.requests} requests, {self.throttled} throttled, "
+            f"{round(self.seconds_waited, 1)} s waiting for the rate limit"
+        )
+
+    def _refill(self, now):
+        elapsed = max(0.0, now - self._updated)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self._updated = max(self._updated, now)
+
+
+class RateLimitedHTTPAdapter(TimeoutHTTPAdapter):
+    """
+    TimeoutHTTPAdapter that takes a token from a RateLimiter before each
+    request and retries requests rejected with a 429 once the limiter lets
+    it.
+    """
+
+    def __init__(self, *args, limiter=None, throttle_retries=THROTTLE_RETRIES,
+                 **kwargs):
+        self.limiter = limiter or RateLimiter()
+        self.throttle_retries = throttle_retries
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        for attempt in range(self.throttle_retries + 1):
+            self.limiter.acquire()
+            response = super().send(request, **kwargs)
+            if response.status_code != 429:
+                break
+            self.limiter.throttle(parse_retry_after(response))
+            if attempt < self.throttle_retries:
+                response.close()
+        self.limiter.update(response)
+        return response
+
+
+def make_session(pool_size=POOL_SIZE, retries=RETRIES,
+                 backoff_factor=BACKOFF_FACTOR,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                 rate_limit=RATE_LIMIT, burst=RATE_BURST,
+                 throttle_retries=THROTTLE_RETRIES):
+    """
+    Make a requests session with pooled connections, retries, a default
+    timeout and a rate limit. The session's RateLimiter is its
+    `rate_limiter` attribute.
+
+    POSTs are only retried if the connection couldn't be made, so a job is
+    never submitted twice.
+
+    :param int pool_size: Number of connections kept alive per host.
+    :param int retries: Number of times to retry a failed request.
+    :param float backoff_factor: Backoff between retries, in seconds.
+    :param timeout: Seconds to wait for a response, or a tuple of the connect
+        and read timeouts.
+    :param float rate_limit: Requests allowed per hour, 0 for no limit.
+    :param int burst: Number of requests that can be made back to back.
+    :param int throttle_retries: Number of times to retry a request rejected
+        with a 429.
+    :rtype: requests.Session
+    """
+    retry = Retry(
+        total=retries, backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES, raise_on_status=False
+    )
+    limiter = RateLimiter(rate_limit, burst)
+    adapter = RateLimitedHTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size,
+        max_retries=retry, timeout=timeout, limiter=limiter,
+        throttle_retries=throttle_retries
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.rate_limiter = limiter
+    return session
+
+
+def parse_retry_after(response):
+    """
+    Return the number of seconds the response's Retry-After header asks the
+    client to wait, or None if it doesn't have one.
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    # Otherwise it should be an HTTP date.
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max(0.0, (date - now).total_seconds())
+
+
+def configure(name, **kwargs):
+    """
+    Set the options used to make the shared session *name*, replacing the
+    session if it has already been made.
+
+    :param kwargs: Keyword arguments to `make_session`.
+    """
+    with _lock:
+        _settings[name] = kwargs
+        session = _sessions.pop(name, None)
+    if session is not None:
+        session.close()
+
+
+def get_session(name="default"):
+    """
+    Return the shared session *name*, making it on first use.
+
+    :rtype: requests.Session
+    """
+    with _lock:
+        if name not in _sessions:
+            _sessions[name] = make_session(**_settings.get(name, {}))
+        return _sessions[name]
+
+
+def close_all():
+    """
+    Close all the shared sessions.
+    """
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
@@ -0,0 +1,214 @@
+"""
+Durable record of the progress of a scenario sweep.
+
+Each scenario's building simulation and each building's REopt job are
+recorded as they move through their stages, in a SQLite database that is
+written as soon as a stage is reached. In particular the run_uuid of a REopt
+job is stored as soon as it's submitted, so if the sweep is interrupted the
+next run can poll the outstanding jobs for their results instead of
+submitting them again.
+
+Stages of a scenario:
+    written         scenario JSON written
+    simulated       OpenStudio simulations finished
+    post_processed  URBANopt post-processing finished, loads are ready
+    failed          a rake task failed
+
+Stages of a REopt job, keyed on its results filepath:
+    submitted       job submitted, has a run_uuid
+    written         results written
+    failed          job couldn't be submitted or didn't finish optimal
+
+Safe to use from multiple threads and processes. Ledgers are pickled as
+their path, so they can be passed to worker processes.
+"""
+import sqlite3
+import threading
+import time
+
+SCENARIO_STAGES = ("written", "simulated", "post_processed", "failed")
+REOPT_STAGES = ("submitted", "written", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenarios (
+    scenario_name TEXT PRIMARY KEY,
+    template TEXT,
+    stage TEXT NOT NULL,
+    error TEXT,
+    seconds REAL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reopt_jobs (
+    output_path TEXT PRIMARY KEY,
+    run_uuid TEXT,
+    payload_hash TEXT,
+    stage TEXT NOT NULL,
+    error TEXT,
+    seconds REAL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reopt_jobs_stage ON reopt_jobs (stage);
+"""
+
+
+class JobLedger:
+    """
+    SQLite ledger of scenario and REopt job stages.
+    """
+
+    def __init__(self, path):
+        """
+        :param str path: SQLite database file, made if it doesn't exist.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(SCHEMA)
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def scenario_stage(self, scenario_name):
+        """
+        Return the stage of a scenario, or None if it isn't in the ledger.
+        """
+        rows = self._execute(
+            "SELECT stage FROM scenarios WHERE scenario_name = ?",
+            (scenario_name,))
+        return rows[0][0] if rows else None
+
+    def set_scenario_stage(self, scenario_name, stage, template=None,
+                           error=None, seconds=None):
+        """
+        Record that a scenario reached a stage.
+
+        :param str template: Template filepath the scenario was made from.
+        :param str error: Error message, for the failed stage.
+        :param float seconds: Time taken by the simulation.
+        """
+        if stage not in SCENARIO_STAGES:
+            raise ValueError(f"Unknown scenario stage {stage}")
+        self._execute(
+            """
+            INSERT INTO scenarios
+                (scenario_name, template, stage, error, seconds, updated)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (scenario_name) DO UPDATE SET
+                template = COALESCE(excluded.template, template),
+                stage = excluded.stage,
+                error = excluded.error,
+                seconds = COALESCE(excluded.seconds, seconds),
+                updated = excluded.updated
+            """,
+            (scenario_name, template, stage, error, seconds, time.time()))
+
+    def reopt_stage(self, output_path):
+        """
+        Return the stage of the REopt job for a results filepath, or None if
+        it isn't in the ledger.
+        """
+        rows = self._execute(
+            "SELECT stage FROM reopt_jobs WHERE output_path = ?",
+            (output_path,))
+        return rows[0][0] if rows else None
+
+    def reopt_submitted(self, output_path, run_uuid, payload_hash=None):
+        """
+        Record that a REopt job was submitted.
+
+        :param str payload_hash: reopt_cache.payload_hash of the payload, to
+            cache the results under once they're fetched.
+        """
+        self._set_reopt_stage(
+            output_path, "submitted", run_uuid=run_uuid,
+            payload_hash=payload_hash)
+
+    def reopt_written(self, output_path, seconds=None):
+        """
+        Record that the results of a REopt job were written.
+
+        :param float seconds: Time from submitting the job to its results.
+        """
+        self._set_reopt_stage(output_path, "written", seconds=seconds)
+
+    def reopt_failed(self, output_path, error):
+        self._set_reopt_stage(output_path, "failed", error=error)
+
+    def _set_reopt_stage(self, output_path, stage, run_uuid=None,
+                         payload_hash=None, error=None, seconds=None):
+        self._execute(
+            """
+            INSERT INTO reopt_jobs
+                (output_path, run_uuid, payload_hash, stage, error, seconds,
+                 updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (output_path) DO UPDATE SET
+                run_uuid = COALESCE(excluded.run_uuid, run_uuid),
+                payload_hash = COALESCE(excluded.payload_hash, payload_hash),
+                stage = excluded.stage,
+                error = excluded.error,
+                seconds = COALESCE(excluded.seconds, seconds),
+                updated = excluded.updated
+            """,
+            (output_path, run_uuid, payload_hash, stage, error, seconds,
+             time.time()))
+
+    def outstanding(self):
+        """
+        Return the REopt jobs that were submitted but whose results weren't
+        written, oldest first.
+
+        :return: list of dictionaries of output_path, run_uuid and
+            payload_hash
+        """
+        rows = self._execute(
+            "SELECT output_path, run_uuid, payload_hash FROM reopt_jobs "
+            "WHERE stage = 'submitted' ORDER BY updated")
+        return [
+            {"output_path": output_path, "run_uuid": run_uuid,
+             "payload_hash": payload_hash}
+            for output_path, run_uuid, payload_hash in rows
+        ]
+
+    def durations(self):
+        """
+        Return the number and mean of the recorded times of the simulations
+        that finished post-processing and the REopt jobs that were written.
+
+        :return: dictionary of (count, mean seconds) tuples under
+            "scenarios" and "reopt_jobs", with a mean of None if there are no
+            recorded times
+        """
+        return {
+            table: tuple(self._execute(
+                f"SELECT COUNT(seconds), AVG(seconds) FROM {table} "
+                "WHERE stage = ? AND seconds IS NOT NULL", (stage,))[0])
+            for table, stage in (
+                ("scenarios", "post_processed"), ("reopt_jobs", "written"))
+        }
+
+    def summary(self):
+        counts = []
+        for table in ("scenarios", "reopt_jobs"):
+            rows = self._execute(
+                f"SELECT stage, COUNT(*) FROM {table} GROUP BY stage "
+                "ORDER BY stage")
+            counts.append(", ".join(
+                f"{count} {stage}" for stage, count in rows) or "none")
+        return (
+            f"Job ledger: scenarios {counts[0]}; REopt jobs {counts[1]}"
+        )
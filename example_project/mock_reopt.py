@@ -0,0 +1,370 @@
+"""
+Local stand-in for the REopt API, for testing and benchmarking the job
+submission pipeline without the rate-limited NREL API.
+
+It implements the two endpoints scenarios.py uses:
+    POST /v1/job/                       submit a job, returns its run_uuid
+    GET  /v1/job/<run_uuid>/results/    "Optimizing..." until the job is done
+
+Jobs take a random solve time, and can be set to fail on submission or to
+finish with a non-optimal status. Like the NREL API, the server can limit the
+number of requests per time window, rejecting the rest with a 429 and a
+Retry-After header. Responses echo the inputs and finished jobs
+return the same time series REopt does, so payload sizes are realistic.
+
+To run scenarios against it:
+
+    python mock_reopt.py --port 8765 --latency 5
+    REOPT_URL=http://localhost:8765 NREL_DEV_KEY=mock python scenarios.py ...
+"""
+import argparse
+import collections
+import http.server
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+
+import numpy as np
+
+RESULTS_PATH = re.compile(r"^/v1/job/([0-9a-f-]+)/results/?$")
+SUBMIT_PATH = re.compile(r"^/v1/job/?$")
+
+
+class MockReopt:
+    """
+    Mock REopt server running on a background thread.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=5, spread=0.5,
+                 failure_rate=0, non_optimal_rate=0, rate_limit=0,
+                 rate_window=3600, seed=None):
+        """
+        :param int port: Port to listen on, or 0 for any free port.
+        :param float latency: Median seconds for a job to solve.
+        :param float spread: Standard deviation of the log of the solve
+            time. 0 makes every job take *latency* seconds.
+        :param float failure_rate: Fraction of submissions that fail with a
+            500 error.
+        :param float non_optimal_rate: Fraction of jobs that finish with a
+            non-optimal status.
+        :param int rate_limit: Number of requests allowed per *rate_window*
+            seconds, 0 for no limit.
+        :param float rate_window: Length of the rate limit's sliding window.
+        :param int seed: Seed for the random solve times and outcomes.
+        """
+        self.latency = latency
+        self.spread = spread
+        self.failure_rate = failure_rate
+        self.non_optimal_rate = non_optimal_rate
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.random = random.Random(seed)
+        # Counts of the requests served, by kind.
+        self.counts = {
+            "submitted": 0, "failed": 0, "polls": 0, "finished": 0,
+            "throttled": 0,
+        }
+        self._jobs = {}
+        # Times of the requests in the current rate limit window.
+        self._requests = collections.deque()
+        self._lock = threading.Lock()
+
+        mock = self
+
+        class Handler(_Handler):
+            server_mock = mock
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """
+        Serve on a background thread.
+
+        :return: Base URL of the server, to use as REOPT_URL.
+        """
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def check_rate_limit(self):
+        """
+        Count a request against the rate limit.
+
+        :return: Tuple of the requests remaining in the window and the
+            seconds until another request is allowed, which is None if this
+            one is allowed.
+        """
+        if not self.rate_limit:
+            return None, None
+        with self._lock:
+            now = time.monotonic()
+            while self._requests and \
+                    self._requests[0] <= now - self.rate_window:
+                self._requests.popleft()
+            if len(self._requests) >= self.rate_limit:
+                self.counts["throttled"] += 1
+                return 0, self._requests[0] + self.rate_window - now
+            self._requests.append(now)
+            return self.rate_limit - len(self._requests), None
+
+    def submit(self, body):
+        """
+        Register a job for a posted payload.
+
+        :return: run_uuid, or None if the submission should fail.
+        """
+        with self._lock:
+            if self.random.random() < self.failure_rate:
+                self.counts["failed"] += 1
+                return None
+            if self.spread:
+                solve_time = self.random.lognormvariate(
+                    math.log(self.latency), self.spread)
+            else:
+                solve_time = self.latency
+            run_uuid = str(uuid.uuid4())
+            self._jobs[run_uuid] = {
+                "done_at": time.monotonic() + solve_time,
+                "optimal": self.random.random() >= self.non_optimal_rate,
+                "inputs": body,
+            }
+            self.counts["submitted"] += 1
+            return run_uuid
+
+    def results(self, run_uuid):
+        """
+        Return the serialized results response of a job, or None if there
+        is no such job.
+        """
+        with self._lock:
+            job = self._jobs.get(run_uuid)
+            self.counts["polls"] += 1
+        if job is None:
+            return None
+        if time.monotonic() < job["done_at"]:
+            # REopt sends the inputs back while the job is still solving.
+            return b'{"inputs": ' + job["inputs"] + \
+                b', "outputs": {"Scenario": {"status": "Optimizing..."}}, ' \
+                b'"messages": {}}'
+
+        with self._lock:
+            self.counts["finished"] += 1
+        inputs = json.loads(job["inputs"])
+        if job["optimal"]:
+            outputs = make_outputs(inputs, run_uuid)
+            messages = {}
+        else:
+            outputs = {"Scenario": {
+                "status": "not optimal", "run_uuid": run_uuid, "Site": {}}}
+            messages = {"error": "Problem is infeasible."}
+        add_tariff_inputs(inputs)
+        return json.dumps({
+            "inputs": inputs, "outputs": outputs, "messages": messages,
+        }).encode("utf-8")
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_mock = None
+    _remaining = None
+
+    def do_POST(self):
+        path, _, query = self.path.partition("?")
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self._throttled():
+            return
+        if not SUBMIT_PATH.match(path):
+            return self._send(404, {"messages": {"error": "Not found"}})
+        if "api_key=" not in query:
+            return self._send(403, {"error": {"code": "API_KEY_MISSING"}})
+        try:
+            if "Scenario" not in json.loads(body):
+                raise ValueError
+        except ValueError:
+            return self._send(
+                400, {"messages": {"input_errors": ["Invalid payload"]}})
+
+        run_uuid = self.server_mock.submit(body)
+        if run_uuid is None:
+            return self._send(
+                500, {"messages": {"error": "Internal Server Error"}})
+        self._send(201, {"run_uuid": run_uuid})
+
+    def do_GET(self):
+        if self._throttled():
+            return
+        match = RESULTS_PATH.match(self.path.partition("?")[0])
+        if match is None:
+            return self._send(404, {"messages": {"error": "Not found"}})
+        body = self.server_mock.results(match.group(1))
+        if body is None:
+            return self._send(
+                404, {"messages": {"error": "run_uuid not found"}})
+        self._send(200, body)
+
+    def _throttled(self):
+        """
+        Reject the request with a 429 if it's over the rate limit.
+
+        :return: True if the request was rejected.
+        """
+        self._remaining, retry_after = self.server_mock.check_rate_limit()
+        if retry_after is None:
+            return False
+        self._send(429, {"error": {
+            "code": "OVER_RATE_LIMIT",
+            "message": "You have exceeded your rate limit.",
+        }}, {"Retry-After": str(math.ceil(retry_after))})
+        return True
+
+    def _send(self, status, body, headers={}):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        if self.server_mock.rate_limit:
+            self.send_header(
+                "X-RateLimit-Limit", str(self.server_mock.rate_limit))
+            self.send_header("X-RateLimit-Remaining", str(self._remaining))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # Clients stop reading "Optimizing..." responses early.
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+def add_tariff_inputs(inputs):
+    """
+    Fill in the tariff details REopt adds to the inputs from URDB.
+    """
+    tariff = inputs["Scenario"]["Site"].setdefault("ElectricTariff", {})
+    label = tariff.get("urdb_label", "mock")
+    tariff.setdefault("urdb_response", {"label": label, "name": "Mock Rate"})
+    tariff.setdefault("urdb_utility_name", "Mock Utility")
+    tariff.setdefault("urdb_rate_name", "Mock Rate")
+    tariff.setdefault("net_metering_limit_kw", 0)
+    inputs["Scenario"]["Site"].setdefault("Storage", {}).setdefault(
+        "total_rebate_us_dollars_per_kwh", 0)
+
+
+def make_outputs(inputs, run_uuid):
+    """
+    Make plausible optimal outputs with the time series REopt returns.
+    """
+    scenario = inputs["Scenario"]
+    steps_per_hour = scenario.get("time_steps_per_hour", 1)
+    loads = np.asarray(
+        scenario["Site"].get("LoadProfile", {}).get("loads_kw")
+        or np.ones(8760 * steps_per_hour), dtype=float)
+    hours = np.arange(len(loads)) / steps_per_hour % 24
+    # PV follows the sun between 6 am and 6 pm.
+    pv_kw = 5.0
+    pv = np.round(pv_kw * np.clip(np.sin((hours - 6) / 12 * np.pi), 0, None),
+                  3)
+    pv_to_load = np.minimum(pv, loads)
+    pv_excess = pv - pv_to_load
+    pv_to_battery = np.round(pv_excess * 0.5, 3)
+    pv_to_grid = np.round(pv_excess - pv_to_battery, 3)
+    battery_to_load = np.round(np.minimum(loads - pv_to_load, 0.5), 3)
+    zeros = np.zeros(len(loads))
+    annual_kwh = float(loads.sum() / steps_per_hour)
+
+    return {"Scenario": {
+        "status": "optimal",
+        "run_uuid": run_uuid,
+        "Site": {
+            "LoadProfile": {
+                "annual_calculated_kwh": round(annual_kwh, 2),
+                "year_one_electric_load_series_kw": loads.round(3).tolist(),
+            },
+            "PV": {
+                "size_kw": pv_kw,
+                "average_yearly_energy_produced_kwh": round(
+                    float(pv.sum() / steps_per_hour), 2),
+                "average_yearly_energy_exported_kwh": round(
+                    float(pv_to_grid.sum() / steps_per_hour), 2),
+                "year_one_power_production_series_kw": pv.tolist(),
+                "year_one_to_battery_series_kw": pv_to_battery.tolist(),
+                "year_one_to_load_series_kw": pv_to_load.round(3).tolist(),
+                "year_one_to_grid_series_kw": pv_to_grid.tolist(),
+                "year_one_curtailed_production_series_kw": zeros.tolist(),
+            },
+            "Storage": {
+                "size_kw": 0.5,
+                "size_kwh": 2.0,
+                "year_one_to_load_series_kw": battery_to_load.tolist(),
+                "year_one_to_grid_series_kw": zeros.tolist(),
+                "year_one_soc_series_pct": np.full(
+                    len(loads), 0.5).tolist(),
+            },
+            "ElectricTariff": {
+                "year_one_to_load_series_kw": np.round(
+                    loads - pv_to_load - battery_to_load, 3).tolist(),
+                "year_one_energy_cost_us_dollars": round(annual_kwh * 0.2, 2),
+            },
+            "Financial": {
+                "npv_us_dollars": round(annual_kwh * 0.05, 2),
+                "lcc_us_dollars": round(annual_kwh * 2.5, 2),
+            },
+        },
+    }}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a mock REopt API.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', default=8765, type=int)
+    parser.add_argument('--latency', default=5, type=float,
+                        help="Median seconds for a job to solve.")
+    parser.add_argument('--spread', default=0.5, type=float,
+                        help="Standard deviation of the log solve time.")
+    parser.add_argument('--failure-rate', default=0, type=float,
+                        help="Fraction of submissions that fail with a 500.")
+    parser.add_argument('--non-optimal-rate', default=0, type=float,
+                        help="Fraction of jobs that aren't optimal.")
+    parser.add_argument('--rate-limit', default=0, type=int,
+                        help="Number of requests allowed per rate window, "
+                             "0 for no limit.")
+    parser.add_argument('--rate-window', default=3600, type=float,
+                        help="Seconds in the rate limit's sliding window.")
+    parser.add_argument('--seed', type=int,
+                        help="Seed for the solve times and outcomes.")
+    args = parser.parse_args()
+
+    mock = MockReopt(
+        args.host, args.port, latency=args.latency, spread=args.spread,
+        failure_rate=args.failure_rate,
+        non_optimal_rate=args.non_optimal_rate, rate_limit=args.rate_limit,
+        rate_window=args.rate_window, seed=args.seed)
+    print(f"Mock REopt listening on {mock.url}")
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock.server.server_close()
@@ -0,0 +1,157 @@
+"""
+Read only selected keys out of a JSON document.
+
+REopt results are mostly 8760-long time series, and parsing all of them into
+Python lists takes most of the time and memory of reading a result when only
+a few scalars are wanted. `loads` walks the document text instead, decodes
+just the values at the requested key paths, and jumps over everything else
+without building it:
+
+    >>> loads('{"a": {"b": 1, "c": [1, 2, 3]}, "d": 2}', [("a", "b")])
+    {'a': {'b': 1}}
+
+The result has the same nesting as the full document, so code written for the
+full document works on it unchanged as long as it only reads the selected
+keys.
+"""
+import json
+import re
+from json.decoder import scanstring
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Characters that open or close a container or a string.
+_STRUCTURE = re.compile(r'[\[\]{}"]')
+# Rest of a string after its opening quote.
+_STRING_END = re.compile(r'(?:[^"\\]|\\.)*"', re.DOTALL)
+# A number, true, false or null.
+_SCALAR = re.compile(r"[^,\]}\s]+")
+
+_decoder = json.JSONDecoder()
+
+
+def load(fp, paths):
+    """
+    Read the values at *paths* from a JSON file object.
+
+    :param fp: File object opened in text mode.
+    :param paths: Iterable of key tuples, e.g. [("outputs", "Scenario")].
+    :rtype: dict
+    """
+    return loads(fp.read(), paths)
+
+
+def loads(s, paths):
+    """
+    Read the values at *paths* from a JSON document string.
+
+    Keys on a path that aren't in the document, or that don't hold an object
+    where the path continues, are left out of the result.
+
+    :param str s: JSON document, whose top level must be an object.
+    :param paths: Iterable of key tuples.
+    :rtype: dict
+    """
+    i = _skip_whitespace(s, 0)
+    if s[i:i + 1] != "{":
+        raise json.JSONDecodeError("Expecting object", s, i)
+    result, _ = _select(s, i, make_tree(paths))
+    return result
+
+
+def make_tree(paths):
+    """
+    Turn key paths into a nested dict of the keys to descend into. A value of
+    None means the whole value under that key is wanted.
+    """
+    tree = {}
+    for path in paths:
+        node = tree
+        for key in path[:-1]:
+            child = node.setdefault(key, {})
+            if child is None:
+                # A shorter path already selects the whole value.
+                break
+            node = child
+        else:
+            node[path[-1]] = None
+    return tree
+
+
+def _skip_whitespace(s, i):
+    return _WHITESPACE.match(s, i).end()
+
+
+def _select(s, i, tree):
+    """
+    Read the wanted keys of the object starting at s[i].
+
+    :return: Tuple of the selected dict and the index after the object.
+    """
+    result = {}
+    i = _skip_whitespace(s, i + 1)
+    if s[i:i + 1] == "}":
+        return result, i + 1
+    while True:
+        if s[i:i + 1] != '"':
+            raise json.JSONDecodeError("Expecting property name", s, i)
+        key, i = scanstring(s, i + 1)
+        i = _skip_whitespace(s, i)
+        if s[i:i + 1] != ":":
+            raise json.JSONDecodeError("Expecting ':' delimiter", s, i)
+        i = _skip_whitespace(s, i + 1)
+
+        if key not in tree:
+            i = _skip_value(s, i)
+        elif tree[key] is None:
+            result[key], i = _decoder.raw_decode(s, i)
+        elif s[i:i + 1] == "{":
+            result[key], i = _select(s, i, tree[key])
+        else:
+            i = _skip_value(s, i)
+
+        i = _skip_whitespace(s, i)
+        if s[i:i + 1] == ",":
+            i = _skip_whitespace(s, i + 1)
+        elif s[i:i + 1] == "}":
+            return result, i + 1
+        else:
+            raise json.JSONDecodeError("Expecting ',' delimiter", s, i)
+
+
+def _skip_value(s, i):
+    """
+    Return the index after the value starting at s[i], without decoding it.
+    """
+    char = s[i:i + 1]
+    if char == '"':
+        return _string_end(s, i + 1)
+    if char not in ("[", "{"):
+        match = _SCALAR.match(s, i)
+        if match is None:
+            raise json.JSONDecodeError("Expecting value", s, i)
+        return match.end()
+
+    # Jump from bracket to bracket, skipping over strings. Arrays of numbers
+    # are passed over in one search.
+    depth = 0
+    while True:
+        match = _STRUCTURE.search(s, i)
+        if match is None:
+            raise json.JSONDecodeError("Unterminated container", s, i)
+        char = match.group()
+        i = match.end()
+        if char == '"':
+            i = _string_end(s, i)
+        elif char in "[{":
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return i
+
+
+def _string_end(s, i):
+    match = _STRING_END.match(s, i)
+    if match is None:
+        raise json.JSONDecodeError("Unterminated string", s, i - 1)
+    return match.end()
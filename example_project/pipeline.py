@@ -0,0 +1,193 @@
+"""
+Run items through a chain of stages, each on its own pool of threads.
+
+Stages are connected by bounded queues, so every stage works on a different
+item at the same time and a slow stage holds back the stages before it
+instead of letting their output pile up in memory. Threads suit stages that
+wait on subprocesses or the network, which release the GIL while they wait.
+
+    pipeline = Pipeline([
+        Stage("download", download, workers=8),
+        Stage("parse", parse, workers=2, fan_out=True),
+    ])
+    records = pipeline.run(urls)
+    print(pipeline.report())
+"""
+import queue
+import threading
+import time
+
+# Put on a stage's queue once for each of its workers when there are no more
+# items.
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a Pipeline, with statistics on how its workers spent their
+    time.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=8, fan_out=False):
+        """
+        :param str name: Name of the stage in the report.
+        :param func: Called with each item. Returns the item to pass to the
+            next stage, or None to drop it.
+        :param int workers: Number of threads calling *func*.
+        :param int queue_size: Number of items that can wait for the stage.
+        :param bool fan_out: *func* returns an iterable of items to pass on
+            instead of a single item.
+        """
+        if workers < 1:
+            raise ValueError(f"Stage {name} needs at least one worker")
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue_size = queue_size
+        self.fan_out = fan_out
+        # Statistics, updated as the pipeline runs.
+        self.items = 0
+        self.outputs = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def process(self, item):
+        """
+        Run the stage on an item, yielding the items to pass on as they're
+        made.
+
+        If *func* raises, the error is recorded after the items it had
+        already made are passed on. The time the caller takes between items,
+        like waiting for room on the next queue, doesn't count as busy.
+        """
+        start = time.monotonic()
+        paused = 0.0
+        outputs = 0
+        try:
+            output = self.func(item)
+            if not self.fan_out:
+                output = [output]
+            for o in output:
+                if o is None:
+                    continue
+                outputs += 1
+                yielded = time.monotonic()
+                yield o
+                paused += time.monotonic() - yielded
+        except Exception as e:
+            with self._lock:
+                self.errors.append((item, e))
+        with self._lock:
+            self.items += 1
+            self.outputs += outputs
+            self.busy += time.monotonic() - start - paused
+
+    def summary(self, seconds):
+        """
+        Describe how the stage's workers spent *seconds* of wall time: busy
+        running the stage, blocked on a full queue to the next stage or idle
+        waiting for items.
+        """
+        capacity = self.workers * seconds or 1
+        idle = max(0.0, capacity - self.busy - self.blocked)
+        return (
+            f"{self.name}: {self.workers} workers, {self.items} in, "
+            f"{self.outputs} out, {len(self.errors)} errors, "
+            f"{round(self.busy / capacity * 100)}% busy, "
+            f"{round(self.blocked / capacity * 100)}% blocked, "
+            f"{round(idle / capacity * 100)}% idle"
+        )
+
+
+class Pipeline:
+    """
+    Chain of Stages, each feeding the next through a bounded queue.
+    """
+
+    def __init__(self, stages):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = stages
+        self.seconds = 0.0
+
+    @property
+    def errors(self):
+        """
+        List of (stage name, item, exception) for the items that raised.
+        """
+        return [
+            (stage.name, item, e)
+            for stage in self.stages for item, e in stage.errors
+        ]
+
+    def run(self, items):
+        """
+        Push the items through every stage, blocking until they're through.
+
+        An item whose stage raises is recorded in `errors` and dropped. The
+        items a fan-out stage made from it before raising are still passed on.
+
+        :return: list of the items out of the last stage, in the order they
+            finished
+        """
+        queues = [queue.Queue(stage.queue_size) for stage in self.stages]
+        # The output of the last stage isn't bounded since nothing takes from
+        # it until the end.
+        queues.append(queue.Queue())
+        remaining = [stage.workers for stage in self.stages]
+        remaining_lock = threading.Lock()
+
+        def work(i):
+            stage = self.stages[i]
+            inputs, outputs = queues[i], queues[i + 1]
+            while True:
+                item = inputs.get()
+                if item is _DONE:
+                    break
+                for output in stage.process(item):
+                    start = time.monotonic()
+                    outputs.put(output)
+                    with stage._lock:
+                        stage.blocked += time.monotonic() - start
+            with remaining_lock:
+                remaining[i] -= 1
+                last = remaining[i] == 0
+            # The last worker of a stage to finish tells the next stage.
+            if last and i + 1 < len(self.stages):
+                for _ in range(self.stages[i + 1].workers):
+                    outputs.put(_DONE)
+
+        start = time.monotonic()
+        threads = [
+            threading.Thread(
+                target=work, args=(i,), daemon=True,
+                name=f"{stage.name}-{n}")
+            for i, stage in enumerate(self.stages)
+            for n in range(stage.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for item in items:
+            queues[0].put(item)
+        for _ in range(self.stages[0].workers):
+            queues[0].put(_DONE)
+        for thread in threads:
+            thread.join()
+        self.seconds = time.monotonic() - start
+
+        results = []
+        while not queues[-1].empty():
+            results.append(queues[-1].get())
+        return results
+
+    def report(self):
+        """
+        Return a summary of each stage's utilization.
+        """
+        lines = [f"Pipeline finished in {round(self.seconds, 1)} seconds"]
+        lines += [
+            "  " + stage.summary(self.seconds) for stage in self.stages
+        ]
+        return "\n".join(lines)
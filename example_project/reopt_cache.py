@@ -0,0 +1,322 @@
+"""
+Content-addressed cache of REopt results.
+
+Results are keyed on a hash of the full REopt payload, so two payloads only
+share an entry if they would have sent REopt exactly the same request, no
+matter which scenario or template they came from.
+
+Layout of the cache folder:
+    index.json              entry sizes and usage, plus hit/miss totals
+    objects/ab/abcdef...json    REopt results for payload hash abcdef...
+"""
+import hashlib
+import json
+import math
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+import partial_json
+
+# Default maximum size of the cache, in bytes.
+DEFAULT_MAX_BYTES = 20 * 10**9
+
+# Number of entries to add between writes of the index. Results whose entry
+# was lost before the index was written are indexed again when looked up.
+FLUSH_EVERY = 100
+
+
+def canonical_json(payload):
+    """
+    Serialize the payload the same way every time: sorted keys, no
+    whitespace and arrays as plain lists.
+    """
+    return json.dumps(
+        payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False,
+        default=json_default
+    )
+
+
+def payload_hash(payload):
+    """
+    Return the SHA-256 hex digest of the canonical payload.
+    """
+    return hashlib.sha256(canonical_json(payload).encode("utf-8")).hexdigest()
+
+
+def json_default(obj):
+    """
+    JSON encoder fallback for NumPy arrays and scalars.
+    """
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON "
+                    "serializable")
+
+
+def results_match(payload, filename):
+    """
+    Return True if the REopt results in *filename* were made from the
+    payload, going by the inputs REopt echoes back in them.
+
+    REopt fills in defaults and adds details to the inputs it echoes, so only
+    the values the payload sets are compared, numbers to within rounding.
+    Results that are missing, unreadable or without inputs never match.
+    """
+    try:
+        with open(filename, "r") as f:
+            inputs = partial_json.load(f, [("inputs",)]).get("inputs")
+    except (OSError, ValueError):
+        return False
+    if inputs is None:
+        return False
+    return _echoed(json.loads(canonical_json(payload)), inputs)
+
+
+def _echoed(sent, echoed):
+    """
+    Return True if every value set in *sent* is the same in *echoed*.
+    """
+    if isinstance(sent, dict):
+        return isinstance(echoed, dict) and all(
+            key in echoed and _echoed(value, echoed[key])
+            for key, value in sent.items())
+    if isinstance(sent, list):
+        if not isinstance(echoed, list) or len(sent) != len(echoed):
+            return False
+        if all(map(_is_number, sent)) and all(map(_is_number, echoed)):
+            # Loads are compared as arrays, since there are thousands.
+            return not sent or bool(np.allclose(
+                sent, echoed, rtol=1e-6, atol=1e-9))
+        return all(map(_echoed, sent, echoed))
+    if _is_number(sent) and _is_number(echoed):
+        return math.isclose(sent, echoed, rel_tol=1e-6, abs_tol=1e-9)
+    return sent == echoed
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class ReoptCache:
+    """
+    Store REopt results keyed on the payload that produced them.
+
+    Entries are evicted least recently used first once the cache is larger
+    than *max_bytes*. Safe to use from multiple threads of one process.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param str path: Cache folder
+        :param int max_bytes: Maximum total size of the cached results.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        # Hits and misses of this instance.
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._unflushed = 0
+
+        os.makedirs(os.path.join(self.path, "objects"), exist_ok=True)
+        try:
+            with open(self.index_filename, "r") as f:
+                self._index = json.load(f)
+        except FileNotFoundError:
+            self._index = {"entries": {}, "hits": 0, "misses": 0}
+
+    @property
+    def index_filename(self):
+        return os.path.join(self.path, "index.json")
+
+    def object_filename(self, key):
+        return os.path.join(self.path, "objects", key[:2], key + ".json")
+
+    @property
+    def size(self):
+        """
+        Total size of the cached results in bytes.
+        """
+        with self._lock:
+            return sum(e["size"] for e in self._index["entries"].values())
+
+    def __len__(self):
+        return len(self._index["entries"])
+
+    def __contains__(self, payload):
+        """
+        Return True if the payload has results cached. Doesn't count as a hit
+        or miss.
+        """
+        return os.path.exists(self.object_filename(payload_hash(payload)))
+
+    def lookup(self, payload, key=None):
+        """
+        Return the filename of the cached results for the payload, or None.
+
+        :param str key: Hash key of the payload if it's already known.
+        """
+        if key is None:
+            key = payload_hash(payload)
+        filename = self.object_filename(key)
+        with self._lock:
+            entry = self._index["entries"].get(key)
+            if entry is None and os.path.exists(filename):
+                # Added by a run that stopped before writing the index.
+                entry = self._index["entries"][key] = self._entry(filename)
+            if entry is None or not os.path.exists(filename):
+                self._index["entries"].pop(key, None)
+                self.misses += 1
+                self._index["misses"] += 1
+                self._dirty = True
+                return None
+            entry["hits"] += 1
+            entry["last_used"] = time.time()
+            self.hits += 1
+            self._index["hits"] += 1
+            self._dirty = True
+        return filename
+
+    def get(self, payload):
+        """
+        Return the cached results dictionary for the payload, or None.
+        """
+        filename = self.lookup(payload)
+        if filename is None:
+            return None
+        with open(filename, "r") as f:
+            return json.load(f)
+
+    def fetch(self, payload, output_filepath):
+        """
+        Copy the cached results for the payload to *output_filepath*.
+
+        Results already at *output_filepath* that aren't cached, like the
+        results written before there was a cache, are added to the cache
+        instead and count as a hit, if the inputs echoed in them match the
+        payload (see `results_match`). Results of a payload that has changed
+        since are a miss, and are overwritten once the job is run again.
+
+        :return: True if the payload was cached or its results were already
+            at *output_filepath*.
+        """
+        key = payload_hash(payload)
+        filename = self.object_filename(key)
+        if not os.path.exists(filename) and \
+                results_match(payload, output_filepath):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            temp_filename = self._temp_filename(filename)
+            shutil.copyfile(output_filepath, temp_filename)
+            os.replace(temp_filename, filename)
+            with self._lock:
+                self.hits += 1
+                self._index["hits"] += 1
+            self._add_entry(key, hits=1)
+            return True
+
+        filename = self.lookup(payload, key)
+        if filename is None:
+            return False
+        os.makedirs(os.path.dirname(output_filepath) or ".", exist_ok=True)
+        shutil.copyfile(filename, output_filepath)
+        return True
+
+    def put(self, payload, results, key=None):
+        """
+        Add the REopt results for the payload, evicting old entries if the
+        cache is over its size limit.
+
+        :param str key: Hash key of the payload if it's already known, in
+            which case the payload isn't needed.
+        :return: Hash key of the payload
+        """
+        if key is None:
+            key = payload_hash(payload)
+        filename = self.object_filename(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # Write to a temporary file first so readers never see a partial file.
+        temp_filename = self._temp_filename(filename)
+        with open(temp_filename, "w") as f:
+            json.dump(results, f)
+        os.replace(temp_filename, filename)
+        self._add_entry(key)
+        return key
+
+    def _temp_filename(self, filename):
+        return f"{filename}.{os.getpid()}.{threading.get_ident()}"
+
+    def _entry(self, filename, hits=0):
+        now = time.time()
+        return {
+            "size": os.path.getsize(filename),
+            "created": now,
+            "last_used": now,
+            "hits": hits,
+        }
+
+    def _add_entry(self, key, hits=0):
+        """
+        Index the results written for a key, writing the index every
+        FLUSH_EVERY entries.
+        """
+        with self._lock:
+            self._index["entries"][key] = self._entry(
+                self.object_filename(key), hits)
+            self._evict()
+            self._dirty = True
+            self._unflushed += 1
+            flush = self._unflushed >= FLUSH_EVERY
+        if flush:
+            self.flush()
+
+    def _evict(self):
+        """
+        Remove least recently used entries until the cache fits. Must be
+        called with the lock held.
+        """
+        entries = self._index["entries"]
+        total = sum(e["size"] for e in entries.values())
+        if total <= self.max_bytes:
+            return
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            total -= entries.pop(key)["size"]
+            try:
+                os.remove(self.object_filename(key))
+            except FileNotFoundError:
+                pass
+
+    def flush(self):
+        """
+        Write the index to disk if it has changed.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            temp_filename = f"{self.index_filename}.{os.getpid()}"
+            with open(temp_filename, "w") as f:
+                json.dump(self._index, f)
+            os.replace(temp_filename, self.index_filename)
+            self._dirty = False
+            self._unflushed = 0
+
+    def close(self):
+        """
+        Write the index to disk if it has changed.
+        """
+        self.flush()
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups * 100 if lookups else 0
+        return (
+            f"REopt cache: {self.hits} hits, {self.misses} misses "
+            f"({round(hit_rate, 1)}% hit rate), {len(self)} entries, "
+            f"{round(self.size / 10**6, 1)} MB"
+        )
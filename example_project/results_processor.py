@@ -1,18 +1,61 @@
 """
 Functionality to aid in processing results.
 """
+import concurrent.futures
 import functools
 from glob import glob
 import itertools
 import os
+import pickle
 import re
 
+import numpy as np
 import pandas as pd
 import ujson as json
 
+import feature_reports
+import partial_json
+
+# Time series in the REopt outputs, by metric name, as keys under
+# outputs.Scenario.Site.
+REOPT_SERIES = {
+    "load_profile": ("LoadProfile", "year_one_electric_load_series_kw"),
+    "pv_power_production": ("PV", "year_one_power_production_series_kw"),
+    "pv_to_battery": ("PV", "year_one_to_battery_series_kw"),
+    "pv_to_load": ("PV", "year_one_to_load_series_kw"),
+    "pv_to_grid": ("PV", "year_one_to_grid_series_kw"),
+    "pv_curtailed": ("PV", "year_one_curtailed_production_series_kw"),
+    "storage_to_load": ("Storage", "year_one_to_load_series_kw"),
+    "storage_to_grid": ("Storage", "year_one_to_grid_series_kw"),
+}
+
+# Paths of the scalar values read by `Results.extract_reopt_metrics`.
+REOPT_METRIC_PATHS = [
+    ("outputs", "Scenario", "Site", "PV", "size_kw"),
+    ("outputs", "Scenario", "Site", "PV",
+     "average_yearly_energy_produced_kwh"),
+    ("outputs", "Scenario", "Site", "PV",
+     "average_yearly_energy_exported_kwh"),
+    ("outputs", "Scenario", "Site", "Storage", "size_kw"),
+    ("outputs", "Scenario", "Site", "Storage", "size_kwh"),
+    ("outputs", "Scenario", "Site", "LoadProfile", "annual_calculated_kwh"),
+    ("outputs", "Scenario", "Site", "Financial", "npv_us_dollars"),
+    ("inputs", "Scenario", "Site", "ElectricTariff", "urdb_response",
+     "label"),
+    ("inputs", "Scenario", "Site", "ElectricTariff", "urdb_utility_name"),
+    ("inputs", "Scenario", "Site", "ElectricTariff", "urdb_rate_name"),
+    ("inputs", "Scenario", "Site", "ElectricTariff", "net_metering_limit_kw"),
+    ("inputs", "Scenario", "Site", "Storage",
+     "total_rebate_us_dollars_per_kwh"),
+    ("inputs", "Scenario", "time_steps_per_hour"),
+]
+
 
 class Results:
 
+    # Version of the snapshot format written by `to_snapshot`.
+    SNAPSHOT_VERSION = 2
+
     def __init__(self, results_dir, run_dir):
         """
         :param str results_dir: REopt output folder
@@ -23,30 +66,143 @@ class Results:
         self.results_dir = results_dir
         self.run_dir = run_dir
         self._scenarios = {}
+        self._catalog = ScenarioCatalog(run_dir, self.load_scenario)
+        # (mtime, size) of each REopt run JSON when it was read, to tell if it
+        # has changed since.
+        self._file_ids = {}
+        # Keyword arguments of each call to `load`, so they can be redone.
+        self._loads = []
+        # Compact frame of the scalar results, rebuilt when they change.
+        self._frame = None
+
+    @classmethod
+    def from_pickle(cls, filepath, refresh=True):
+        """
+        Load results from a snapshot written by `to_snapshot`.
 
-    def to_dataframe(self, selections={}, scenarios=[]):
+        :param str filepath: Snapshot file
+        :param bool refresh: Re-read REopt results that were added or changed
+            since the snapshot was taken.
+        :raises ValueError: If the file isn't a snapshot of this version,
+            like a Results object pickled before there were snapshots.
+        """
+        rebuild = (
+            "Delete it, load the results again and save them with "
+            "to_snapshot.")
+        try:
+            with open(filepath, "rb") as f:
+                snapshot = pickle.load(f)
+        except (AttributeError, ImportError, pickle.UnpicklingError) as e:
+            raise ValueError(
+                f"{filepath} isn't a Results snapshot: {e}. {rebuild}") from e
+        if not isinstance(snapshot, dict):
+            raise ValueError(
+                f"{filepath} is a pickled {type(snapshot).__name__}, not a "
+                f"Results snapshot. {rebuild}")
+        if snapshot.get("version") != cls.SNAPSHOT_VERSION:
+            raise ValueError(
+                f"{filepath} has snapshot version {snapshot.get('version')}, "
+                f"expected {cls.SNAPSHOT_VERSION}. {rebuild}")
+
+        results = cls(snapshot["results_dir"], snapshot["run_dir"])
+        results._results = snapshot["results"]
+        results._scenarios = snapshot["scenarios"]
+        results._file_ids = snapshot["file_ids"]
+        results._loads = snapshot["loads"]
+        if refresh:
+            results.refresh()
+        return results
+
+    def to_snapshot(self, filepath):
+        """
+        Save the loaded results so they can be reopened with `from_pickle`.
+        """
+        snapshot = {
+            "version": self.SNAPSHOT_VERSION,
+            "results_dir": self.results_dir,
+            "run_dir": self.run_dir,
+            "results": self._results,
+            "scenarios": self._scenarios,
+            "file_ids": self._file_ids,
+            "loads": self._loads,
+        }
+        # Write to a temporary file so a failed write doesn't clobber the
+        # last snapshot.
+        with open(filepath + ".tmp", "wb") as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(filepath + ".tmp", filepath)
+
+    def refresh(self, workers=1, executor="process", streaming=True):
+        """
+        Re-read REopt results that were added or changed since they were
+        loaded, and drop the ones that were deleted.
+
+        :param int workers: Number of REopt JSONs to read at once.
+        :param str executor: `process` or `thread` pool for the workers.
+        :param bool streaming: Only parse the parts of the JSONs that are used.
+        """
+        for reopt_run in list(self._results):
+            if not os.path.exists(reopt_run):
+                del self._results[reopt_run]
+                self._file_ids.pop(reopt_run, None)
+                self._frame = None
+        for kwargs in list(self._loads):
+            self.load(**kwargs, workers=workers, executor=executor,
+                      streaming=streaming)
+
+    def to_dataframe(self, selections={}, scenarios=[], load_series=False):
         """
         :param dict selections: Filter of column and column values that
             must all satisfied, e.g. {"location": "San Diego"} will only return
             entries in San Diego.
         :param lst scenarios: List of scenario IDs that must be matched
+        :param load_series: Add the timeseries columns for the selected runs.
+            True for all of them, or a list of the names in `REOPT_SERIES`.
         """
-        frame = pd.DataFrame.from_dict(self._results, orient='index')
+        frame = self.compact_frame()
 
+        # Combine all the filters into one mask so the frame is only indexed
+        # once.
+        mask = np.ones(len(frame), dtype=bool)
         if scenarios:
-            indices = []
-            for scenario_id in scenarios:
-                indices.append(frame['scenario_id'] == scenario_id)
-            frame = frame.loc[
-                functools.reduce(lambda x, y: x | y, indices)
-            ]
+            mask &= frame['scenario_id'].isin(scenarios).to_numpy()
+        for k, v in selections.items():
+            mask &= (frame[k] == v).to_numpy()
+        frame = frame.loc[mask] if not mask.all() else frame.copy()
 
-        # Select columns that match all the criteria.
-        if selections:
-            for k, v in selections.items():
-                frame = frame.loc[frame[k] == v]
+        for name in series_names(load_series):
+            frame[name] = [self._results[run].get(name) for run in frame.index]
         return frame
 
+    def compact_frame(self):
+        """
+        Return a frame of the scalar metrics of every loaded run, indexed by
+        the REopt JSON path.
+
+        Text columns are categoricals and integer columns are downcast to the
+        smallest dtype that holds them. The frame is cached until the loaded
+        results change, so don't modify it.
+        """
+        if self._frame is not None:
+            return self._frame
+
+        series = set(REOPT_SERIES)
+        columns = {}
+        for run_metrics in self._results.values():
+            for column in run_metrics:
+                if column not in series:
+                    columns.setdefault(column, None)
+        index = pd.Index(list(self._results))
+        data = {
+            column: compact_series(pd.Series(
+                [run_metrics.get(column)
+                 for run_metrics in self._results.values()],
+                index=index))
+            for column in columns
+        }
+        self._frame = pd.DataFrame(data, index=index)
+        return self._frame
+
     def to_scenario_dataframe(self, selections={}):
         """
         Return DataFrame of scenario data matching the parameters in *selections*
@@ -55,7 +211,8 @@ class Results:
         pass
 
     def load(self, scenario_pattern="", reopt_pattern="",
-             default_schedules_only=False):
+             default_schedules_only=False, load_series=False, workers=1,
+             executor="process", streaming=True):
         """
         Load all results from the REopt and scenario directory.
 
@@ -63,7 +220,24 @@ class Results:
             the filepath
         :param str scenario_pattern: Pattern matching for the scenario
         :param str reopt_pattern: Pattern matching for reopt
+        :param load_series: Load the timeseries data. True for all of them,
+            or a list of the names in `REOPT_SERIES` to load.
+        :param int workers: Number of REopt JSONs to read at once.
+        :param str executor: Read the JSONs on a pool of `process`es or
+            `thread`s if workers > 1.
+        :param bool streaming: Only parse the parts of the JSONs that are
+            used, instead of the whole document.
         """
+        kwargs = {
+            "scenario_pattern": scenario_pattern,
+            "reopt_pattern": reopt_pattern,
+            "default_schedules_only": default_schedules_only,
+            "load_series": load_series,
+        }
+        if kwargs not in self._loads:
+            self._loads.append(kwargs)
+
+        pending = []
         scenarios = os.listdir(self.results_dir)
         for scenario in scenarios:
             if scenario_pattern and re.match(scenario_pattern, scenario) is None:
@@ -71,35 +245,86 @@ class Results:
             elif "default" not in scenario and default_schedules_only:
                 continue
             print(f'loading runs for {scenario}...')
-            self.load_reopt_runs(scenario, reopt_pattern)
+            pending.extend(
+                self._changed_runs(scenario, reopt_pattern, load_series))
+        self._read_runs(pending, load_series, workers, executor, streaming)
 
-    def load_reopt_runs(self, scenario_id, reopt_pattern=""):
+    def load_reopt_runs(self, scenario_id, reopt_pattern="", load_series=False,
+                        workers=1, executor="process", streaming=True):
         """
         Load all reopt runs associated with the scenario ID.
 
         :param str reopt_pattern: Regex matching for fill reopt filepath.
         """
+        self._read_runs(
+            self._changed_runs(scenario_id, reopt_pattern, load_series),
+            load_series, workers, executor, streaming
+        )
+
+    def _changed_runs(self, scenario_id, reopt_pattern="", load_series=False):
+        """
+        Return a list of (scenario ID, REopt JSON path, file ID) for the REopt
+        runs of the scenario that haven't been read since they last changed,
+        or were read without the wanted series.
+        """
+        series = series_names(load_series)
         reopt_scenario_dir = os.path.join(self.results_dir, scenario_id)
 
-        scenario_params = self.load_scenario(scenario_id)
+        # Make sure the scenario has a description before reading any runs.
+        self.load_scenario(scenario_id)
 
+        changed = []
         for reopt_run in sorted(
                 self.get_leaf_jsons(reopt_scenario_dir)):
             if reopt_pattern and re.match(reopt_pattern, reopt_run) is None:
                 continue
 
-            if reopt_run in self._results:
+            # Skip runs that haven't changed since they were read.
+            stat = os.stat(reopt_run)
+            file_id = (stat.st_mtime_ns, stat.st_size)
+            if self._file_ids.get(reopt_run) == file_id and \
+                    reopt_run in self._results and all(
+                        self._results[reopt_run][name] is not None
+                        for name in series):
                 continue
+            changed.append((scenario_id, reopt_run, file_id))
+        return changed
 
-            with open(reopt_run, "r") as f:
-                reopt_results = json.load(f)
+    def _read_runs(self, runs, load_series=False, workers=1,
+                   executor="process", streaming=True):
+        """
+        Read the metrics of the REopt runs from `_changed_runs`.
 
+        With more than one worker the JSONs are parsed on a pool, and only the
+        extracted metrics are sent back.
+        """
+        filepaths = [reopt_run for _, reopt_run, _ in runs]
+        read = functools.partial(
+            read_reopt_metrics, load_series=load_series, streaming=streaming)
+        if workers > 1 and len(runs) > 1:
+            if executor == "process":
+                pool = concurrent.futures.ProcessPoolExecutor(workers)
+            elif executor == "thread":
+                pool = concurrent.futures.ThreadPoolExecutor(workers)
+            else:
+                raise ValueError(f"Unknown executor: {executor}")
+            chunksize = max(1, min(64, len(runs) // (workers * 4)))
+            with pool:
+                metrics = list(pool.map(
+                    read, filepaths, chunksize=chunksize))
+        else:
+            metrics = map(read, filepaths)
+
+        for (scenario_id, reopt_run, file_id), run_metrics in zip(
+                runs, metrics):
             building_id = os.path.split(os.path.split(reopt_run)[0])[1]
 
             self._results[reopt_run] = {
-                **scenario_params, **self.extract_reopt_metrics(reopt_results),
+                **self.load_scenario(scenario_id), **run_metrics,
                 "building_id": building_id, "scenario_id": scenario_id
             }
+            self._file_ids[reopt_run] = file_id
+            self._frame = None
 
     @staticmethod
     def get_leaf_jsons(path):
@@ -150,6 +375,10 @@ class Results:
             scenario_json['features'][1]['properties'].get(
                 'schedules_occupant_types'
         )
+        hvac_thermostat_offset = \
+            scenario_json['features'][1]['properties'].get(
+                'hvac_thermostat_offset'
+        )
         floor_area = scenario_json['features'][1]['properties']['floor_area']
         climate_zone = scenario_json['project']['climate_zone']
         weatherfile = scenario_json['project']['weather_filename']
@@ -163,6 +392,7 @@ class Results:
         return {
             "schedules_type": schedules_type,
             "schedules_occupant_types": schedules_occupant_types,
+            "hvac_thermostat_offset": hvac_thermostat_offset,
             "floor_area": floor_area,
             "climate_zone": climate_zone,
             "weatherfile": weatherfile,
@@ -178,9 +408,11 @@ class Results:
         """
         Get useful metrics.
 
-        :param bool load_series: Load the timeseries data
+        :param load_series: Load the timeseries data. True for all of them,
+            or a list of the names in `REOPT_SERIES` to load.
         :return: dictionary
         """
+        series = series_names(load_series)
         output_site = reopt_json['outputs']['Scenario']['Site']
         input_site = reopt_json['inputs']['Scenario']['Site']
 
@@ -195,25 +427,10 @@ class Results:
             output_site['PV']['average_yearly_energy_exported_kwh']
 
 
-        if load_series:
-            load_profile = output_site['LoadProfile']['year_one_electric_load_series_kw']
-            pv_power_production = output_site['PV']['year_one_power_production_series_kw']
-            pv_to_battery = output_site['PV']['year_one_to_battery_series_kw']
-            pv_to_load = output_site['PV']['year_one_to_load_series_kw']
-            pv_to_grid = output_site['PV']['year_one_to_grid_series_kw']
-            pv_curtailed = output_site['PV']['year_one_curtailed_production_series_kw']
-            storage_to_load = output_site['Storage']['year_one_to_load_series_kw']
-            storage_to_grid = output_site['Storage']['year_one_to_grid_series_kw']
-        else:
-            load_profile = None
-            pv_power_production = None
-            pv_to_battery = None
-            pv_to_load = None
-            pv_to_grid = None
-            pv_curtailed = None
-            storage_to_load = None
-            storage_to_grid = None
-
+        series_values = {
+            name: output_site[section][key] if name in series else None
+            for name, (section, key) in REOPT_SERIES.items()
+        }
 
         urdb = input_site['ElectricTariff']['urdb_response']['label']
         utility = input_site['ElectricTariff']['urdb_utility_name']
@@ -226,18 +443,18 @@ class Results:
 
         return {
             "pv_size": pv_size,
-            "pv_power_production": pv_power_production,
-            "pv_to_battery": pv_to_battery,
-            "pv_to_load": pv_to_load,
-            "pv_to_grid": pv_to_grid,
-            "pv_curtailed": pv_curtailed,
+            "pv_power_production": series_values["pv_power_production"],
+            "pv_to_battery": series_values["pv_to_battery"],
+            "pv_to_load": series_values["pv_to_load"],
+            "pv_to_grid": series_values["pv_to_grid"],
+            "pv_curtailed": series_values["pv_curtailed"],
             "pv_yearly_energy_produced": pv_yearly_energy_produced,
             "pv_energy_exported": pv_energy_exported,
             "storage_size_kw": storage_size_kw,
             "storage_size_kwh": storage_size_kwh,
-            "storage_to_load": storage_to_load,
-            "storage_to_grid": storage_to_grid,
-            "load_profile": load_profile,
+            "storage_to_load": series_values["storage_to_load"],
+            "storage_to_grid": series_values["storage_to_grid"],
+            "load_profile": series_values["load_profile"],
             "load_annual_kwh": load_annual_kwh,
             "urdb": urdb,
             "utility": utility,
@@ -250,7 +467,9 @@ class Results:
 
     def get_electricity_usage_and_occupancy(
             self, locations, schedules_types, building_nums,
-            occupant_types=[None], multiindex=True
+            occupant_types=[None], hvac_setbacks=[None],
+            timesteps_per_hour=None, multiindex=True, batched=True,
+            workers=1, executor="process"
         ):
         """
         Return a (possibly multi-indexed) DataFrame with the desired parameters.
@@ -261,23 +480,56 @@ class Results:
         :param lst schedules_types: Schedules types to query
         :param lst building_nums: Building nums to get.
         :param lst occupant_types: list of occupant types
+        :param lst hvac_setbacks: list of thermostat setbacks. None matches
+            any setback.
+        :param int timesteps_per_hour: Only use scenarios simulated with this
+            many timesteps per hour, or any if None.
+        :param bool batched: Read all the runs first and fill one
+            preallocated frame with categorical keys, instead of
+            concatenating a frame per run and pivoting it. Multiindexed
+            frames are the same as the pivot's: runs with a None key are
+            dropped and duplicate rows are averaged. If not multiindexed,
+            only numeric columns are kept, as floats, and the keys are
+            categorical columns.
+        :param int workers: Number of runs to read at once when batched.
+        :param str executor: Read the runs on a pool of `process`es or
+            `thread`s if workers > 1.
         """
-        combos = itertools.product(
-            locations, schedules_types, building_nums, occupant_types,
-        )
-        runs = []
-        for location, schedule, building_num, occupants in combos:
+        combos = []
+        for combo in itertools.product(
+                locations, schedules_types, building_nums, occupant_types,
+                hvac_setbacks):
+            location, schedule, building_num, occupants, setback = combo
             if schedule == 'default':
                 if occupants:
                     continue
                 elif building_num != 1:
                     continue
+            combos.append(combo)
+
+        index = ['location', 'schedules_type', 'occupant_types']
+        # Only index on the setback if one was asked for, since pivot_table
+        # drops rows with a None index value.
+        if any(setback is not None for setback in hvac_setbacks):
+            index.append('hvac_setback')
+        index.append('building_num')
+
+        if batched:
+            return self._assemble_usage_and_occupancy(
+                combos, index, timesteps_per_hour, multiindex, workers,
+                executor)
+
+        runs = []
+        for location, schedule, building_num, occupants, setback in combos:
             try:
                 power = self.get_scenario_electricity_usage(
-                    location, schedule, building_num, occupants
+                    location, schedule, building_num, occupants,
+                    hvac_setback=setback,
+                    timesteps_per_hour=timesteps_per_hour
                 )
                 occ_schedule = self.get_scenario_occupant_schedule(
-                    location, building_num, occupants
+                    location, building_num, occupants, hvac_setback=setback,
+                    timesteps_per_hour=timesteps_per_hour
                 )
             except FileNotFoundError as e:
                 print(e)
@@ -287,28 +539,163 @@ class Results:
             data['building_num'] = building_num
             data['schedules_type'] = schedule
             data['occupant_types'] = occupants
+            data['hvac_setback'] = setback
             data['location'] = location
             runs.append(data)
             print(
                 f"Loaded loc={location}, schedule={schedule}, "
-                f"building_num={building_num}, occupants={occupants}"
+                f"building_num={building_num}, occupants={occupants}, "
+                f"setback={setback}"
             )
         total = pd.concat(runs)
 
         if multiindex:
-            return pd.pivot_table(
-                total,
-                index=[
-                    'location', 'schedules_type', 'occupant_types',
-                    'building_num', 'Datetime'
-                ]
-            )
+            return pd.pivot_table(total, index=index + ['Datetime'])
         else:
             return total
 
+    def _assemble_usage_and_occupancy(self, combos, index, timesteps_per_hour,
+                                      multiindex, workers, executor):
+        """
+        Batched path of `get_electricity_usage_and_occupancy`.
+
+        The scenarios of every run are looked up first, the runs are read
+        (on a pool if workers > 1), and their values are copied into one
+        preallocated array. The keys are stored once per run as categoricals
+        and repeated through integer codes, so no per-row key columns are
+        built and nothing has to be pivoted.
+        """
+        keys = []
+        reads = []
+        for location, schedule, building_num, occupants, setback in combos:
+            params = self._scenario_params(
+                location, schedule, occupants, setback, timesteps_per_hour)
+            occ_params = self._scenario_params(
+                location, "stochastic", occupants, setback, timesteps_per_hour)
+            power_scenario = next(
+                iter(self.get_matching_scenarios(params)), None)
+            occ_scenario = self._occupant_schedule_scenario(
+                occ_params, building_num)
+            if power_scenario is None:
+                print(
+                    f"No scenario with location {location} found that "
+                    f"satisfies schedules_type={schedule}, "
+                    f"building_num={building_num}")
+                continue
+            if occ_scenario is None:
+                print(
+                    f"No scenario with location {location} found that "
+                    f"satisfies building_num={building_num}, "
+                    f"occupant_types={occupants}")
+                continue
+            keys.append({
+                'location': location,
+                'schedules_type': schedule,
+                'occupant_types': occupants,
+                'hvac_setback': setback,
+                'building_num': building_num,
+            })
+            reads.append((
+                self.run_dir, power_scenario, occ_scenario, building_num,
+                self.load_scenario(power_scenario)["timesteps_per_hour"],
+                self.load_scenario(occ_scenario)["timesteps_per_hour"],
+            ))
+
+        if workers > 1 and len(reads) > 1:
+            if executor == "process":
+                pool = concurrent.futures.ProcessPoolExecutor(workers)
+            elif executor == "thread":
+                pool = concurrent.futures.ThreadPoolExecutor(workers)
+            else:
+                raise ValueError(f"Unknown executor: {executor}")
+            with pool:
+                results = list(pool.map(_read_run_timeseries, reads))
+        else:
+            results = [_read_run_timeseries(r) for r in reads]
+
+        runs = [
+            (key, result) for key, result in zip(keys, results)
+            if result is not None
+        ]
+        if multiindex:
+            # Sort the runs by their keys, like pivot_table would.
+            runs.sort(key=lambda run: tuple(
+                (run[0][name] is not None, run[0][name]) for name in index))
+        for key, _ in runs:
+            print(
+                f"Loaded loc={key['location']}, "
+                f"schedule={key['schedules_type']}, "
+                f"building_num={key['building_num']}, "
+                f"occupants={key['occupant_types']}, "
+                f"setback={key['hvac_setback']}"
+            )
+        if not runs:
+            raise ValueError("No runs found with the given parameters")
+        if multiindex:
+            # pivot_table drops rows with a missing key.
+            runs = [
+                run for run in runs
+                if all(run[0][name] is not None for name in index)
+            ]
+            if not runs:
+                return pd.DataFrame(index=pd.MultiIndex.from_arrays(
+                    [[]] * (len(index) + 1), names=index + ['Datetime']))
+
+        columns = sorted(set().union(*(r[1] for _, r in runs)))
+        column_numbers = {column: i for i, column in enumerate(columns)}
+        lengths = np.array([len(r[0]) for _, r in runs])
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        values = np.full((offsets[-1], len(columns)), np.nan)
+        datetimes = np.empty(offsets[-1], dtype="datetime64[ns]")
+        for i, (_, (run_index, run_columns, run_values)) in enumerate(runs):
+            rows = slice(offsets[i], offsets[i + 1])
+            datetimes[rows] = run_index
+            values[rows, [column_numbers[c] for c in run_columns]] = \
+                run_values
+
+        # Row number -> run number, to expand the per-run keys.
+        run_numbers = np.repeat(np.arange(len(runs)), lengths)
+        key_columns = {
+            name: pd.Categorical([key[name] for key, _ in runs])
+            for name in index
+        }
+
+        if not multiindex:
+            frame = pd.DataFrame(
+                values, columns=columns,
+                index=pd.DatetimeIndex(datetimes, name='Datetime'))
+            for name in ['building_num', 'schedules_type', 'occupant_types',
+                         'hvac_setback', 'location']:
+                if name not in key_columns:
+                    key_columns[name] = pd.Categorical(
+                        [key[name] for key, _ in runs])
+                frame[name] = pd.Categorical.from_codes(
+                    key_columns[name].codes[run_numbers],
+                    dtype=key_columns[name].dtype)
+            return frame
+
+        datetime_codes, datetime_levels = pd.factorize(datetimes, sort=True)
+        multi_index = pd.MultiIndex(
+            levels=[key_columns[name].categories for name in index]
+            + [pd.DatetimeIndex(datetime_levels)],
+            codes=[key_columns[name].codes[run_numbers] for name in index]
+            + [datetime_codes],
+            names=index + ['Datetime'],
+            verify_integrity=False,
+        )
+        frame = pd.DataFrame(values, index=multi_index, columns=columns)
+        # Match pivot_table: average rows with the same keys and timestamp,
+        # then drop rows and columns that are all missing.
+        if not multi_index.is_unique:
+            frame = frame.groupby(
+                level=list(range(multi_index.nlevels)), sort=True).mean()
+        elif not multi_index.is_monotonic_increasing:
+            frame = frame.sort_index()
+        return frame.dropna(how="all").dropna(how="all", axis=1)
+
     def get_scenario_electricity_usage(
             self, location, schedules_type="default", building_num=1,
-            occupant_types=None):
+            occupant_types=None, hvac_setback=None, timesteps_per_hour=None):
         """
         Get electricity usage data for the described scenario(s).
 
@@ -317,122 +704,356 @@ class Results:
 
         Labels returned are labeled with the left bin edge
         (different than EnergyPlus outputs).
+
+        :param hvac_setback: Thermostat setback, or None for any.
+        :param int timesteps_per_hour: Timesteps per hour, or None for any.
         """
-        params = {
-            "location": location,
-            "schedules_type": schedules_type,
-            "schedules_occupant_types": occupant_types,
-        }
+        params = self._scenario_params(
+            location, schedules_type, occupant_types, hvac_setback,
+            timesteps_per_hour)
         for scenario in self.get_matching_scenarios(params):
-            # Check if it matches
-            try:
-                scenario_params = self.load_scenario(scenario)
-            except Exception:
-                continue
-            # Load up the electricity file.
-            report_csv = os.path.join(
-                self.run_dir, scenario, str(building_num),
-                "014_default_feature_reports", "default_feature_reports.csv")
-            try:
-                report = pd.read_csv(
-                    report_csv, index_col=0, infer_datetime_format=True,
-                    parse_dates=True
-                )
-            except FileNotFoundError as e:
-                # Probably because the building number doesn't exist
-                raise FileNotFoundError(
-                    f"No building number {building_num}") from e
-            # Check and make sure the timestep matches what we expect.
-            report_timestep = (report.index[1] - report.index[0]).total_seconds()
-            if not (3600 / scenario_params["timesteps_per_hour"] == report_timestep):
-                raise RuntimeError(
-                    "Mismatch in simulated timestep vs. scenario timestep, "
-                    f"building {building_num} of {scenario}")
-
-            min_per_step = int(60 / scenario_params["timesteps_per_hour"])
-            report = report.resample(f"{min_per_step}T",
-                                     closed='right', label='left').mean()
-
-            electricity_cols = [
-                c for c in report.columns if "kWh" in c and "Electricity" in c
-                and ":" in c
-            ]
-
-            return report[electricity_cols]
+            return self.read_electricity_usage(scenario, building_num)
 
         raise FileNotFoundError(
             f"No scenario with location {location} found that satisfies "
             f"schedules_type={schedules_type}, building_num={building_num}")
 
+    def read_electricity_usage(self, scenario, building_num=1):
+        """
+        Read the electricity usage of a building in a scenario, resampled to
+        the scenario timestep.
+        """
+        return read_electricity_usage(
+            self.run_dir, scenario, building_num,
+            self.load_scenario(scenario)["timesteps_per_hour"])
+
     def get_scenario_occupant_schedule(self, location, building_num=1,
-                                       occupant_types=None):
+                                       occupant_types=None, hvac_setback=None,
+                                       timesteps_per_hour=None):
         """
         Get the occupant schedule associated with the keyword descriptors.
         """
+        params = self._scenario_params(
+            location, "stochastic", occupant_types, hvac_setback,
+            timesteps_per_hour)
+        scenario = self._occupant_schedule_scenario(params, building_num)
+        if scenario is None:
+            raise FileNotFoundError(
+                f"No scenario with location {location} found that satisfies "
+                f"building_num={building_num}, "
+                f"occupant_types={occupant_types}")
+
+        report = pd.read_csv(
+            os.path.join(self.run_dir, scenario, str(building_num),
+                         "schedules.csv"))
+        # Use the timestamps of the same scenario's electricity usage.
+        report.index = self.read_electricity_usage(
+            scenario, building_num).index
+        return report
+
+    def _occupant_schedule_scenario(self, params, building_num):
+        """
+        Return the first scenario matching *params* that has an occupant
+        schedule for the building, or None.
+        """
+        for scenario in self.get_matching_scenarios(params):
+            if os.path.exists(os.path.join(
+                    self.run_dir, scenario, str(building_num),
+                    "schedules.csv")):
+                return scenario
+        return None
+
+    @staticmethod
+    def _scenario_params(location, schedules_type, occupant_types,
+                         hvac_setback=None, timesteps_per_hour=None):
+        """
+        Scenario parameters to match for the lookups above. The setback and
+        timesteps are left out when they are None so they match anything.
+        """
         params = {
             "location": location,
-            "schedules_type": "stochastic",
-            "building_num": building_num,
-            "schedules_occupant_types": occupant_types
+            "schedules_type": schedules_type,
+            "schedules_occupant_types": occupant_types,
         }
-        for scenario in self.get_matching_scenarios(params):
-            # Load up the schedule file.
-            report_csv = os.path.join(
-                self.run_dir, scenario, str(building_num),
-                "schedules.csv")
+        if hvac_setback is not None:
+            params["hvac_thermostat_offset"] = hvac_setback
+        if timesteps_per_hour is not None:
+            params["timesteps_per_hour"] = timesteps_per_hour
+        return params
+
+    def get_matching_scenarios(self, params=None):
+        """
+        Only get scenarios IDs that match the specified parameter(s).
+
+        :param dict parameters: Dictionary of scenario parameters that must
+            match. If the values are a list, will consider the scenario to
+            be a match if it matches at least one of the list entries.
+        :return: List of scenario IDs that match.
+        """
+        return self._catalog.match(params)
+
+
+class ScenarioCatalog:
+    """
+    Index of the scenarios in an URBANopt run folder by their parameters.
+
+    Lookups on the indexed parameters are set intersections instead of a scan
+    of the run folder. New scenarios are picked up on the next lookup: the run
+    folder is only listed again when its modification time changes, and only
+    the new scenarios are loaded.
+    """
+
+    # Scenario parameters with an index.
+    INDEXED = (
+        "location", "schedules_type", "schedules_occupant_types",
+        "hvac_thermostat_offset", "timesteps_per_hour",
+    )
+
+    def __init__(self, run_dir, load_scenario):
+        """
+        :param str run_dir: URBANopt output folder
+        :param load_scenario: Function returning the parameters of a scenario
+            ID, e.g. `Results.load_scenario`.
+        """
+        self.run_dir = run_dir
+        self._load_scenario = load_scenario
+        # Parameters of each indexed scenario.
+        self._params = {}
+        # Modification time of scenario folders that don't have a description
+        # yet, so they are only tried again once something is written to them.
+        self._pending = {}
+        self._index = {key: {} for key in self.INDEXED}
+        self._run_dir_mtime = None
+
+    def __len__(self):
+        return len(self._params)
+
+    def refresh(self):
+        """
+        Index the scenarios added to the run folder since the last refresh.
+        """
+        try:
+            mtime = os.stat(self.run_dir).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._run_dir_mtime:
+            self._run_dir_mtime = mtime
+            scenarios = set(
+                entry.name for entry in os.scandir(self.run_dir)
+                if entry.is_dir()
+            )
+            for scenario in set(self._params) - scenarios:
+                self._remove(scenario)
+            for scenario in set(self._pending) - scenarios:
+                del self._pending[scenario]
+            for scenario in scenarios - set(self._params):
+                self._pending.setdefault(scenario, None)
+
+        for scenario, last_mtime in list(self._pending.items()):
             try:
-                report = pd.read_csv(report_csv)
+                mtime = os.stat(
+                    os.path.join(self.run_dir, scenario)).st_mtime_ns
             except FileNotFoundError:
                 continue
+            if mtime == last_mtime:
+                continue
+            try:
+                params = self._load_scenario(scenario)
+            except Exception:
+                self._pending[scenario] = mtime
+                continue
+            del self._pending[scenario]
+            self._add(scenario, params)
 
-            index = self.get_scenario_electricity_usage(
-                location, 'stochastic', building_num=building_num,
-                occupant_types=occupant_types).index
+    def _add(self, scenario, params):
+        self._params[scenario] = params
+        for key in self.INDEXED:
+            self._index[key].setdefault(params.get(key), set()).add(scenario)
 
-            report.index = index
+    def _remove(self, scenario):
+        params = self._params.pop(scenario)
+        for key in self.INDEXED:
+            self._index[key].get(params.get(key), set()).discard(scenario)
 
-            return report
+    def match(self, params=None):
+        """
+        Return the sorted IDs of the scenarios that match *params*.
+
+        :param dict params: Scenario parameters that must match. If a value
+            is a list, the scenario matches if it matches any of its entries.
+            `building_num` is ignored.
+        """
+        self.refresh()
+        if not params:
+            return sorted(set(self._params) | set(self._pending))
+
+        candidates = None
+        unindexed = {}
+        for key, value in params.items():
+            if key == "building_num":
+                continue
+            if isinstance(value, (int, float, str)) or value is None:
+                choices = [value]
+            else:
+                choices = list(value)
+            if key not in self._index:
+                unindexed[key] = choices
+                continue
+            scenarios = set()
+            for choice in choices:
+                scenarios |= self._index[key].get(choice, set())
+            candidates = scenarios if candidates is None \
+                else candidates & scenarios
+            if not candidates:
+                return []
+
+        if candidates is None:
+            candidates = self._params
+        return sorted(
+            scenario for scenario in candidates
+            if all(self._params[scenario].get(key) in choices
+                   for key, choices in unindexed.items())
+        )
 
+
+def read_electricity_usage(run_dir, scenario, building_num,
+                           timesteps_per_hour):
+    """
+    Read the electricity usage of a building in a scenario, resampled to the
+    scenario timestep.
+
+    Labels returned are labeled with the left bin edge
+    (different than EnergyPlus outputs).
+    """
+    # Load up the electricity columns.
+    report_csv = os.path.join(
+        run_dir, scenario, str(building_num),
+        feature_reports.FEATURE_REPORT_FOLDER,
+        feature_reports.FEATURE_REPORT_FILENAME)
+    try:
+        electricity_cols = [
+            c for c in feature_reports.report_columns(report_csv)
+            if "kWh" in c and "Electricity" in c and ":" in c
+        ]
+        report = feature_reports.read_report(report_csv, electricity_cols)
+    except FileNotFoundError as e:
+        # Probably because the building number doesn't exist
         raise FileNotFoundError(
-            f"No scenario with location {location} found that satisfies "
-            f"building_num={building_num}, occupant_types={occupant_types}")
+            f"No building number {building_num}") from e
+    # Check and make sure the timestep matches what we expect.
+    report_timestep = (report.index[1] - report.index[0]).total_seconds()
+    if not (3600 / timesteps_per_hour == report_timestep):
+        raise RuntimeError(
+            "Mismatch in simulated timestep vs. scenario timestep, "
+            f"building {building_num} of {scenario}")
 
-    def get_matching_scenarios(self, params=None):
-        """
-        Only get scenarios IDs that match the specified parameter(s).
+    min_per_step = int(60 / timesteps_per_hour)
+    return report.resample(f"{min_per_step}min",
+                           closed='right', label='left').mean()
 
-        If a parameter is None, acts like a wildcard.
 
-        :param dict parameters: Dictionary of scenario parameters that must
-            match. If the values are a list, will consider the scenario to
-            be a match if it matches at least one of the list entries.
-        :return: List of scenario IDs that match.
-        """
-        matches = []
-        for scenario in os.listdir(self.run_dir):
-            match = True
-            if params:
-                try:
-                    scenario_params = self.load_scenario(scenario)
-                except Exception:
-                    pass
-                for k, v in params.items():
-                    if k == "building_num":
-                        continue
-                    elif isinstance(v, (int, float, str)) or v is None:
-                        if scenario_params.get(k) != v:
-                            match = False
-                            break
-                    else:
-                        # If we're given a list of choices, handle those.
-                        any_match = False
-                        for choice in v:
-                            if scenario_params.get(k) == choice:
-                                any_match = True
-                                break
-                        if not any_match:
-                            match = False
-                            break
-            if match:
-                matches.append(scenario)
-        return matches
+def read_run_timeseries(run_dir, power_scenario, occ_scenario, building_num,
+                        power_timesteps_per_hour, occ_timesteps_per_hour):
+    """
+    Read the electricity usage and occupant schedule of one run for
+    `Results.get_electricity_usage_and_occupancy`.
+
+    Module-level so it can be sent to worker processes.
+
+    :return: Tuple of the datetime64 index, the column names and a 2-D array
+        of the numeric values.
+    """
+    power = read_electricity_usage(
+        run_dir, power_scenario, building_num, power_timesteps_per_hour)
+    if occ_scenario == power_scenario:
+        occ_index = power.index
+    else:
+        occ_index = read_electricity_usage(
+            run_dir, occ_scenario, building_num, occ_timesteps_per_hour).index
+    occ_schedule = pd.read_csv(
+        os.path.join(run_dir, occ_scenario, str(building_num),
+                     "schedules.csv"))
+    occ_schedule.index = occ_index
+    occ_schedule.columns = [c + '_sched' for c in occ_schedule.columns]
+    data = pd.concat([power, occ_schedule], axis=1).select_dtypes("number")
+    return (
+        data.index.to_numpy(dtype="datetime64[ns]"), list(data.columns),
+        data.to_numpy(dtype=np.float64),
+    )
+
+
+def _read_run_timeseries(args):
+    """
+    `read_run_timeseries` that returns None if the run's files are missing.
+    """
+    try:
+        return read_run_timeseries(*args)
+    except FileNotFoundError as e:
+        print(e)
+        return None
+
+
+def compact_series(values):
+    """
+    Return *values* downcast to the smallest integer dtype that holds it, or
+    as a categorical if it only holds text.
+
+    Floats stay float64, since float32 only keeps about 7 significant digits
+    and exact selections like a latitude would stop matching.
+    """
+    if pd.api.types.is_bool_dtype(values):
+        return values
+    if pd.api.types.is_integer_dtype(values):
+        return pd.to_numeric(values, downcast="integer")
+    if pd.api.types.is_float_dtype(values):
+        return values
+    if all(_is_text_or_missing(v) for v in values):
+        return values.astype("category")
+    return values
+
+
+def _is_text_or_missing(value):
+    return value is None or isinstance(value, str) or \
+        (isinstance(value, float) and value != value)
+
+
+def series_names(load_series):
+    """
+    Return the names of the series selected by a `load_series` argument.
+    """
+    if load_series is True:
+        return list(REOPT_SERIES)
+    if not load_series:
+        return []
+    unknown = set(load_series) - set(REOPT_SERIES)
+    if unknown:
+        raise ValueError(f"Unknown series: {sorted(unknown)}")
+    return list(load_series)
+
+
+def reopt_metric_paths(load_series=False):
+    """
+    Return the key paths of the REopt output values `extract_reopt_metrics`
+    reads.
+    """
+    return REOPT_METRIC_PATHS + [
+        ("outputs", "Scenario", "Site") + REOPT_SERIES[name]
+        for name in series_names(load_series)
+    ]
+
+
+def read_reopt_metrics(reopt_run, load_series=False, streaming=True):
+    """
+    Read a REopt run JSON and return its metrics.
+
+    Module-level so it can be sent to worker processes.
+
+    :param bool streaming: Only decode the values the metrics need, and skip
+        over the rest of the document.
+    """
+    with open(reopt_run, "r") as f:
+        if streaming:
+            reopt_json = partial_json.load(f, reopt_metric_paths(load_series))
+        else:
+            reopt_json = json.load(f)
+    return Results.extract_reopt_metrics(reopt_json, load_series)
@@ -1,24 +1,34 @@
 # Generate scenario JSON and CSV files to automate runs.
 import argparse
+import asyncio
+import concurrent.futures
+import contextlib
 import copy
 import csv
 import datetime
 import errno
+import functools
 import json
-import hashlib
 import os
+import random
 import re
 import subprocess
-import sys
 import threading
 import time
 
-import pandas as pd
 import pytz
 import requests
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
-from templates.generate_templates import TEMPLATE_DIRECTORY, flatten_dict
+import feature_reports
+import http_session
+from job_ledger import JobLedger
+from pipeline import Pipeline, Stage
+from reopt_cache import (
+    ReoptCache, json_default, payload_hash, results_match)
+from templates.generate_templates import (
+    DEFAULT_ID_SCHEME, ID_SCHEMES, TEMPLATE_DIRECTORY, filename_tag,
+    flatten_dict, getID, get_template, read_manifest)
 
 # Warnings from REopt calls.
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
@@ -27,13 +37,32 @@ TEMPLATE_DIRECTORY = f"./templates/{TEMPLATE_DIRECTORY}"
 
 REOPT_RESULTS_PATH = "./reopt_results"
 
+REOPT_CACHE_PATH = "./reopt_cache"
+
+JOB_LEDGER_PATH = "./job_ledger.sqlite"
+
+# Scratch space for the scenario and mapper files of the pipeline.
+WORKER_DIRECTORY = "./workers"
+
+# Number of scenarios checked against the caches at once by plan_sweep.
+PLAN_THREADS = 8
+
 DEFAULT_REOPT_URL = 'https://developer.nrel.gov/api/reopt'
 
 REOPT_URL = os.environ.get('REOPT_URL', DEFAULT_REOPT_URL)
 
-# Lock for number of active threads.
-thread_lock = threading.Lock()
-REOPT_THREAD_COUNTER = 0
+# Status of a REopt job that hasn't finished.
+REOPT_OPTIMIZING = "Optimizing..."
+# Used to find the job status without parsing the whole REopt response.
+# Only outputs.Scenario.status as the first key of the Scenario is matched,
+# since the inputs echoed back can have other "status" keys. Responses it
+# doesn't match are parsed in full.
+REOPT_STATUS_PATTERN = re.compile(
+    rb'"outputs"\s*:\s*\{\s*"Scenario"\s*:\s*\{\s*"status"\s*:\s*"([^"]*)"')
+# Most bytes of an "Optimizing..." response to read past the status, without
+# keeping them, so the connection can go back to the pool. The connection is
+# dropped instead if more of the response is left.
+REOPT_DRAIN_BYTES = 2**20
 
 with open("./templates/default_building.json", "r") as f:
     DEFAULT_BUILDING = json.load(f)
@@ -70,6 +99,9 @@ class Simulation:
         - timesteps_per_hour
     """
 
+    # getID scheme of the IDs in scenario names and REopt results filenames.
+    id_scheme = DEFAULT_ID_SCHEME
+
     def __init__(
             self, location, building_parameters, reopt_parameters,
             weatherfile, climate_zone, latitude, longitude, timezone,
@@ -100,6 +132,9 @@ class Simulation:
         self.reopt_timesteps_per_hour = 1
         self.tag = tag
         self.timezone = timezone
+        # Directory (relative to the project root) to write the scenario and
+        # mapper files into.
+        self.workdir = ""
 
     @classmethod
     def from_json(cls, filepath):
@@ -207,76 +242,114 @@ class Simulation:
         log(f"Wrote mapper CSV to {self.mapper_filename}")
         return self.mapper_filename
 
-    def call_reopt(self, wait=True, use_cached=True, sleep=0, max_threads=5):
+    def call_reopt(self, wait=True, use_cached=True, client=None, cache=None,
+                   ledger=None):
         """
         Call reopt for the site's building(s) and write the results.
 
         :param bool wait: Wait for REopt to return a result before continuing.
-        :param float sleep: NUmber of seconds to sleep after each REopt run.
-        :return: None if wait=True or a list of thread objects otherwise.
+        :param ReoptClient client: Client to run the REopt jobs concurrently
+            with. If not given, the jobs are run one at a time on a client of
+            their own, and waited for.
+        :param ReoptCache cache: Cache of results keyed on the full payload.
+            If not given, a building is skipped if its results file exists.
+        :param JobLedger ledger: Ledger to record the jobs in. Buildings
+            with a job that was submitted but hasn't finished are skipped,
+            since they're polled by `ReoptClient.resume`. The client's ledger
+            is used if not given.
+        :return: None if no client is given or a list of
+            concurrent.futures.Future objects otherwise.
         """
-        API_KEY = os.environ.get("NREL_DEV_KEY")
-        if not API_KEY:
-            raise RuntimeError("NREL_DEV_KEY environment variable missing")
+        own_client = client is None
+        if own_client:
+            client = ReoptClient(max_jobs=1, ledger=ledger)
+        elif ledger is None:
+            ledger = client.ledger
 
-        threads = []
+        futures = []
 
-        for building_num in range(1, self.num_simulations + 1):
-            # Make a name for the reopt results
+        for building_num, payload, output_path in self.pending_reopt_jobs(
+                use_cached, cache, ledger):
+            log(f"Running REopt for building {building_num} of "
+                  f"{self.num_simulations}")
+            futures.append(client.submit(payload, output_path, cache))
+
+        if own_client:
+            client.close()
+            return None
+        if wait:
+            concurrent.futures.wait(futures)
+        return futures
 
-            output_path = os.path.join(
-                REOPT_RESULTS_PATH, self.scenario_name, str(building_num),
-                self.reopt_results_filename(building_num)
-                )
+    def pending_reopt_jobs(self, use_cached=True, cache=None, ledger=None,
+                           loads=None):
+        """
+        Generate the REopt jobs the site's buildings still need, copying
+        cached results into place for the others.
+
+        :param ReoptCache cache: Cache of results keyed on the full payload.
+            Results files that already exist but aren't cached are added to
+            it if they were made from the same payload. If not given, a
+            building is skipped if its results file exists.
+        :param JobLedger ledger: Ledger of submitted jobs. Buildings with a
+            job that was submitted but hasn't finished are skipped.
+        :param dict loads: Loads already read by building number, filled in
+            as more are read. Simulations with the same scenario_name share
+            their buildings, so they can share the loads too.
+        :return: generator of (building_num, payload, output_path) tuples
+        """
+        if loads is None:
+            loads = {}
+        for building_num in range(1, self.num_simulations + 1):
+            output_path = self.reopt_output_path(building_num)
 
-            if use_cached and self.reopt_result_exists(building_num):
+            if use_cached and cache is None and \
+                    self.reopt_result_exists(building_num):
                 continue
 
-            log(f"Running REopt for building {building_num} of "
-                  f"{self.num_simulations}")
+            if ledger is not None and \
+                    ledger.reopt_stage(output_path) == "submitted":
+                log(f"REopt job for building {building_num} of "
+                    f"{self.num_simulations} was already submitted")
+                continue
 
-            payload = self.make_reopt_payload(building_num)
-            if wait:
-                call_reopt_and_write(payload, API_KEY, output_path)
-            else:
-                # Make sure we don't go over the maximum thread count.
-                while get_num_active_reopt_threads() >= max_threads:
-                    print(f"Waiting for other REopt threads to finish "
-                         f"({get_num_active_reopt_threads()} running)...")
-                    time.sleep(5)
-                with thread_lock:
-                    thread = threading.Thread(
-                        target=call_reopt_and_write,
-                        args=(payload, API_KEY, output_path)
-                    )
-                    thread.start()
-                    global REOPT_THREAD_COUNTER
-                    REOPT_THREAD_COUNTER += 1
-                threads.append(thread)
-                if sleep:
-                    print(f"Sleeping for {sleep} s after REopt call...")
-                    time.sleep(sleep)
+            if building_num not in loads:
+                loads[building_num] = self.get_loads_kw(building_num)
+            payload = self.make_reopt_payload(
+                building_num, loads[building_num])
+            if use_cached and cache is not None and \
+                    cache.fetch(payload, output_path):
+                log(f"Using cached REopt results for building {building_num} "
+                    f"of {self.num_simulations}")
+                continue
 
-        if wait:
-            return None
-        else:
-            return threads
+            yield building_num, payload, output_path
 
-    def reopt_result_exists(self, building_num):
+    def reopt_output_path(self, building_num):
         """
-        Return true if the REopt JSON already has been written.
+        Return the filepath of the REopt results for a building.
         """
-        output_path = os.path.join(
+        return os.path.join(
             REOPT_RESULTS_PATH, self.scenario_name, str(building_num),
             self.reopt_results_filename(building_num)
             )
-        return os.path.exists(output_path)
+
+    def reopt_result_exists(self, building_num):
+        """
+        Return true if the REopt JSON already has been written.
+        """
+        return os.path.exists(self.reopt_output_path(building_num))
 
 
-    def make_reopt_payload(self, building_num=1):
+    def make_reopt_payload(self, building_num=1, loads_kw=None):
         """
         Return a dictionary to send to REopt API with the building load.
+
+        :param loads_kw: Load of the building, read from its feature report
+            if not given.
         """
+        if loads_kw is None:
+            loads_kw = self.get_loads_kw(building_num)
         template = copy.deepcopy(DEFAULT_REOPT)
         site = template["Scenario"]["Site"]
 
@@ -288,7 +361,7 @@ class Simulation:
         template["Scenario"]["Site"]["LoadProfile"] = {
             "percent_share": 100,
             "year": 2007,
-            "loads_kw": self.get_loads_kw(building_num),
+            "loads_kw": loads_kw,
             "loads_kw_is_net": True
         }
         template["Scenario"]["Site"]["latitude"] = self.latitude
@@ -297,30 +370,12 @@ class Simulation:
 
     def get_loads_kw(self, building_num):
         """
-        Return a list of the modeled load in kW for the building.
-        """
-        # Get the name of the feature report folder
-        report_folder = [
-            f for f in os.listdir(
-                os.path.join('run', self.scenario_name, str(building_num)))
-            if 'default_feature_reports' in f
-        ][0]
-        report_csv = os.path.join(
-            'run', self.scenario_name, str(building_num),
-            report_folder, "default_feature_reports.csv")
-        report = pd.read_csv(
-            report_csv, index_col=0, infer_datetime_format=True,
-            parse_dates=True
-        )
-        # Check and make sure the timestep matches what we expect.
-        report_timestep = (report.index[1] - report.index[0]).total_seconds()
-        if not (3600 / self.scenario_timesteps_per_hour == report_timestep):
-            raise RuntimeError(
-                "Mismatch in simulated timestep vs. scenario timestep, "
-                f"building {building_num} of {self.scenario_name}")
-        return round(
-            report["Electricity:Facility(kWh)"] * self.scenario_timesteps_per_hour, 3
-        ).tolist()
+        Return an array of the modeled load in kW for the building.
+        """
+        report_csv = feature_reports.feature_report_csv(
+            'run', self.scenario_name, building_num)
+        return feature_reports.read_facility_kw(
+            report_csv, self.scenario_timesteps_per_hour)
 
 
     def make_geojson_polygon(self):
@@ -362,16 +417,20 @@ class Simulation:
 
     @property
     def mapper_filename(self):
-        return self.scenario_name + ".csv"
+        return os.path.join(self.workdir, self.scenario_name + ".csv")
 
     @property
     def scenario_filename(self):
-        return self.scenario_name + ".json"
+        return os.path.join(self.workdir, self.scenario_name + ".json")
 
     def reopt_results_filename(self, building_num):
         """
         Unique name based on the REopt parameters and site load.
         """
+        return self._reopt_results_filename
+
+    @functools.cached_property
+    def _reopt_results_filename(self):
         reopt_site = self.reopt_parameters["Scenario"]["Site"]
 
         net_metering = \
@@ -393,13 +452,14 @@ class Simulation:
                 "storage_rebate": storage_rebate,
                 "timesteps": timesteps,
                 "schedule": self.schedules_type
-            }
+            },
+            self.id_scheme
         )
 
         return f"{urdb}-net-metering-{net_metering}-rebate-" \
                f"{storage_rebate}-{uuid}.json".replace(" ", "-").lower()
 
-    @property
+    @functools.cached_property
     def scenario_name(self):
         """
         Filename base that is unique based on the building simulation parameters
@@ -454,7 +514,7 @@ class Simulation:
         return end.strftime('%Y-%m-%dT%H:%M:%S.000')
         # return end.strftime('%Y-%m-%dT%H:%M:%S.000Z')
 
-    @property
+    @functools.cached_property
     def building_sim_uuid(self):
         """
         Return a UUID corresponding to the building simulation parameters
@@ -474,7 +534,7 @@ class Simulation:
         # if 'schedules_occupant_types' in params and \
         #         not params['schedules_occupant_types']:
         #     del params['schedules_occupant_types']
-        return getID(params)
+        return getID(params, self.id_scheme)
 
 
     def __getattr__(self, key):
@@ -492,63 +552,93 @@ class Simulation:
 
         return object.__getattribute__(self, key)
 
-    def run_building_sim(self, use_cached=True, trace=False):
+    def run_building_sim(self, use_cached=True, trace=False, ledger=None):
         """
         Run simulations and post-process the building.
 
         If use_cached, then will not overwrite old building simulation files.
-        """
-        clear_baseline = [
-            "bundle",
-            "exec",
-            "rake",
-            f"clear_baseline[{self.scenario_filename},{self.mapper_filename}]"
-        ]
-        run_baseline = [
-            "bundle",
-            "exec",
-            "rake",
-            f"run_baseline[{self.scenario_filename},{self.mapper_filename}]"
-        ]
-        post_process = [
-            "bundle",
-            "exec",
-            "rake",
-            f"post_process_baseline[{self.scenario_filename},{self.mapper_filename}]"
-        ]
-        if trace:
-            clear_baseline.append('--trace')
-            run_baseline.append('--trace')
-            post_process.append('--trace')
 
+        :param JobLedger ledger: Ledger to record the finished stages in.
+        """
         if use_cached and self.results_exist():
             log(
                 "Run output already generated, using cache files in "
                 f"{self.scenario_name}")
+            if ledger is not None:
+                ledger.set_scenario_stage(self.scenario_name, "post_processed")
             return
-        try:
+        start = time.monotonic()
+        self.simulate_baseline(trace, ledger)
+        self.post_process_baseline(trace, ledger, start)
+
+    def simulate_baseline(self, trace=False, ledger=None):
+        """
+        Clear old simulation files and run the OpenStudio simulations.
+        """
+        with self._rake_errors(ledger):
             log("Clearing old simulation files...")
-            clearing = subprocess.check_output(clear_baseline, cwd="../")
+            clearing = subprocess.check_output(
+                self.rake_command("clear_baseline", trace), cwd="../")
             log(clearing.decode('utf-8'))
             log("Old files cleared!")
             log("Starting simulation rake task...")
             running = subprocess.check_output(
-                run_baseline, cwd="../"
+                self.rake_command("run_baseline", trace), cwd="../"
             )
             log(running.decode('utf-8'))
             log("Finished simulation!")
+            if ledger is not None:
+                ledger.set_scenario_stage(self.scenario_name, "simulated")
+
+    def post_process_baseline(self, trace=False, ledger=None, start=None):
+        """
+        Run the URBANopt post-processor on the simulations.
+
+        :param float start: time.monotonic() when the simulation started, to
+            record how long the scenario took in the ledger.
+        """
+        with self._rake_errors(ledger):
             # We need to run this to get the power values to send to reopt.
             log("Running URBANopt post-processor")
             post_process = subprocess.check_output(
-                post_process, cwd="../"
+                self.rake_command("post_process_baseline", trace), cwd="../"
             )
             log(post_process.decode('utf-8'))
             log("Finished URBANopt post-processing")
+            if ledger is not None:
+                seconds = None if start is None else time.monotonic() - start
+                ledger.set_scenario_stage(
+                    self.scenario_name, "post_processed", seconds=seconds)
+
+    def rake_command(self, task, trace=False):
+        """
+        Return the command to run a rake task on the scenario.
+        """
+        command = [
+            "bundle",
+            "exec",
+            "rake",
+            f"{task}[{self.scenario_filename},{self.mapper_filename}]"
+        ]
+        if trace:
+            command.append('--trace')
+        return command
+
+    @contextlib.contextmanager
+    def _rake_errors(self, ledger=None):
+        """
+        Clean up the run files if a rake task fails.
+        """
+        try:
+            yield
         except KeyboardInterrupt as e:
             log("Keyboard interrupted...")
             raise e
         except Exception as e:
             log("Error running task!")
+            if ledger is not None:
+                ledger.set_scenario_stage(
+                    self.scenario_name, "failed", error=str(e))
             self.cleanup()
             raise e
 
@@ -596,148 +686,862 @@ class Simulation:
         subprocess.run(["rm", f"{self.mapper_filename}"], cwd=".")
 
 
-def get_num_active_reopt_threads():
-    with thread_lock:
-        return REOPT_THREAD_COUNTER
+def read_templates(filepaths):
+    """
+    Read template files.
+
+    :return: generator of (filepath, template dictionary) tuples
+    """
+    for filepath in filepaths:
+        with open(filepath, "r") as f:
+            yield filepath, json.load(f)
 
 
-def getID(mydic):
+def group_templates(templates):
     """
-    Create unique ID to tag JSON.
+    Load templates and group them by scenario name. Templates in a group
+    share a run folder, so the group only needs simulating once.
+
+    :param templates: (name, template dictionary) tuples, from read_templates
+        or read_manifest
+    :return: list of dictionaries of a scenario_name, its template names and
+        their Simulations, in the order the scenarios first appear
     """
-    ID = 0
-    for x in mydic.keys():
-        # Hash the content
-        ID = ID + int(
-            hashlib.sha256(str(mydic[x]).encode('utf-8')).hexdigest(), 16
-            )
-        # Hash the key
-        ID = ID + int(hashlib.sha256(x.encode('utf-8')).hexdigest(), 16)
-    return (ID % 10**10)
+    groups = {}
+    for template, data in templates:
+        try:
+            simulation = Simulation.from_dict(data)
+        except KeyError as e:
+            raise ValueError(f"Template {template} is missing {e}") from e
+        group = groups.setdefault(simulation.scenario_name, {
+            "scenario_name": simulation.scenario_name,
+            "templates": [],
+            "simulations": [],
+        })
+        group["templates"].append(template)
+        group["simulations"].append(simulation)
+    return list(groups.values())
+
+
+class ScenarioPipeline:
+    """
+    Run templates through the building simulations and REopt as a pipeline
+    of stages:
+
+        generate      write the scenario and mapper files of a scenario
+        simulate      run the OpenStudio simulations
+        post_process  run the URBANopt post-processor
+        extract_load  read each building's load and make its REopt payloads
+        reopt         hand each REopt job to a ReoptClient
+
+    Each stage has its own worker threads and a bounded queue in front of it.
+    The simulations run in rake subprocesses, so the next scenario simulates
+    while the REopt jobs of the last one are waiting on the API. Templates
+    that share a scenario name go through the simulation stages as one group.
+
+    The ReoptClient submits and polls the jobs, and writes their results, on
+    its event loop, so REopt jobs go through the same path as with --file.
+    The reopt stage only waits for the client when it already has as many
+    jobs as it runs at once plus a queue's worth waiting, and `run` waits
+    for the last jobs to finish.
+    """
+
+    # Default number of workers of each stage. The reopt stage runs on one
+    # thread, and its number is the REopt jobs the client runs at once.
+    WORKERS = {
+        "generate": 1,
+        "simulate": 1,
+        "post_process": 1,
+        "extract_load": 2,
+        "reopt": 5,
+    }
+
+    def __init__(self, workers=None, queue_size=8, use_cached=True,
+                 use_reopt_cache=True, trace=False, skip_reopt=False,
+                 cache=None, ledger=None, client=None, **client_kwargs):
+        """
+        :param dict workers: Number of workers of a stage by name, for the
+            stages that shouldn't have the default number in WORKERS.
+        :param int queue_size: Number of items that can wait for a stage.
+        :param bool use_cached: Don't rerun simulations that are in `run`.
+        :param bool use_reopt_cache: Don't rerun REopt jobs that have results.
+        :param bool trace: Trace rake tasks.
+        :param bool skip_reopt: Only run the simulation stages.
+        :param ReoptCache cache: Cache of REopt results.
+        :param JobLedger ledger: Ledger to record the scenarios and jobs in.
+        :param ReoptClient client: Client to run the REopt jobs on. If not
+            given, each run makes its own client, with the reopt number of
+            workers as max_jobs, and closes it at the end.
+        :param client_kwargs: Keyword arguments for the ReoptClient, if not
+            given.
+        """
+        self.workers = {**self.WORKERS, **(workers or {})}
+        self.queue_size = queue_size
+        self.use_cached = use_cached
+        self.use_reopt_cache = use_reopt_cache
+        self.trace = trace
+        self.skip_reopt = skip_reopt
+        self.cache = cache
+        self.ledger = ledger
+        self.client = client
+        self.client_kwargs = client_kwargs
+        self._reopt_client = None
+        self._reopt_slots = None
+        self._total = 0
+        self._simulated = 0
+        self._start = None
+        self._lock = threading.Lock()
+
+    def run(self, templates):
+        """
+        Run the templates through every stage, logging errors as they're
+        reported by the stages and the utilization of each stage at the end.
+
+        :param templates: (name, template dictionary) tuples, from
+            read_templates or read_manifest
+        :return: Pipeline with the errors and statistics of each stage
+        """
+        groups = group_templates(templates)
+        self._total = len(groups)
+        self._simulated = 0
+        self._start = time.monotonic()
+        log(f"Running {len(groups)} unique scenarios for "
+            f"{sum(len(group['templates']) for group in groups)} templates")
+        os.makedirs(WORKER_DIRECTORY, exist_ok=True)
+
+        if not self.skip_reopt:
+            self._reopt_client = self.client or ReoptClient(
+                max_jobs=self.workers["reopt"], ledger=self.ledger,
+                **self.client_kwargs)
+            self._reopt_slots = threading.Semaphore(
+                self._reopt_client.max_jobs + self.queue_size)
+
+        pipeline = Pipeline(self.make_stages())
+        outputs = pipeline.run(groups)
+        # Without REopt the outputs are the post-processed groups.
+        jobs = [] if self.skip_reopt else outputs
+        unfinished = sum(not job["future"].done() for job in jobs)
+        if unfinished:
+            log(f"Waiting for {unfinished} REopt jobs to finish...")
+            concurrent.futures.wait([job["future"] for job in jobs])
+        if self._reopt_client is not None and self.client is None:
+            self._reopt_client.close()
+        self._reopt_client = None
+
+        for stage, item, e in pipeline.errors:
+            name = item.get("scenario_name") or item.get("output_path")
+            log(f"Error in {stage} of {name}: {e}")
+        for job in jobs:
+            if job["future"].exception() is not None:
+                log(f"Error in REopt job of {job['output_path']}: "
+                    f"{job['future'].exception()}")
+        log(pipeline.report())
+        return pipeline
+
+    def make_stages(self):
+        names = ["generate", "simulate", "post_process"]
+        if not self.skip_reopt:
+            names += ["extract_load", "reopt"]
+        return [
+            Stage(name, getattr(self, name),
+                  1 if name == "reopt" else self.workers[name],
+                  self.queue_size, fan_out=name == "extract_load")
+            for name in names
+        ]
+
+    def generate(self, group):
+        simulation = group["simulations"][0]
+        simulation.workdir = WORKER_DIRECTORY
+        simulation.write_mapper_csv()
+        simulation.write_scenario_json()
+        if self.ledger is not None:
+            self.ledger.set_scenario_stage(
+                group["scenario_name"], "written",
+                template=group["templates"][0])
+        return group
+
+    def simulate(self, group):
+        simulation = group["simulations"][0]
+        group["start"] = time.monotonic()
+        group["cached"] = self.use_cached and simulation.results_exist()
+        if group["cached"]:
+            log(
+                "Run output already generated, using cache files in "
+                f"{group['scenario_name']}")
+        else:
+            simulation.simulate_baseline(self.trace, self.ledger)
+        return group
+
+    def post_process(self, group):
+        simulation = group["simulations"][0]
+        if not group["cached"]:
+            simulation.post_process_baseline(
+                self.trace, self.ledger, group["start"])
+        elif self.ledger is not None:
+            self.ledger.set_scenario_stage(
+                group["scenario_name"], "post_processed")
+        simulation.cleanup()
+
+        with self._lock:
+            self._simulated += 1
+            simulated = self._simulated
+        log(f"Scenario {simulated} of {self._total} simulated, "
+            f"{round((time.monotonic() - self._start) / 60, 1)} min since "
+            "start")
+        return group
+
+    def extract_load(self, group):
+        # Every template of the group shares the group's buildings, so each
+        # building's load is read once and the REopt jobs for all the
+        # templates' REopt parameters fan out from it. Templates with the
+        # same REopt parameters too share their results files, so only one
+        # of them makes the jobs.
+        loads = {}
+        output_paths = set()
+        for simulation in group["simulations"]:
+            for building_num, payload, output_path in \
+                    simulation.pending_reopt_jobs(
+                        self.use_reopt_cache, self.cache, self.ledger,
+                        loads=loads):
+                if output_path in output_paths:
+                    continue
+                output_paths.add(output_path)
+                yield {
+                    "building_num": building_num,
+                    "payload": payload,
+                    "output_path": output_path,
+                }
 
+    def reopt(self, job):
+        # Wait for the client to have room for the job, so the payloads of a
+        # long sweep don't all pile up in memory waiting to be submitted.
+        self._reopt_slots.acquire()
+        job["future"] = self._reopt_client.submit(
+            job.pop("payload"), job["output_path"], self.cache)
+        job["future"].add_done_callback(
+            lambda future: self._reopt_slots.release())
+        return job
 
-def call_reopt_and_write(payload, api_key, output_filepath):
+
+def plan_group(group, use_cached=True, use_reopt_cache=True,
+               skip_reopt=False, cache=None, ledger=None):
     """
-    Call REopt and write results.
+    Work out what ScenarioPipeline would do with a group of templates,
+    without running or writing anything.
+
+    The REopt jobs of a scenario that needs simulating are all counted as to
+    submit, since their loads aren't known until it's simulated. Existing
+    results files only count as done if they were made from the same
+    payload, see reopt_cache.results_match.
+
+    :return: dictionary of whether the scenario needs simulating and the
+        numbers of its REopt jobs to submit, to resume from the ledger and
+        already done
     """
-    try:
-        start = time.monotonic()
-        root_url = REOPT_URL
-        log(f"Making REopt call to {root_url}...")
-        post_url = root_url + '/v1/job/?api_key=' + api_key
-        results_url = \
-            root_url + '/v1/job/<run_uuid>/results/?api_key=' + api_key
-        # Turn off verification because the private server certificate is
-        # expired...
-        verify = root_url == DEFAULT_REOPT_URL
-        resp = requests.post(post_url, json=payload, verify=verify)
-        if not resp.ok:
-            msg = "REopt status code {}. {}".format(resp.status_code,
-                                                    resp.content)
-            raise RuntimeError(msg)
-
-        run_id_dict = json.loads(resp.text)
-        try:
-            run_id = run_id_dict['run_uuid']
-        except KeyError:
-            msg = "Response from {} did not contain run_uuid.".format(post_url)
-            raise KeyError(msg)
+    simulation = group["simulations"][0]
+    simulate = not (
+        use_cached and os.path.isdir("run") and simulation.results_exist())
+    plan = {"simulate": simulate, "submit": 0, "resume": 0, "done": 0}
+    if skip_reopt:
+        return plan
+
+    loads = {}
+    output_paths = set()
+    for simulation in group["simulations"]:
+        for building_num in range(1, simulation.num_simulations + 1):
+            output_path = simulation.reopt_output_path(building_num)
+            if output_path in output_paths:
+                continue
+            output_paths.add(output_path)
+
+            if ledger is not None and \
+                    ledger.reopt_stage(output_path) == "submitted":
+                plan["resume"] += 1
+            elif use_reopt_cache and not simulate:
+                if building_num not in loads:
+                    loads[building_num] = simulation.get_loads_kw(building_num)
+                payload = simulation.make_reopt_payload(
+                    building_num, loads[building_num])
+                # A run always has a cache, which adopts the results files
+                # that were made from the same payload.
+                done = (cache is not None and payload in cache) or \
+                    results_match(payload, output_path)
+                plan["done" if done else "submit"] += 1
+            else:
+                plan["submit"] += 1
+    return plan
 
-        results = reopt_poller(url=results_url.replace('<run_uuid>', run_id))
 
-        if results['outputs']['Scenario']['status'] != 'optimal':
-            error_msg = results['messages'].get('error')
-            if error_msg:
-                print(error_msg)
-            raise RuntimeError(
-                f"Job {run_id} completed with non-optimal status: "
-                f"{results['outputs']['Scenario']['status']}")
+def plan_sweep(templates, workers=None, use_cached=True, use_reopt_cache=True,
+               skip_reopt=False, cache=None, ledger=None, rate_limit=0):
+    """
+    Work out what ScenarioPipeline.run would do with the templates, and
+    estimate how long it would take from the durations recorded in the
+    ledger. The scenarios are checked against the run folder, the REopt
+    results and the cache on PLAN_THREADS threads.
+
+    :param templates: (name, template dictionary) tuples, from read_templates
+        or read_manifest
+    :param dict workers: Number of workers of a ScenarioPipeline stage by
+        name, for the stages that wouldn't have the default number.
+    :param float rate_limit: REopt API requests allowed per hour, 0 for no
+        limit.
+    :return: dictionary of the counts of templates, scenarios, simulations
+        to run and REopt jobs to submit, resume and already done, and the
+        estimated hours of each part, which are None without recorded
+        durations
+    """
+    groups = group_templates(templates)
+    check = functools.partial(
+        plan_group, use_cached=use_cached, use_reopt_cache=use_reopt_cache,
+        skip_reopt=skip_reopt, cache=cache, ledger=ledger)
+    with concurrent.futures.ThreadPoolExecutor(PLAN_THREADS) as pool:
+        plans = list(pool.map(check, groups))
+
+    workers = {**ScenarioPipeline.WORKERS, **(workers or {})}
+    plan = {
+        "templates": sum(len(group["templates"]) for group in groups),
+        "scenarios": len(groups),
+        "simulate": sum(p["simulate"] for p in plans),
+        "submit": sum(p["submit"] for p in plans),
+        "resume": sum(p["resume"] for p in plans),
+        "done": sum(p["done"] for p in plans),
+        "workers": workers,
+        "rate_limit": rate_limit,
+        "durations": ledger.durations() if ledger is not None else {},
+        "simulate_hours": None,
+        "reopt_hours": None,
+        "hours": None,
+    }
+    simulations, simulation_seconds = \
+        plan["durations"].get("scenarios", (0, None))
+    if simulation_seconds is not None:
+        plan["simulate_hours"] = plan["simulate"] * simulation_seconds / \
+            workers["simulate"] / 3600
+    jobs, job_seconds = plan["durations"].get("reopt_jobs", (0, None))
+    if job_seconds is not None:
+        plan["reopt_hours"] = (plan["submit"] + plan["resume"]) * \
+            job_seconds / workers["reopt"] / 3600
+        if rate_limit:
+            # Every job is submitted once, and polled at least once.
+            plan["reopt_hours"] = max(
+                plan["reopt_hours"],
+                (2 * plan["submit"] + plan["resume"]) / rate_limit)
+    estimates = [
+        hours for hours in (plan["simulate_hours"], plan["reopt_hours"])
+        if hours is not None
+    ]
+    if estimates:
+        # The REopt jobs of one scenario run while the next simulates.
+        plan["hours"] = max(estimates)
+    return plan
+
+
+def plan_report(plan):
+    """
+    Describe a plan from plan_sweep.
+    """
+    def hours(value):
+        if value is None:
+            return "unknown"
+        if value < 1:
+            return f"{round(value * 60)} min"
+        return f"{round(value, 1)} h"
+
+    lines = [
+        f"Plan for {plan['templates']} templates in {plan['scenarios']} "
+        "scenarios:",
+        f"  OpenStudio simulations: {plan['simulate']} to run, "
+        f"{plan['scenarios'] - plan['simulate']} cached",
+        f"  REopt jobs: {plan['submit']} to submit, {plan['resume']} to "
+        f"resume, {plan['done']} done",
+    ]
+    for name, table in (("simulation", "scenarios"), ("REopt job", "reopt_jobs")):
+        count, seconds = plan["durations"].get(table, (0, None))
+        if seconds is None:
+            lines.append(f"  No recorded {name} durations")
+        else:
+            lines.append(
+                f"  Mean {name} took {round(seconds)} s over {count} recorded")
+    workers = plan["workers"]
+    lines.append(
+        f"  Estimated wall time {hours(plan['hours'])}: "
+        f"{hours(plan['simulate_hours'])} simulating on "
+        f"{workers['simulate']} workers, {hours(plan['reopt_hours'])} of "
+        f"REopt jobs on {workers['reopt']} workers")
+    if plan["rate_limit"]:
+        requests = 2 * plan["submit"] + plan["resume"]
+        lines.append(
+            f"  At least {requests} REopt API requests, "
+            f"{hours(requests / plan['rate_limit'])} of quota at "
+            f"{round(plan['rate_limit'])} requests per hour")
+    return "\n".join(lines)
+
+
+def get_api_key():
+    """
+    Return the NREL developer API key from the environment.
+    """
+    api_key = os.environ.get("NREL_DEV_KEY")
+    if not api_key:
+        raise RuntimeError("NREL_DEV_KEY environment variable missing")
+    return api_key
 
-        # Make directory if not existing
-        if not os.path.exists(os.path.dirname(output_filepath)):
-            try:
-                os.makedirs(os.path.dirname(output_filepath))
-            except OSError as exc: # Guard against race condition
-                if exc.errno != errno.EEXIST:
-                    raise
-
-        with open(output_filepath, "w+") as f:
-            json.dump(results, f)
-        log(f"Wrote REopt results to {output_filepath}")
-        end = time.monotonic()
-        print(f"Run {run_id} took {round(end - start)} seconds to finish.")
-    except Exception as e:
-        print(e)
-    finally:
-        with thread_lock:
-            global REOPT_THREAD_COUNTER
-            REOPT_THREAD_COUNTER -= 1
-
-
-
-def reopt_poller(url, poll_interval=3):
+
+def submit_reopt_job(payload, api_key, session=None):
     """
-    Function for polling the REopt API results URL until status is not
-    "Optimizing..."
+    Post a job to REopt.
 
-    :param url: results url to poll
-    :param poll_interval: seconds
-    :return: dictionary response (once status is not "Optimizing...")
+    :param requests.Session session: Session to post with, defaults to the
+        shared REopt session.
+    :return: run_uuid of the job
     """
-    key_error_count = 0
-    key_error_threshold = 3
-    status = "Optimizing..."
+    session = session or http_session.get_session("reopt")
+    post_url = REOPT_URL + '/v1/job/?api_key=' + api_key
+    # Turn off verification because the private server certificate is
+    # expired...
+    verify = REOPT_URL == DEFAULT_REOPT_URL
+    # Serialize here since the loads are NumPy arrays.
+    resp = session.post(
+        post_url, data=json.dumps(payload, default=json_default),
+        headers={"Content-Type": "application/json"}, verify=verify)
+    if not resp.ok:
+        msg = "REopt status code {}. {}".format(resp.status_code,
+                                                resp.content)
+        raise RuntimeError(msg)
+
+    run_id_dict = json.loads(resp.text)
+    try:
+        return run_id_dict['run_uuid']
+    except KeyError:
+        msg = "Response from {} did not contain run_uuid.".format(post_url)
+        raise KeyError(msg)
+
+
+def reopt_results_url(run_id, api_key):
+    return REOPT_URL + f'/v1/job/{run_id}/results/?api_key=' + api_key
 
-    start = time.monotonic()
-    timeout = 500
 
-    while True:
-        resp = requests.get(url=url, verify=False)
+def get_reopt_results(url, session=None):
+    """
+    Get the REopt results URL once.
+
+    The response is streamed and only kept until the job status turns up, so
+    polls of a job that is still optimizing don't parse the full response.
+    The rest of the response is read and thrown away, up to
+    REOPT_DRAIN_BYTES, so the connection can be reused. The body is parsed
+    in full once the job has finished.
+
+    :return: dictionary of
+        - status: the job status, None if the response doesn't have one
+        - results: the response dictionary, None if the job is optimizing
+        - bytes: number of response bytes transferred
+        - seconds: time taken by the request
+        - retry_after: seconds the server asked us to wait before polling
+          again, or None
+    """
+    session = session or http_session.get_session("reopt")
+    start = time.monotonic()
+    with session.get(url=url, verify=False, stream=True) as resp:
+        body = bytearray()
+        status = None
+        chunks = resp.iter_content(chunk_size=65536)
+        for chunk in chunks:
+            # Search the tail of the last chunk as well in case the status
+            # straddles two chunks.
+            search_start = max(0, len(body) - 256)
+            body += chunk
+            if status is None:
+                match = REOPT_STATUS_PATTERN.search(body, search_start)
+                if match:
+                    status = match.group(1).decode('utf-8')
+                    if status == REOPT_OPTIMIZING:
+                        break
+        if status == REOPT_OPTIMIZING:
+            drained = 0
+            for chunk in chunks:
+                drained += len(chunk)
+                if drained > REOPT_DRAIN_BYTES:
+                    break
+        num_bytes = resp.raw.tell()
+        retry_after = http_session.parse_retry_after(resp)
+
+    resp_dict = None
+    if status != REOPT_OPTIMIZING:
         try:
-            resp_dict = json.loads(resp.content)
+            resp_dict = json.loads(body)
         except json.decoder.JSONDecodeError as e:
             print("Error reading REopt response:")
-            print(resp.content)
+            print(body)
             raise e
-
         try:
             status = resp_dict['outputs']['Scenario']['status']
         except KeyError:
-            key_error_count += 1
-            log('REopt KeyError count: {}'.format(key_error_count))
-            if key_error_count > key_error_threshold:
+            status = None
+
+    return {
+        "status": status,
+        "results": resp_dict,
+        "bytes": num_bytes,
+        "seconds": time.monotonic() - start,
+        "retry_after": retry_after,
+    }
+
+
+def check_reopt_results(results, run_id):
+    """
+    Raise a RuntimeError if the REopt job didn't finish with an optimal
+    solution.
+    """
+    if results['outputs']['Scenario']['status'] != 'optimal':
+        error_msg = results['messages'].get('error')
+        if error_msg:
+            print(error_msg)
+        raise RuntimeError(
+            f"Job {run_id} completed with non-optimal status: "
+            f"{results['outputs']['Scenario']['status']}")
+
+
+def write_reopt_results(results, output_filepath):
+    # Make directory if not existing
+    if not os.path.exists(os.path.dirname(output_filepath)):
+        try:
+            os.makedirs(os.path.dirname(output_filepath))
+        except OSError as exc: # Guard against race condition
+            if exc.errno != errno.EEXIST:
+                raise
+
+    with open(output_filepath, "w+") as f:
+        json.dump(results, f)
+    log(f"Wrote REopt results to {output_filepath}")
+
+
+class ReoptPoll:
+    """
+    Keep track of the polling of one REopt job.
+
+    The interval between polls starts at *poll_interval* and grows
+    exponentially up to *max_poll_interval*, with random jitter so jobs
+    submitted together don't poll in lockstep. An interval hinted by the
+    server with a Retry-After header takes precedence.
+    """
+
+    # Number of responses without a status to allow before giving up.
+    key_error_threshold = 3
+
+    def __init__(self, poll_interval=2, max_poll_interval=30, timeout=500,
+                 backoff_factor=1.5, jitter=0.2):
+        """
+        :param float poll_interval: Seconds to wait before the second poll.
+        :param float max_poll_interval: Longest number of seconds between
+            polls.
+        :param float timeout: Seconds to wait for the job to finish.
+        :param float backoff_factor: Growth of the interval after each poll.
+        :param float jitter: Maximum random spread of each interval, as a
+            fraction of the interval.
+        """
+        self.max_poll_interval = max_poll_interval
+        self.timeout = timeout
+        self.backoff_factor = backoff_factor
+        self.jitter = jitter
+
+        self.start = time.monotonic()
+        self.results = None
+        self.polls = 0
+        self.bytes = 0
+        self.latency = 0
+        self._interval = poll_interval
+        self._key_error_count = 0
+
+    def update(self, response):
+        """
+        Record a response from get_reopt_results.
+
+        :return: True if polling should stop.
+        """
+        self.polls += 1
+        self.bytes += response["bytes"]
+        self.latency += response["seconds"]
+        self.results = response["results"]
+
+        if response["status"] is None:
+            self._key_error_count += 1
+            log('REopt KeyError count: {}'.format(self._key_error_count))
+            if self._key_error_count > self.key_error_threshold:
                 log(
                     "Breaking polling loop due to KeyError count threshold of "
-                    "{} exceeded.".format(key_error_threshold))
-                break
-        if status != "Optimizing...":
-            break
-        elif (time.monotonic() - start) > timeout:
+                    "{} exceeded.".format(self.key_error_threshold))
+                return True
+        elif response["status"] != REOPT_OPTIMIZING:
+            return True
+        if (time.monotonic() - self.start) > self.timeout:
             raise RuntimeError("Breaking polling loop since timeout exceeded.")
-        else:
-            time.sleep(poll_interval)
+        return False
+
+    def next_interval(self, retry_after=None):
+        """
+        Seconds to wait before the next poll.
+        """
+        if retry_after is not None:
+            return retry_after
+        interval = self._interval
+        self._interval = min(
+            self._interval * self.backoff_factor, self.max_poll_interval)
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def summary(self):
+        mean_latency = self.latency / self.polls if self.polls else 0
+        return (
+            f"{self.polls} polls, {round(mean_latency * 1000)} ms mean poll "
+            f"latency, {round(self.bytes / 1000, 1)} kB transferred"
+        )
+
+
+class ReoptClient:
+    """
+    Submit and poll REopt jobs concurrently on a single asyncio event loop.
+
+    The event loop runs in a background thread so jobs can be submitted while
+    building simulations keep running in the main thread. The number of jobs
+    in flight is capped with a semaphore, and a job waiting between polls
+    only holds a timer on the loop. The blocking HTTP calls go through the
+    shared REopt session on the loop's executor, which has a thread for each
+    request that can be in flight rather than one for each job, so hundreds
+    of jobs can poll on a handful of threads and pooled connections.
+
+    With a JobLedger, the run_uuid of each job is recorded as soon as it's
+    submitted, and `resume` polls the jobs a previous run left outstanding.
+    """
+
+    def __init__(self, api_key=None, max_jobs=5, sleep=0, poll_interval=2,
+                 max_poll_interval=30, timeout=500, ledger=None,
+                 max_requests=None):
+        """
+        :param str api_key: NREL developer API key, defaults to the
+            NREL_DEV_KEY environment variable.
+        :param int max_jobs: Maximum number of REopt jobs to have submitted
+            or polling at any time.
+        :param float sleep: Number of seconds to wait between job submissions.
+        :param float poll_interval: Seconds to wait before the second poll of
+            a job.
+        :param float max_poll_interval: Longest number of seconds between
+            polls of a job.
+        :param float timeout: Seconds to wait for a job to finish.
+        :param JobLedger ledger: Ledger to record the jobs in.
+        :param int max_requests: Maximum number of blocking calls, mostly
+            REopt API requests, to make at once. Defaults to the smaller of
+            max_jobs and the HTTP connection pool size.
+        """
+        self.api_key = api_key or get_api_key()
+        self.max_jobs = max_jobs
+        self.max_requests = max_requests or min(
+            max_jobs, http_session.POOL_SIZE)
+        self.sleep = sleep
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.timeout = timeout
+        self.ledger = ledger
+        # Polling statistics of each finished job.
+        self.job_stats = []
+
+        self.session = http_session.get_session("reopt")
+
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(
+            concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_requests))
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        # Made on the event loop the first time they're needed.
+        self._semaphore = None
+        self._submit_lock = None
+        self._futures = []
+
+    def submit(self, payload, output_filepath, cache=None):
+        """
+        Queue a REopt job and write its results once finished.
+
+        :param ReoptCache cache: Cache to also store the results in.
+        :return: concurrent.futures.Future for the job
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self.call_reopt_and_write(payload, output_filepath, cache),
+            self.loop)
+        self._futures.append(future)
+        return future
+
+    def resume(self, ledger=None, cache=None):
+        """
+        Poll the jobs that were submitted but whose results weren't written,
+        and write their results once finished, instead of submitting them
+        again.
+
+        :param JobLedger ledger: Ledger of the jobs, defaults to the
+            client's ledger.
+        :param ReoptCache cache: Cache to also store the results in.
+        :return: list of concurrent.futures.Future for the jobs
+        """
+        ledger = ledger or self.ledger
+        futures = []
+        for job in ledger.outstanding():
+            log(f"Resuming REopt job {job['run_uuid']} for "
+                f"{job['output_path']}")
+            future = asyncio.run_coroutine_threadsafe(
+                self.call_reopt_and_write(
+                    None, job['output_path'], cache, run_id=job['run_uuid'],
+                    key=job['payload_hash']),
+                self.loop)
+            futures.append(future)
+        self._futures.extend(futures)
+        return futures
+
+    @property
+    def num_active(self):
+        """
+        Number of jobs that haven't finished yet.
+        """
+        return sum(not future.done() for future in self._futures)
 
-    return resp_dict
+    def wait(self):
+        """
+        Block until all submitted jobs have finished.
+        """
+        concurrent.futures.wait(self._futures)
+
+    def close(self):
+        """
+        Wait for all submitted jobs, then shut down the event loop.
+        """
+        self.wait()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    async def call_reopt_and_write(self, payload, output_filepath,
+                                   cache=None, run_id=None, key=None):
+        """
+        Call REopt and write results.
+
+        :param str run_id: run_uuid of a job that was already submitted, to
+            poll instead of submitting the payload.
+        :param str key: reopt_cache.payload_hash of the payload, needed to
+            cache the results if the payload isn't given.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_jobs)
+            self._submit_lock = asyncio.Lock()
+
+        async with self._semaphore:
+            start = time.monotonic()
+            poll = None
+            try:
+                if key is None and payload is not None and (
+                        self.ledger is not None or cache is not None):
+                    key = payload_hash(payload)
+                if run_id is None:
+                    async with self._submit_lock:
+                        log(f"Making REopt call to {REOPT_URL}...")
+                        run_id = await self._run(
+                            submit_reopt_job, payload, self.api_key,
+                            self.session)
+                        if self.ledger is not None:
+                            await self._run(
+                                self.ledger.reopt_submitted, output_filepath,
+                                run_id, key)
+                        if self.sleep:
+                            await asyncio.sleep(self.sleep)
+                poll = await self.poll(
+                    reopt_results_url(run_id, self.api_key))
+                check_reopt_results(poll.results, run_id)
+                await self._run(
+                    write_reopt_results, poll.results, output_filepath)
+                if cache is not None and key is not None:
+                    await self._run(cache.put, payload, poll.results, key)
+            except Exception as e:
+                print(e)
+                # A job that was submitted but not polled to the end may
+                # still be optimizing, so it's left as submitted to be polled
+                # again.
+                if self.ledger is not None and (
+                        run_id is None or poll is not None):
+                    await self._run(
+                        self.ledger.reopt_failed, output_filepath, str(e))
+                raise
+            end = time.monotonic()
+            if self.ledger is not None:
+                await self._run(
+                    self.ledger.reopt_written, output_filepath, end - start)
+            self.job_stats.append({
+                "run_uuid": run_id,
+                "seconds": end - start,
+                "polls": poll.polls,
+                "poll_latency": poll.latency / poll.polls,
+                "bytes": poll.bytes,
+            })
+            print(f"Run {run_id} took {round(end - start)} seconds to finish "
+                  f"({poll.summary()}).")
+
+    async def poll(self, url):
+        """
+        Poll the REopt API results URL until status is not "Optimizing..."
+
+        :return: ReoptPoll with the response dictionary (once status is not
+            "Optimizing...") and the polling statistics
+        """
+        poll = ReoptPoll(
+            self.poll_interval, self.max_poll_interval, self.timeout)
+        while True:
+            response = await self._run(get_reopt_results, url, self.session)
+            if poll.update(response):
+                break
+            await asyncio.sleep(poll.next_interval(response["retry_after"]))
+        return poll
+
+    async def _run(self, func, *args):
+        """
+        Run a blocking function on the event loop's executor.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            None, func, *args)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Run our scenarios.')
     parser.add_argument('--run-all', default=False, action='store_true',
                         help=f'run all scenarios in {TEMPLATE_DIRECTORY}')
+    parser.add_argument('--plan', action='store_true',
+                        help="Report how many simulations and REopt jobs "
+                             "--run-all would run and estimate how long "
+                             "they'd take, without running anything.")
     parser.add_argument('--pattern', type=str,
                         help='regex pattern to restrict which files are run '
                              'with --run-all')
     parser.add_argument('--file',
-                        help=f'run a specified scenario in {TEMPLATE_DIRECTORY}')
+                        help=f'run a specified scenario in {TEMPLATE_DIRECTORY}, '
+                             'or the template with this tag or filename in '
+                             '--manifest')
+    parser.add_argument('--manifest',
+                        help="Read the templates from this manifest written "
+                             "by generate_templates.py --manifest instead of "
+                             f"from {TEMPLATE_DIRECTORY}.")
     parser.add_argument('--reopt-async', action='store_true',
-                        help=f"Don't wait for REopt to finish before continuing.")
+                        help="Don't wait for REopt to finish before "
+                             "continuing with --file. --run-all always "
+                             "simulates the next scenarios while REopt runs, "
+                             "and waits for REopt at the end.")
     parser.add_argument('--max-reopt-threads', default=5, type=int,
                         help="Maximum number of simultaneous REopt jobs to "
-                             "run at any time.")
+                             "submit or poll at any time.")
+    parser.add_argument('--reopt-timeout', default=500, type=float,
+                        help="Seconds to wait for a REopt job to finish.")
     parser.add_argument('--ignore-scenario-cache', action='store_true',
                         help=f"Rerun OpenStudio for each scenario.")
     parser.add_argument('--ignore-reopt-cache', action='store_true',
                         help=f"Rerun REopt every time.")
+    parser.add_argument('--reopt-cache-size', default=20, type=float,
+                        help="Maximum size of the REopt results cache in "
+                             f"{REOPT_CACHE_PATH}, in GB.")
     parser.add_argument('--skip-reopt', action='store_true',
                         help=f"Don't run REopt on the scenarios.")
     parser.add_argument('--trace', action='store_true',
@@ -745,38 +1549,111 @@ if __name__ == "__main__":
     parser.add_argument('--sleep', default=0, type=int,
                         help=
                             "Number of seconds to sleep between REopt calls "
-                            "to prevent hitting the REopt API limit. Only "
-                            "applies if the --reopt-async"
-                            "flag is set.")
+                            "to prevent hitting the REopt API limit, with "
+                            "--file or --run-all.")
+    parser.add_argument('--reopt-rate-limit', type=float,
+                        default=float(os.environ.get('REOPT_RATE_LIMIT', 1000)),
+                        help="Maximum number of REopt API requests, "
+                             "submissions and polls together, per hour. 0 "
+                             "for no limit.")
+    parser.add_argument('--reopt-burst', default=10, type=int,
+                        help="Number of REopt API requests that can be made "
+                             "back to back under the rate limit.")
     parser.add_argument('--reverse', action='store_true',
                         help=f"Reverse the order which scenarios are run.")
+    parser.add_argument('--id-scheme', choices=ID_SCHEMES,
+                        default=DEFAULT_ID_SCHEME,
+                        help="How to make the IDs in scenario names and REopt "
+                             "results filenames. legacy keeps the names of "
+                             "existing runs and results, canonical renames "
+                             "them all. Defaults to the ID_SCHEME environment "
+                             "variable, or legacy.")
+    parser.add_argument('--ledger', default=JOB_LEDGER_PATH,
+                        help="SQLite file to record the progress of the "
+                             "scenarios and REopt jobs in, so an interrupted "
+                             "run can be resumed.")
+    parser.add_argument('--no-ledger', action='store_true',
+                        help="Don't record progress or resume REopt jobs.")
+    parser.add_argument('--jobs', default=1, type=int,
+                        help="Number of building simulations to run at once "
+                             "with --run-all.")
+    parser.add_argument('--post-process-jobs', type=int,
+                        help="Number of scenarios to post-process at once "
+                             "with --run-all, defaults to --jobs.")
+    parser.add_argument('--queue-size', default=8, type=int,
+                        help="Number of items that can wait for each stage "
+                             "of the --run-all pipeline.")
     args = parser.parse_args()
+    Simulation.id_scheme = args.id_scheme
 
     start = time.monotonic()
 
     reopt_wait = not args.reopt_async
 
+    # A plan only reads the ledger and cache, so doesn't make them.
+    ledger = None
+    if not args.no_ledger and \
+            not (args.plan and not os.path.exists(args.ledger)):
+        ledger = JobLedger(args.ledger)
+
+    reopt_client = None
+    reopt_cache = None
+    if args.plan:
+        if not args.skip_reopt and os.path.isdir(REOPT_CACHE_PATH):
+            reopt_cache = ReoptCache(REOPT_CACHE_PATH)
+    elif not args.skip_reopt:
+        reopt_cache = ReoptCache(
+            REOPT_CACHE_PATH, max_bytes=int(args.reopt_cache_size * 10**9))
+        # The client makes at most POOL_SIZE requests at once, so the
+        # default pool keeps a connection alive for each of them.
+        http_session.configure(
+            "reopt", rate_limit=args.reopt_rate_limit, burst=args.reopt_burst)
+        reopt_client = ReoptClient(
+            max_jobs=args.max_reopt_threads, sleep=args.sleep,
+            timeout=args.reopt_timeout, ledger=ledger)
+        if ledger is not None:
+            # Pick up the jobs a previous run left in flight.
+            resumed = reopt_client.resume(cache=reopt_cache)
+            if resumed:
+                log(f"Resuming {len(resumed)} outstanding REopt jobs")
+
     if args.file:
-        template = os.path.join(TEMPLATE_DIRECTORY, args.file)
-        simulation = Simulation.from_json(template)
-        simulation.write_mapper_csv()
-        simulation.write_scenario_json()
-        simulation.run_building_sim(
-            not args.ignore_scenario_cache, trace=args.trace)
-        # simulation.cleanup()
-        end = time.monotonic()
-        log(f"Finished building simulation in {round(end - start, 1)} seconds.")
-        if not args.skip_reopt:
-            simulation.call_reopt(
-                wait=reopt_wait, use_cached=not args.ignore_reopt_cache,
-                sleep=args.sleep, max_threads=args.max_reopt_threads)
-        end = time.monotonic()
-    elif args.run_all:
+        if args.manifest:
+            template = args.file
+            data = get_template(args.manifest, filename_tag(args.file))
+            if data is None:
+                raise SystemExit(f"{args.file} isn't in {args.manifest}")
+        else:
+            template = os.path.join(TEMPLATE_DIRECTORY, args.file)
+            data = next(read_templates([template]))[1]
+        templates = [(template, data)]
+        if not args.plan:
+            simulation = Simulation.from_dict(data)
+            simulation.write_mapper_csv()
+            simulation.write_scenario_json()
+            if ledger is not None:
+                ledger.set_scenario_stage(
+                    simulation.scenario_name, "written", template=template)
+            simulation.run_building_sim(
+                not args.ignore_scenario_cache, trace=args.trace, ledger=ledger)
+            # simulation.cleanup()
+            end = time.monotonic()
+            log(f"Finished building simulation in {round(end - start, 1)} "
+                "seconds.")
+            if not args.skip_reopt:
+                simulation.call_reopt(
+                    wait=reopt_wait, use_cached=not args.ignore_reopt_cache,
+                    client=reopt_client, cache=reopt_cache)
+            end = time.monotonic()
+    elif (args.run_all or args.plan) and args.manifest:
+        # Templates come out of the manifest already filtered and sorted.
+        templates = list(read_manifest(args.manifest, pattern=args.pattern))
+        if args.reverse:
+            templates.reverse()
+    elif args.run_all or args.plan:
         files = os.listdir(TEMPLATE_DIRECTORY)
         templates = []
 
-        request_threads = []
-
         for f in files:
             if re.match(r'template-.*-\d+.json', f):
                 # Check regex match if we've specified a pattern.
@@ -789,46 +1666,41 @@ if __name__ == "__main__":
         templates = sorted(templates)
         if args.reverse:
             templates.reverse()
-        total = len(templates)
-        number_run = 0
-        start = time.monotonic()
-
-        for i, template in enumerate(templates):
-            loop_start = time.monotonic()
-            template = os.path.join(TEMPLATE_DIRECTORY, template)
-
-            log(f"Running template {template}")
-            simulation = Simulation.from_json(template)
-            simulation.write_mapper_csv()
-            simulation.write_scenario_json()
-            try:
-                simulation.run_building_sim(
-                    not args.ignore_scenario_cache, args.trace)
-                simulation.cleanup()
-            except Exception as e:
-                log("ERROR:")
-                log(e)
-            end = time.monotonic()
-            log(
-                f"Finished building simulation in {end - loop_start} seconds.")
-            try:
-                if not args.skip_reopt:
-                    reopt_threads = simulation.call_reopt(
-                        wait=reopt_wait, sleep=args.sleep,
-                        use_cached=not args.ignore_reopt_cache,
-                        max_threads=args.max_reopt_threads)
-            except Exception as e:
-                log("Error running REopt")
-                log(e)
-
-            remaining = total - i - 1
-            estimated_remaining = (
-                (end  - start) / (i + 1) * remaining) / 60
-            log(f"Simulation {i+1} of {total} finished.")
-            log("Estimated remaining time: "
-                  f"{round(estimated_remaining, 1)} min")
-            log("Total time elapsed since start: "
-                f"{round((time.monotonic() - start) / 60, 1)} min")
-
-    if REOPT_THREAD_COUNTER == 0:
-        sys.exit(0)
+        templates = read_templates(
+            os.path.join(TEMPLATE_DIRECTORY, template)
+            for template in templates
+        )
+    workers = {
+        "simulate": args.jobs,
+        "post_process": args.post_process_jobs or args.jobs,
+        "reopt": args.max_reopt_threads,
+    }
+    if args.plan:
+        log(plan_report(plan_sweep(
+            templates, workers=workers,
+            use_cached=not args.ignore_scenario_cache,
+            use_reopt_cache=not args.ignore_reopt_cache,
+            skip_reopt=args.skip_reopt, cache=reopt_cache, ledger=ledger,
+            rate_limit=args.reopt_rate_limit)))
+    elif args.run_all:
+        runner = ScenarioPipeline(
+            workers=workers,
+            queue_size=args.queue_size,
+            use_cached=not args.ignore_scenario_cache,
+            use_reopt_cache=not args.ignore_reopt_cache, trace=args.trace,
+            skip_reopt=args.skip_reopt, cache=reopt_cache, ledger=ledger,
+            client=reopt_client)
+        runner.run(templates)
+
+    if reopt_client is not None:
+        if reopt_client.num_active:
+            log(f"Waiting for {reopt_client.num_active} REopt jobs to "
+                "finish...")
+        reopt_client.close()
+        reopt_cache.close()
+        log(reopt_cache.summary())
+        log("REopt API: "
+            + http_session.get_session("reopt").rate_limiter.summary())
+    if ledger is not None:
+        log(ledger.summary())
+        ledger.close()
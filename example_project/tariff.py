@@ -3,24 +3,34 @@ Visualization of utility tariffs
 """
 import calendar
 import logging
-import json
 
 import matplotlib.pyplot as plt
-import requests
+import numpy as np
 import seaborn as sns
 
+import urdb
+
 log = logging.getLogger(__name__)
 
+# Year the buildings are simulated in and the REopt loads are posted for,
+# which sets the days of the week loads are priced on. Jan 1 is a Monday.
+LOAD_YEAR = 2007
+
 
 class Rate(object):
 
-    def __init__(self, rate, util=None):
+    def __init__(self, rate, util=None, cache=None):
         """
         :param rate: str, rate name (must include util name) or URDB rate label
         :param util: str, optional
+        :param cache: urdb.TariffCache to get the rate from, defaults to the
+            shared cache. False to always download the rate.
         """
         self.util = util
         self.rate = rate  # rate name string
+        self.cache = urdb.default_cache() if cache is None else cache
+        # CompiledRate objects by (year, timesteps per hour).
+        self._compiled = {}
 
         self.urdb_dict = self.get_rate() # can return None
 
@@ -38,75 +48,12 @@ class Rate(object):
 
     def download_rate(self):
         """
-        Check URDB for rate.
+        Check the URDB cache, or URDB if there isn't one, for the rate.
         :return: Either rate dict or None
         """
-
-        url_base = "http://api.openei.org/utility_rates?"
-        api_key = "BLLsYv81d8y4w6UPYCfGFsuWlu4IujlZYliDmoq6"
-        request_params = {
-            "version": "8",
-            "format": "json",
-            "detail": "full",
-            "api_key": api_key,
-        }
-
-        using_rate_label = False
-        # no spaces in rate label, assume spaces in rate name
-        if " " not in self.rate or self.util is None:
-            request_params["getpage"] = self.rate
-            using_rate_label = True
-
-        else:
-            # have to replace '&' to handle url correctly
-            request_params["ratesforutility"] = self.util.replace("&", "%26")
-
-        log.info('Checking URDB for {}...'.format(self.rate))
-        res = requests.get(url_base, params=request_params, verify=False)
-
-        if not res.ok:
-            log.debug('URDB response not OK. Code {} with message: {}'.format(res.status_code, res.text))
-            raise Warning('URDB response not OK.')
-            # return None
-
-        data = json.loads(res.text, strict=False)
-        rates_in_util = data['items']  # data['items'] contains a list of dicts, one dict for each rate in util
-
-        if len(rates_in_util) == 0:
-            log.info('Could not find {} in URDB.'.format(self.rate))
-            return None
-
-        if not using_rate_label:
-            matched_rates = []
-            start_dates = []
-
-            for rate in rates_in_util:
-
-                if rate['name'] == self.rate:
-                    matched_rates.append(rate)  # urdb can contain multiple rates of same name
-
-                    if 'startdate' in rate:
-                        start_dates.append(rate['startdate'])
-
-            # find the newest rate of those that match the self.rate
-            newest_index = 0
-
-            if len(start_dates) > 1 and len(start_dates) == len(matched_rates):
-                newest_index = start_dates.index(max(start_dates))
-
-            if len(matched_rates) > 0:
-                newest_rate = matched_rates[newest_index]
-                return newest_rate
-            else:
-                log.info('Could not find {} in URDB.'.format(self.rate))
-                return None
-
-        elif rates_in_util[0]['label'] == self.rate:
-            return rates_in_util[0]
-
-        else:
-            log.info('Could not find {} in URDB'.format(self.rate))
-            return None
+        if self.cache:
+            return self.cache.get_rate(self.rate, self.util)
+        return urdb.download_rate(self.rate, self.util)
 
     def energy_rate(self, month, hour, weekend, tier=0):
         """
@@ -122,6 +69,32 @@ class Rate(object):
         return self.demandratestructure[period][tier]
 
 
+    def compile(self, year=LOAD_YEAR, timesteps_per_hour=1):
+        """
+        Compile the rate into arrays of the period and price at every
+        timestep of a year, for pricing whole load series.
+
+        Compiled rates are cached, so compiling again is free.
+
+        :param int year: Year, which sets the days of the week.
+        :param int timesteps_per_hour: Timesteps per hour of the loads that
+            will be priced.
+        :rtype: CompiledRate
+        """
+        key = (year, timesteps_per_hour)
+        if key not in self._compiled:
+            self._compiled[key] = CompiledRate(self, year, timesteps_per_hour)
+        return self._compiled[key]
+
+    def bill(self, loads_kw, year=LOAD_YEAR, timesteps_per_hour=1):
+        """
+        Return the energy and demand costs of a load series, or of a 2-D
+        batch of load series with one per row.
+
+        See `CompiledRate.bill`.
+        """
+        return self.compile(year, timesteps_per_hour).bill(loads_kw)
+
     def get_period(self, month, hour, weekend=False, schedule_type='energy'):
         """
         Get the numerical utility period for the given parameters.
@@ -382,5 +355,241 @@ class Rate(object):
         return hours
 
 
+class CompiledRate(object):
+    """
+    Periods and prices of a rate at every timestep of a year.
+
+    Arrays with one entry per timestep:
+        month: Month, with January = 0
+        hour: Hour, with midnight = 0
+        weekend: True on Saturdays and Sundays
+        energy_period: Energy period number
+        energy_price: $ / kWh of the first tier, including adjustments.
+            Bills of tiered rates use the tiers instead.
+        demand_period: Demand period number, or None if the rate doesn't have
+            a time of use demand charge
+        demand_price: $ / kW of the first tier, or None
+
+    Prices include the URDB `adj` adjustment on top of the `rate`.
+    """
+
+    def __init__(self, rate, year=LOAD_YEAR, timesteps_per_hour=1):
+        """
+        :param Rate rate: Rate to compile
+        :param int year: Year, which sets the days of the week.
+        :param int timesteps_per_hour: Timesteps per hour of the loads.
+        """
+        if 60 % timesteps_per_hour:
+            raise ValueError(
+                f"Invalid timesteps_per_hour: {timesteps_per_hour}")
+        self.year = year
+        self.timesteps_per_hour = timesteps_per_hour
+
+        step = np.timedelta64(60 // timesteps_per_hour, 'm')
+        times = np.arange(
+            np.datetime64(f"{year}-01-01T00:00"),
+            np.datetime64(f"{year + 1}-01-01T00:00"), step)
+        days = times.astype('datetime64[D]')
+        self.month = times.astype('datetime64[M]').astype(int) % 12
+        self.hour = (times - days).astype('timedelta64[h]').astype(int)
+        # 1970-01-01 was a Thursday, so Monday = 0.
+        self.weekend = (days.astype(int) + 3) % 7 >= 5
+        # Index of the first timestep of each month.
+        self.month_starts = np.searchsorted(self.month, np.arange(12))
+
+        self.energy_period = self._periods(
+            rate.energyweekdayschedule, rate.energyweekendschedule)
+        self.energy_period_price = _tier_prices(rate.energyratestructure)
+        self.energy_price = self.energy_period_price[self.energy_period]
+        self.tiered = rate.has_tiered_energy_charge
+        if self.tiered:
+            self._compile_tiers(rate.energyratestructure)
+
+        self.demand_period = None
+        self.demand_price = None
+        # (month, $ / kW, timestep indices) of each demand period in each
+        # month, to take the peaks over.
+        self._demand_windows = []
+        if rate.has_demand_charge:
+            self.demand_period = self._periods(
+                rate.demandweekdayschedule, rate.demandweekendschedule)
+            period_price = _tier_prices(rate.demandratestructure)
+            self.demand_price = period_price[self.demand_period]
+            for month in range(12):
+                in_month = self.month == month
+                for period in np.unique(self.demand_period[in_month]):
+                    self._demand_windows.append((
+                        month, period_price[period],
+                        np.flatnonzero(
+                            in_month & (self.demand_period == period))
+                    ))
+
+        # $ / kW of the monthly peak by month, for flat demand charges.
+        self.flat_demand_price = None
+        flat_structure = rate.urdb_dict.get('flatdemandstructure')
+        flat_months = rate.urdb_dict.get('flatdemandmonths')
+        if flat_structure and flat_months:
+            self.flat_demand_price = \
+                _tier_prices(flat_structure)[np.array(flat_months)]
+
+    def __len__(self):
+        return len(self.month)
+
+    def _compile_tiers(self, structure):
+        """
+        Set up the arrays for pricing tiered energy charges.
+
+        Tier bounds and prices are looked up at every timestep from the
+        timestep's month and energy period, so the bounds can be compared
+        against the cumulative usage of the month.
+        """
+        days_in_month = np.bincount(
+            self.month, minlength=12) / (24 * self.timesteps_per_hour)
+        num_tiers = max(len(period) for period in structure)
+        # Lower kWh bound, kWh width and price of each tier of each period
+        # in each month. Missing tiers have no width, so nothing is priced
+        # in them.
+        lower = np.zeros((12, len(structure), num_tiers))
+        width = np.zeros((12, len(structure), num_tiers))
+        price = np.zeros((len(structure), num_tiers))
+        for period, tiers in enumerate(structure):
+            bound = np.zeros(12)
+            for tier_num, tier in enumerate(tiers):
+                upper = tier.get('max')
+                unit = tier.get('unit', 'kWh')
+                if unit not in ('kWh', 'kWh daily'):
+                    raise ValueError(f"Unsupported energy tier unit: {unit}")
+                # The last tier takes all the usage above the ones before it,
+                # whatever its max says, as in REopt's billing.
+                if upper is None or tier_num == len(tiers) - 1:
+                    upper = np.full(12, np.inf)
+                elif unit == 'kWh daily':
+                    upper = upper * days_in_month
+                else:
+                    upper = np.full(12, float(upper))
+                lower[:, period, tier_num] = bound
+                width[:, period, tier_num] = upper - bound
+                price[period, tier_num] = \
+                    tier.get('rate', 0) + tier.get('adj', 0)
+                if np.isinf(upper).all():
+                    break
+                bound = upper
+        # Tiers along the first axis, timesteps along the second.
+        self._tier_lower = lower[self.month, self.energy_period].T
+        self._tier_width = width[self.month, self.energy_period].T
+        self._tier_price = price[self.energy_period].T
+
+    def _tier_steps(self, loads):
+        """
+        Yield each tier number and the kWh used in that tier at every
+        timestep.
+
+        Tiers are reached by the cumulative usage of the whole month, and
+        the kWh of each timestep fall in the tiers of its own energy period
+        that lie between the month's total before and after the timestep.
+        """
+        kwh = loads / self.timesteps_per_hour
+        after = np.cumsum(kwh, axis=-1)
+        month_start = np.zeros(loads.shape[:-1] + (12,))
+        month_start[..., 1:] = after[..., self.month_starts[1:] - 1]
+        after -= month_start[..., self.month]
+        before = after - kwh
+        for tier, (lower, width) in enumerate(
+                zip(self._tier_lower, self._tier_width)):
+            steps = np.clip(after - lower, 0, width) \
+                - np.clip(before - lower, 0, width)
+            if tier == 0:
+                # Net negative usage is credited at the first tier.
+                steps += np.minimum(after, 0) - np.minimum(before, 0)
+            yield tier, steps
+
+    def tier_usage(self, loads_kw):
+        """
+        Return the kWh used in each tier in each month.
+
+        Tier `max` values are applied to the cumulative usage of the whole
+        month, across all energy periods. Each timestep's kWh are priced at
+        its own period's price for the tier that total has reached.
+
+        :param loads_kw: Load in kW at every timestep, with the timesteps
+            along the last axis.
+        :return: Array with the months and tiers along the last two axes.
+        """
+        loads = np.asarray(loads_kw, dtype=float)
+        return np.stack([
+            np.add.reduceat(steps, self.month_starts, axis=-1)
+            for _, steps in self._tier_steps(loads)
+        ], axis=-1)
+
+    def _periods(self, weekday_schedule, weekend_schedule):
+        """
+        Return the period of every timestep from 12 x 24 schedules.
+        """
+        weekday = np.array(weekday_schedule)[self.month, self.hour]
+        weekend = np.array(weekend_schedule)[self.month, self.hour]
+        return np.where(self.weekend, weekend, weekday)
+
+    def bill(self, loads_kw):
+        """
+        Return the energy and demand costs of a load series, or of a 2-D
+        batch of load series with one per row.
+
+        Energy is priced by tier if the rate has tiers, see `tier_usage`.
+        Demand charges are the peak load
+        of each demand period in each month times its price, plus the flat
+        demand charge on each month's peak.
+
+        :param loads_kw: Load in kW at every timestep, as an array with the
+            timesteps along the last axis.
+        :return: dict of monthly `energy` and `demand` costs, with the months
+            along the last axis, and the `energy_annual`, `demand_annual` and
+            `total_annual` costs.
+        """
+        loads = np.asarray(loads_kw, dtype=float)
+        if loads.shape[-1] != len(self):
+            raise ValueError(
+                f"Expected {len(self)} timesteps for {self.year} at "
+                f"{self.timesteps_per_hour} per hour, got {loads.shape[-1]}")
+
+        if self.tiered:
+            energy = sum(
+                np.add.reduceat(
+                    steps * self._tier_price[tier], self.month_starts,
+                    axis=-1)
+                for tier, steps in self._tier_steps(loads))
+        else:
+            energy = np.add.reduceat(
+                loads * (self.energy_price / self.timesteps_per_hour),
+                self.month_starts, axis=-1)
+
+        demand = np.zeros(loads.shape[:-1] + (12,))
+        for month, price, window in self._demand_windows:
+            demand[..., month] += loads[..., window].max(axis=-1) * price
+        if self.flat_demand_price is not None:
+            demand += np.maximum.reduceat(
+                loads, self.month_starts, axis=-1) * self.flat_demand_price
+
+        energy_annual = energy.sum(axis=-1)
+        demand_annual = demand.sum(axis=-1)
+        return {
+            "energy": energy,
+            "demand": demand,
+            "energy_annual": energy_annual,
+            "demand_annual": demand_annual,
+            "total_annual": energy_annual + demand_annual,
+        }
+
+
+def _tier_prices(structure, tier=0):
+    """
+    Return the price of a tier of each period in a URDB rate structure,
+    including the adjustment.
+    """
+    return np.array([
+        period[tier].get('rate', 0) + period[tier].get('adj', 0)
+        for period in structure
+    ])
+
+
 def _all_equal(iterator):
     return len(set(iterator)) <= 1
@@ -1,21 +1,37 @@
 """
 Read the sites.csv, tariffs.csv, and storage.csv files to create all possible
 iterations of template JSONs give the options.
+
+Templates are generated one combination at a time and written on a pool of
+worker processes. A template file is only rewritten if its content changed,
+so regenerating a sweep leaves the files of unchanged templates alone. The
+hash of each template written is kept in an index next to the templates, so
+unchanged templates don't even need to be formatted or read back:
+
+    python generate_templates.py --jobs 8
+
+Large sweeps can be written to a single manifest file instead of a file per
+template, which scenarios.py --manifest reads templates from by tag or
+filename pattern. Manifests ending in .sqlite or .db are SQLite databases
+indexed on the tag, others are JSON Lines with a template per line:
+
+    python generate_templates.py --manifest templates.sqlite
 """
 import argparse
+import collections
+import concurrent.futures
 import csv
+import functools
 import hashlib
 import itertools
 import json
 import os
 import pprint
+import re
+import sqlite3
 
-import pandas as pd
-from timezonefinder import TimezoneFinder
 import yaml
 
-timezone_finder = TimezoneFinder()
-
 SITES_FILE = "sites.csv"
 TARIFFS = "tariffs.csv"
 STORAGE = "storage.csv"
@@ -23,7 +39,41 @@ STORAGE = "storage.csv"
 # Directory to throw all the JSONs into.
 TEMPLATE_DIRECTORY = 'outputs'
 
-os.makedirs(TEMPLATE_DIRECTORY, exist_ok=True)
+# Number of combinations sent to a worker process at a time.
+CHUNK_SIZE = 256
+# Number of chunks per worker process to submit ahead of the results being
+# read, so only a few chunks are in memory however many combinations there
+# are.
+CHUNKS_AHEAD = 2
+
+# Index in the template directory of the hash, modification time and size of
+# each template written.
+HASH_INDEX = ".template_hashes.json"
+
+# Index the worker processes check templates against.
+_hash_index = {}
+
+# Ways of making the IDs in template tags and scenario names. "legacy" gives
+# the IDs of the existing templates, run folders and results files, so it's
+# the default. "canonical" hashes the whole dictionary, and changes every
+# name.
+ID_SCHEMES = ("legacy", "canonical")
+DEFAULT_ID_SCHEME = os.environ.get("ID_SCHEME", "legacy")
+
+# Extensions of manifests that are SQLite databases rather than JSON Lines.
+SQLITE_EXTENSIONS = (".sqlite", ".sqlite3", ".db")
+
+MANIFEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS templates (
+    tag TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    location TEXT,
+    hash TEXT NOT NULL,
+    template TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS templates_filename ON templates (filename);
+CREATE INDEX IF NOT EXISTS templates_location ON templates (location);
+"""
 
 
 def csv_load(file_name):
@@ -31,19 +81,67 @@ def csv_load(file_name):
         return list(list(rec) for rec in csv.reader(f, delimiter=','))
 
 
-def getID(mydic):
+def csv_dicts(file_name):
+    """
+    Return the rows of a CSV file as dictionaries keyed on the header.
+    """
+    with open(file_name, 'r', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+@functools.lru_cache(maxsize=None)
+def timezone_finder():
+    # Loading the timezone data is slow, so only do it if it's needed.
+    from timezonefinder import TimezoneFinder
+    return TimezoneFinder()
+
+
+@functools.lru_cache(maxsize=None)
+def timezone_at(latitude, longitude):
+    """
+    Return the name of the timezone at a location, looking up each location
+    once.
+    """
+    return timezone_finder().timezone_at(lat=latitude, lng=longitude)
+
+
+def getID(mydic, scheme=DEFAULT_ID_SCHEME):
     """
     Create unique ID to tag JSON.
+
+    The canonical scheme hashes the dictionary serialized with sorted keys,
+    so the ID changes if values are swapped between keys, and is a number of
+    up to 16 digits. The legacy scheme sums the hashes of each key and the
+    str() of each value, and is a number of up to 10 digits.
     """
-    ID = 0
-    for x in mydic.keys():
-        # Hash the content
-        ID = ID + int(
-            hashlib.sha256(str(mydic[x]).encode('utf-8')).hexdigest(), 16
-            )
-        # Hash the key
-        ID = ID + int(hashlib.sha256(x.encode('utf-8')).hexdigest(), 16)
-    return (ID % 10**10)
+    if scheme == "legacy":
+        ID = 0
+        for key, value in mydic.items():
+            ID += _legacy_hash(str(value)) + _legacy_hash(key)
+        return ID % 10**10
+    if scheme != "canonical":
+        raise ValueError(f"Unknown ID scheme {scheme}")
+    content = json.dumps(
+        mydic, sort_keys=True, separators=(',', ':'), ensure_ascii=False,
+        default=_json_default)
+    digest = hashlib.sha256(content.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % 10**16
+
+
+@functools.lru_cache(maxsize=4096)
+def _legacy_hash(text):
+    # Only the last 10 digits of the sum are kept, so each hash can be
+    # reduced first.
+    digest = hashlib.sha256(text.encode('utf-8')).digest()
+    return int.from_bytes(digest, 'big') % 10**10
+
+
+def _json_default(obj):
+    # NumPy arrays and scalars.
+    if hasattr(obj, "tolist"):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON "
+                    "serializable")
 
 
 def flatten_dict(d):
@@ -58,6 +156,444 @@ def flatten_dict(d):
     return dict(items())
 
 
+def combinations(sites, tariffs, storage, location=None):
+    """
+    Generate every combination of a site, tariff and storage row, as a
+    single dictionary of all their columns.
+
+    The timezone of each site is looked up once and added to its rows.
+
+    :param str location: Only generate combinations for this location.
+    """
+    sites = [
+        {**site, 'timezone': timezone_at(
+            float(site['latitude']), float(site['longitude']))}
+        for site in sites
+        if not location or site['location'] == location
+    ]
+    for site, tariff, storage_row in itertools.product(
+            sites, tariffs, storage):
+        yield {**site, **tariff, **storage_row}
+
+
+def make_template(row, default_building, id_scheme=DEFAULT_ID_SCHEME):
+    """
+    Make the template for a combination of a site, tariff and storage row.
+
+    :param str id_scheme: getID scheme of the ID in the tag.
+
+    :return: Tuple of the template's filename and the template dictionary
+    """
+    if row['net metering'] == 'true':
+        net_metering_limit = 100
+    else:
+        net_metering_limit = 0
+
+    tariff_name = row['tariff name']
+    location = row['location']
+    schedules_type = row['schedules_type']
+    building = {
+        **default_building, **{'schedules_type': schedules_type}
+    }
+    # Optional add of occupant types so we don't change the UUIDs of the
+    # scenarios already generated
+    if row['occupant_types']:
+        building['schedules_occupant_types'] = row['occupant_types']
+
+    building['hvac_thermostat_offset'] = float(row['thermostat_setback'])
+
+    urdb_label = row['urdb']
+    kwh_rebate = int(row['kwh_rebate'])
+    climate_zone = row['climate_zone']
+    weatherfile = row['weatherfile']
+    latitude = float(row['latitude'])
+    longitude = float(row['longitude'])
+    num_simulations = int(row['num_simulations'])
+    timesteps_per_hour = int(row['timesteps_per_hour'])
+
+    template = {
+        "location": location,
+        'building': building,
+        'reopt': {
+            'Scenario': {
+                'Site': {
+                    'ElectricTariff': {
+                        'urdb_label': urdb_label,
+                        'net_metering_limit_kw': net_metering_limit
+                    },
+                    'Storage': {
+                        'total_rebate_us_dollars_per_kwh': kwh_rebate
+                    },
+                }
+            }
+        },
+        'climate_zone': climate_zone,
+        'weatherfile': weatherfile,
+        'latitude': latitude,
+        'longitude': longitude,
+        'num_simulations': num_simulations,
+        'timesteps_per_hour': timesteps_per_hour,
+        'timezone': row['timezone'],
+    }
+
+    # UUID tags the run based on the dictionary contents so don't overwrite
+    uuid = getID(flatten_dict(template), id_scheme)
+    urdb_beginning = urdb_label[:5]
+    tag = \
+        f"{location}-{tariff_name}-{urdb_beginning}-net-metering-" \
+        f"{row['net metering']}-sched-{schedules_type}-{num_simulations}-" \
+        f"sims-rebate-{kwh_rebate}-{uuid}".replace(' ', '-').lower()
+    template['tag'] = tag
+    return template_filename(tag), template
+
+
+def template_filename(tag):
+    return 'template-' + tag + '.json'
+
+
+def filename_tag(filename):
+    """
+    Return the tag of a template filename, or the argument unchanged if it's
+    already a tag.
+    """
+    filename = os.path.basename(filename)
+    if filename.startswith('template-') and filename.endswith('.json'):
+        return filename[len('template-'):-len('.json')]
+    return filename
+
+
+def template_hash(template):
+    """
+    Return a hash of the template's content.
+    """
+    # Compact JSON is written by the C encoder, unlike the indented JSON of
+    # the files.
+    content = json.dumps(template, separators=(',', ':'))
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def read_hash_index(directory=TEMPLATE_DIRECTORY):
+    try:
+        with open(os.path.join(directory, HASH_INDEX), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_hash_index(index, directory=TEMPLATE_DIRECTORY):
+    filename = os.path.join(directory, HASH_INDEX)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(index, f)
+    os.replace(filename + '.tmp', filename)
+
+
+def _set_hash_index(index):
+    global _hash_index
+    _hash_index = index
+
+
+def write_if_changed(filename, content):
+    """
+    Write a file unless it already has exactly this content, so unchanged
+    files keep their modification time.
+
+    :param bytes content: File content
+    :return: True if the file was written
+    """
+    try:
+        if os.path.getsize(filename) == len(content):
+            with open(filename, 'rb') as f:
+                if f.read() == content:
+                    return False
+    except FileNotFoundError:
+        pass
+    # Write to a temporary file first so readers never see a partial file.
+    temp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(temp_filename, 'wb') as f:
+        f.write(content)
+    os.replace(temp_filename, filename)
+    return True
+
+
+def write_templates(rows, default_building, directory=TEMPLATE_DIRECTORY,
+                    index=None, id_scheme=DEFAULT_ID_SCHEME):
+    """
+    Make and write the templates for a list of combinations.
+
+    A template is skipped without reading its file if the index has its
+    hash and the file's modification time and size haven't changed since.
+
+    :param dict index: Hash index of the templates already written,
+        defaults to the index given to the worker process.
+    :return: List of (filename, written, index entry) tuples, where written
+        is False if the file was already up to date
+    """
+    if index is None:
+        index = _hash_index
+    results = []
+    for row in rows:
+        fname, template = make_template(row, default_building, id_scheme)
+        filename = os.path.join(directory, fname)
+        digest = template_hash(template)
+        entry = index.get(fname)
+        if entry is not None and entry[0] == digest:
+            try:
+                stat = os.stat(filename)
+                if [stat.st_mtime_ns, stat.st_size] == entry[1:]:
+                    results.append((fname, False, entry))
+                    continue
+            except FileNotFoundError:
+                pass
+        content = json.dumps(template, indent=2).encode('utf-8')
+        written = write_if_changed(filename, content)
+        stat = os.stat(filename)
+        results.append(
+            (fname, written, [digest, stat.st_mtime_ns, stat.st_size]))
+    return results
+
+
+def generate_all(sites, tariffs, storage, default_building,
+                 directory=TEMPLATE_DIRECTORY, location=None, jobs=1,
+                 manifest=None, id_scheme=DEFAULT_ID_SCHEME):
+    """
+    Write the templates for every combination of the sites, tariffs and
+    storage options.
+
+    :param int jobs: Number of worker processes to make and write the
+        templates on.
+    :param str manifest: Manifest to write the templates to, instead of a
+        file each in *directory*.
+    :param str id_scheme: getID scheme of the IDs in the tags.
+    :return: Generator of (filename, written) tuples, in order. The hash
+        index is updated once the generator is exhausted.
+    """
+    rows = combinations(sites, tariffs, storage, location)
+    chunks = iter(lambda: list(itertools.islice(rows, CHUNK_SIZE)), [])
+    if manifest is not None:
+        make = functools.partial(
+            manifest_rows, default_building=default_building,
+            id_scheme=id_scheme)
+        if jobs > 1:
+            with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+                yield from write_manifest(
+                    manifest, itertools.chain.from_iterable(
+                        map_ahead(pool, make, chunks, jobs * CHUNKS_AHEAD)))
+        else:
+            yield from write_manifest(
+                manifest, (row for chunk in chunks for row in make(chunk)))
+        return
+
+    os.makedirs(directory, exist_ok=True)
+    index = read_hash_index(directory)
+    write = functools.partial(
+        write_templates, default_building=default_building,
+        directory=directory, id_scheme=id_scheme)
+    if jobs > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(
+            jobs, initializer=_set_hash_index, initargs=(index,))
+        results = itertools.chain.from_iterable(
+            map_ahead(pool, write, chunks, jobs * CHUNKS_AHEAD))
+    else:
+        pool = None
+        results = (
+            result for chunk in chunks
+            for result in write(chunk, index=index))
+
+    updates = {}
+    try:
+        for fname, written, entry in results:
+            updates[fname] = entry
+            yield fname, written
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    write_hash_index({**index, **updates}, directory)
+
+
+def map_ahead(pool, func, items, ahead):
+    """
+    Map *func* over *items* on *pool* in order, like `pool.map`, but only
+    read and submit up to *ahead* items before their results are taken.
+
+    `Executor.map` submits every item up front, which reads the whole
+    iterable and keeps all the results until they're taken.
+
+    :return: Generator of the results
+    """
+    pending = collections.deque()
+    for item in items:
+        if len(pending) >= ahead:
+            yield pending.popleft().result()
+        pending.append(pool.submit(func, item))
+    while pending:
+        yield pending.popleft().result()
+
+
+def manifest_rows(rows, default_building, id_scheme=DEFAULT_ID_SCHEME):
+    """
+    Make the templates for a list of combinations as manifest rows.
+
+    :return: List of (filename, tag, location, hash, template JSON) tuples
+    """
+    results = []
+    for row in rows:
+        fname, template = make_template(row, default_building, id_scheme)
+        content = json.dumps(template, separators=(',', ':'))
+        digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        results.append(
+            (fname, template['tag'], template['location'], digest, content))
+    return results
+
+
+def is_sqlite_manifest(path):
+    return os.path.splitext(path)[1].lower() in SQLITE_EXTENSIONS
+
+
+def _regexp(pattern, value):
+    return re.match(pattern, value) is not None
+
+
+def connect_manifest(path):
+    """
+    Open a SQLite manifest, making it if it doesn't exist.
+
+    :rtype: sqlite3.Connection
+    """
+    connection = sqlite3.connect(path)
+    connection.executescript(MANIFEST_SCHEMA)
+    connection.create_function("REGEXP", 2, _regexp, deterministic=True)
+    return connection
+
+
+def write_manifest(path, rows):
+    """
+    Add templates to a manifest. Templates already in the manifest with the
+    same tag are replaced if their content changed.
+
+    :param rows: Iterable of rows from manifest_rows
+    :return: Generator of (filename, written) tuples, where written is False
+        if the template was already up to date. The manifest is only
+        complete once the generator is exhausted.
+    """
+    if is_sqlite_manifest(path):
+        yield from _write_sqlite_manifest(path, rows)
+    else:
+        yield from _write_json_lines_manifest(path, rows)
+
+
+def _write_sqlite_manifest(path, rows):
+    connection = connect_manifest(path)
+    try:
+        hashes = dict(connection.execute("SELECT tag, hash FROM templates"))
+        with connection:
+            for fname, tag, location, digest, content in rows:
+                written = hashes.get(tag) != digest
+                if written:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO templates "
+                        "(tag, filename, location, hash, template) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (tag, fname, location, digest, content))
+                yield fname, written
+    finally:
+        connection.close()
+
+
+def _write_json_lines_manifest(path, rows):
+    # Tag -> (hash, line) of the templates already in the manifest.
+    lines = {}
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    lines[entry['tag']] = (entry['hash'], line.rstrip('\n'))
+    except FileNotFoundError:
+        pass
+
+    changed = False
+    for fname, tag, location, digest, content in rows:
+        written = tag not in lines or lines[tag][0] != digest
+        if written:
+            changed = True
+            lines[tag] = (digest, (
+                f'{{"tag": {json.dumps(tag)}, '
+                f'"filename": {json.dumps(fname)}, '
+                f'"location": {json.dumps(location)}, '
+                f'"hash": "{digest}", "template": {content}}}'))
+        yield fname, written
+
+    if changed:
+        with open(path + '.tmp', 'w') as f:
+            for _, line in lines.values():
+                f.write(line + '\n')
+        os.replace(path + '.tmp', path)
+
+
+def read_manifest(path, pattern=None, tags=None):
+    """
+    Read templates from a manifest, in filename order.
+
+    :param str pattern: Only read the templates whose filename matches this
+        regular expression from the start.
+    :param tags: Only read the templates with these tags.
+    :return: Generator of (filename, template dictionary) tuples
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No template manifest at {path}")
+    if is_sqlite_manifest(path):
+        yield from _read_sqlite_manifest(path, pattern, tags)
+        return
+
+    regex = re.compile(pattern) if pattern else None
+    tags = None if tags is None else set(tags)
+    templates = []
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if tags is not None and entry['tag'] not in tags:
+                continue
+            if regex is not None and not regex.match(entry['filename']):
+                continue
+            templates.append((entry['filename'], entry['template']))
+    templates.sort(key=lambda template: template[0])
+    yield from templates
+
+
+def _read_sqlite_manifest(path, pattern=None, tags=None):
+    query = "SELECT filename, template FROM templates"
+    clauses = []
+    params = []
+    if tags is not None:
+        tags = list(tags)
+        clauses.append(f"tag IN ({', '.join('?' * len(tags))})")
+        params += tags
+    if pattern:
+        clauses.append("filename REGEXP ?")
+        params.append(pattern)
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += " ORDER BY filename"
+
+    connection = connect_manifest(path)
+    try:
+        for fname, content in connection.execute(query, params):
+            yield fname, json.loads(content)
+    finally:
+        connection.close()
+
+
+def get_template(path, tag):
+    """
+    Return the template with a tag from a manifest, or None if it isn't in
+    the manifest.
+    """
+    for _, template in read_manifest(path, tags=[tag]):
+        return template
+    return None
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate scenario templates")
@@ -65,92 +601,38 @@ if __name__ == "__main__":
                         help="Only generate templates for this location")
     parser.add_argument("--sites", default=SITES_FILE,
                         help="CSV file containing site information.")
+    parser.add_argument("--jobs", default=1, type=int,
+                        help="Number of processes to write templates with.")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Print the name of every template written.")
+    parser.add_argument("--manifest",
+                        help="Write the templates to this manifest instead "
+                             f"of a file each in {TEMPLATE_DIRECTORY}. "
+                             "SQLite if it ends in .sqlite or .db, JSON "
+                             "Lines otherwise.")
+    parser.add_argument("--id-scheme", choices=ID_SCHEMES,
+                        default=DEFAULT_ID_SCHEME,
+                        help="How to make the IDs in the template tags. "
+                             "legacy keeps the names of existing templates, "
+                             "canonical renames them all. Defaults to the "
+                             "ID_SCHEME environment variable, or legacy.")
 
     args = parser.parse_args()
 
     with open("default_building.json", "r") as f:
         DEFAULT_BUILDING = json.load(f)
 
-    sites = csv_load(args.sites)
-    tariffs = csv_load(TARIFFS)
-    storage = csv_load(STORAGE)
-    header = sites.pop(0) + tariffs.pop(0) + storage.pop(0)
-    rows = []
-    for row in itertools.product(sites, tariffs, storage):
-        rows.append(row[0] + row[1] + row[2])
-
-    runs = pd.DataFrame(rows, columns=header)
-
-    # Generate a JSON
-    for _, row in runs.iterrows():
-        if args.location:
-            if row["location"] != args.location:
-                continue
-
-        if row['net metering'] == 'true':
-            net_metering_limit = 100
-        else:
-            net_metering_limit = 0
-
-        tariff_name = row['tariff name']
-        location = row['location']
-        schedules_type = row['schedules_type']
-        building = {
-            **DEFAULT_BUILDING, **{'schedules_type': schedules_type}
-        }
-        # Optional add of occupant types so we don't change the UUIDs of the
-        # scenarios already generated
-        if row['occupant_types']:
-            building['schedules_occupant_types'] = row['occupant_types']
-
-        building['hvac_thermostat_offset'] = float(row['thermostat_setback'])
-
-        urdb_label = row['urdb']
-        kwh_rebate = int(row['kwh_rebate'])
-        climate_zone = row['climate_zone']
-        weatherfile = row['weatherfile']
-        latitude = float(row['latitude'])
-        longitude = float(row['longitude'])
-        num_simulations = int(row['num_simulations'])
-        timesteps_per_hour = int(row['timesteps_per_hour'])
-        occupant_types = row['occupant_types']
-
-        template = {
-            "location": location,
-            'building': building,
-            'reopt': {
-                'Scenario': {
-                    'Site': {
-                        'ElectricTariff': {
-                            'urdb_label': urdb_label,
-                            'net_metering_limit_kw': net_metering_limit
-                        },
-                        'Storage': {
-                            'total_rebate_us_dollars_per_kwh': kwh_rebate
-                        },
-                    }
-                }
-            },
-            'climate_zone': climate_zone,
-            'weatherfile': weatherfile,
-            'latitude': latitude,
-            'longitude': longitude,
-            'num_simulations': num_simulations,
-            'timesteps_per_hour': timesteps_per_hour,
-            'timezone': timezone_finder.timezone_at(
-                lat=latitude, lng=longitude
-            )
-        }
-
-        # UUID tags the run based on the dictionary contents so don't overwrite
-        uuid = getID(flatten_dict(template))
-        urdb_beginning = urdb_label[:5]
-        tag = \
-            f"{location}-{tariff_name}-{urdb_beginning}-net-metering-" \
-            f"{row['net metering']}-sched-{schedules_type}-{num_simulations}-" \
-            f"sims-rebate-{kwh_rebate}-{uuid}".replace(' ', '-').lower()
-        template['tag'] = tag
-        fname = 'template-'+ tag + '.json'
-        with open(os.path.join(TEMPLATE_DIRECTORY, fname), 'w+') as output:
-            print(f"writing {fname}...")
-            json.dump(template, output, indent=2)
+    total = 0
+    written = 0
+    for fname, changed in generate_all(
+            csv_dicts(args.sites), csv_dicts(TARIFFS), csv_dicts(STORAGE),
+            DEFAULT_BUILDING, location=args.location, jobs=args.jobs,
+            manifest=args.manifest, id_scheme=args.id_scheme):
+        total += 1
+        if changed:
+            written += 1
+            if args.verbose:
+                print(f"writing {fname}...")
+    print(f"Wrote {written} of {total} templates to "
+          f"{args.manifest or TEMPLATE_DIRECTORY}, {total - written} were "
+          "unchanged.")
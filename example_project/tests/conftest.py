@@ -0,0 +1,20 @@
+"""
+Shared setup of the example project's tests.
+
+scenarios.py reads the default building and REopt assumptions relative to
+the project directory when it's imported, so it's imported from there.
+"""
+import os
+import sys
+
+import pytest
+
+PROJECT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIRECTORY)
+
+
+@pytest.fixture
+def scenarios(monkeypatch):
+    monkeypatch.chdir(PROJECT_DIRECTORY)
+    import scenarios as module
+    return module
@@ -0,0 +1,21 @@
+import numpy as np
+
+
+def test_payloads_are_the_pipelines(scenarios):
+    import benchmark_reopt
+
+    payloads = benchmark_reopt.make_payloads(2, timesteps_per_hour=2)
+    simulation = scenarios.Simulation(
+        location={}, building_parameters={},
+        reopt_parameters={"Scenario": {"Site": {}}}, weatherfile=None,
+        climate_zone=None, latitude=benchmark_reopt.LATITUDE,
+        longitude=benchmark_reopt.LONGITUDE, timezone=None)
+    simulation.reopt_timesteps_per_hour = 2
+    for payload in payloads:
+        loads = payload["Scenario"]["Site"]["LoadProfile"]["loads_kw"]
+        assert len(loads) == 8760 * 2
+        expected = simulation.make_reopt_payload(loads_kw=loads)
+        assert payload == expected
+    assert not np.array_equal(
+        payloads[0]["Scenario"]["Site"]["LoadProfile"]["loads_kw"],
+        payloads[1]["Scenario"]["Site"]["LoadProfile"]["loads_kw"])
@@ -0,0 +1,68 @@
+import concurrent.futures
+import itertools
+import json
+import os
+
+import pytest
+
+from conftest import PROJECT_DIRECTORY
+from templates import generate_templates
+
+
+TEMPLATES = os.path.join(PROJECT_DIRECTORY, "templates")
+
+
+def test_map_ahead_keeps_order():
+    with concurrent.futures.ThreadPoolExecutor(4) as pool:
+        results = generate_templates.map_ahead(
+            pool, lambda x: x * x, range(20), ahead=3)
+        assert list(results) == [x * x for x in range(20)]
+
+
+def test_map_ahead_reads_items_as_needed():
+    read = []
+
+    def items():
+        for n in itertools.count():
+            read.append(n)
+            yield n
+
+    with concurrent.futures.ThreadPoolExecutor(2) as pool:
+        results = generate_templates.map_ahead(pool, str, items(), ahead=4)
+        assert [next(results) for _ in range(3)] == ["0", "1", "2"]
+        # The three results taken and the four submitted ahead of them.
+        assert len(read) == 7
+        results.close()
+
+
+@pytest.mark.parametrize("manifest", [None, "manifest.jsonl"])
+def test_jobs_write_the_same_templates(tmp_path, monkeypatch, manifest):
+    # Small chunks, so the workers have several each.
+    monkeypatch.setattr(generate_templates, "CHUNK_SIZE", 16)
+    csv = {
+        name: generate_templates.csv_dicts(os.path.join(TEMPLATES, name))
+        for name in ("sites.csv", "tariffs.csv", "storage.csv")
+    }
+    csv["sites.csv"] = csv["sites.csv"][:2]
+    with open(os.path.join(TEMPLATES, "default_building.json")) as f:
+        default_building = json.load(f)
+
+    outputs = []
+    for jobs in (1, 2):
+        directory = tmp_path / f"jobs-{jobs}"
+        directory.mkdir()
+        generated = list(generate_templates.generate_all(
+            csv["sites.csv"], csv["tariffs.csv"], csv["storage.csv"],
+            default_building, directory=str(directory), jobs=jobs,
+            manifest=manifest and str(directory / manifest)))
+        assert all(written for _, written in generated)
+        if manifest:
+            outputs.append(list(generate_templates.read_manifest(
+                str(directory / manifest))))
+        else:
+            outputs.append({
+                fname: (directory / fname).read_text()
+                for fname, _ in generated
+            })
+    assert outputs[0] == outputs[1]
+    assert len(outputs[0]) > 4 * generate_templates.CHUNK_SIZE
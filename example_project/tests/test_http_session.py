@@ -0,0 +1,108 @@
+import types
+
+import pytest
+
+import http_session
+from http_session import RateLimiter, parse_retry_after
+
+
+class FakeClock:
+    """
+    Stands in for the time module, advancing only when slept on.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(http_session, "time", clock)
+    return clock
+
+
+def test_burst_then_rate(clock):
+    limiter = RateLimiter(per_hour=3600, burst=3)
+    for _ in range(3):
+        limiter.acquire()
+    assert clock.sleeps == []
+
+    limiter.acquire()
+    assert clock.sleeps == [pytest.approx(1.0)]
+    assert limiter.requests == 4
+    assert limiter.seconds_waited == pytest.approx(1.0)
+
+
+def test_refills_up_to_burst(clock):
+    limiter = RateLimiter(per_hour=3600, burst=2)
+    limiter.acquire()
+    limiter.acquire()
+    clock.now += 100
+    limiter.acquire()
+    limiter.acquire()
+    assert clock.sleeps == []
+    limiter.acquire()
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+
+def test_no_limit(clock):
+    limiter = RateLimiter(per_hour=0, burst=1)
+    for _ in range(100):
+        limiter.acquire()
+    assert clock.sleeps == []
+    assert limiter.requests == 100
+
+
+def test_throttle_pauses_then_lets_one_through(clock):
+    limiter = RateLimiter(per_hour=3600, burst=10)
+    limiter.acquire()
+    limiter.throttle(retry_after=30)
+
+    limiter.acquire()
+    assert sum(clock.sleeps) == pytest.approx(30.0)
+    # Only one token after the pause, so the next request waits for the
+    # rate.
+    limiter.acquire()
+    assert sum(clock.sleeps) == pytest.approx(31.0)
+    assert limiter.throttled == 1
+
+
+def test_throttle_without_retry_after_uses_pause(clock):
+    limiter = RateLimiter(per_hour=0, burst=1, pause=60)
+    limiter.throttle()
+    limiter.acquire()
+    assert sum(clock.sleeps) == pytest.approx(60.0)
+
+
+def test_update_caps_tokens_at_remaining_quota(clock):
+    limiter = RateLimiter(per_hour=3600, burst=10)
+    limiter.update(types.SimpleNamespace(
+        headers={"X-RateLimit-Remaining": "1"}))
+    limiter.acquire()
+    assert clock.sleeps == []
+    limiter.acquire()
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+    limiter.update(types.SimpleNamespace(headers={}))
+    assert limiter.tokens == pytest.approx(0.0)
+
+
+@pytest.mark.parametrize("headers, seconds", [
+    ({}, None),
+    ({"Retry-After": "12"}, 12.0),
+    ({"Retry-After": "-5"}, 0.0),
+    ({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}, 0.0),
+    ({"Retry-After": "soon"}, None),
+])
+def test_parse_retry_after(headers, seconds):
+    response = types.SimpleNamespace(headers=headers)
+    assert parse_retry_after(response) == seconds
@@ -0,0 +1,68 @@
+import hashlib
+import os
+
+import numpy as np
+import pytest
+
+from templates.generate_templates import getID
+
+
+DICTS = [
+    {},
+    {"a": 1},
+    {"location": "Fargo", "bedrooms": 3, "setback": 0.5, "pv": None},
+    {"schedule": [1, 2, 3], "nested": {"x": "y"}, "flag": True},
+]
+
+
+def original_getID(mydic):
+    """
+    getID as it was before there were schemes.
+    """
+    ID = 0
+    for x in mydic.keys():
+        ID = ID + int(
+            hashlib.sha256(str(mydic[x]).encode('utf-8')).hexdigest(), 16)
+        ID = ID + int(hashlib.sha256(x.encode('utf-8')).hexdigest(), 16)
+    return (ID % 10**10)
+
+
+@pytest.mark.parametrize("mydic", DICTS)
+def test_legacy_ids_are_unchanged(mydic):
+    assert getID(mydic, "legacy") == original_getID(mydic)
+
+
+@pytest.mark.skipif("ID_SCHEME" in os.environ,
+                    reason="ID_SCHEME sets the default")
+def test_legacy_is_the_default():
+    assert getID(DICTS[2]) == getID(DICTS[2], "legacy")
+
+
+def test_canonical_ignores_key_order():
+    reordered = dict(reversed(list(DICTS[2].items())))
+    assert getID(DICTS[2], "canonical") == getID(reordered, "canonical")
+
+
+def test_canonical_tells_swapped_values_apart():
+    # The legacy sum of hashes can't.
+    swapped = {"a": "x", "b": "y"}, {"a": "y", "b": "x"}
+    assert getID(swapped[0], "legacy") == getID(swapped[1], "legacy")
+    assert getID(swapped[0], "canonical") != getID(swapped[1], "canonical")
+
+
+def test_canonical_serializes_arrays_as_lists():
+    assert getID({"loads": np.arange(3)}, "canonical") == \
+        getID({"loads": [0, 1, 2]}, "canonical")
+    assert getID({"setback": np.float64(0.5)}, "canonical") == \
+        getID({"setback": 0.5}, "canonical")
+
+
+def test_id_digits():
+    for mydic in DICTS:
+        assert 0 <= getID(mydic, "legacy") < 10**10
+        assert 0 <= getID(mydic, "canonical") < 10**16
+
+
+def test_unknown_scheme():
+    with pytest.raises(ValueError, match="Unknown ID scheme"):
+        getID({}, "sha1")
@@ -0,0 +1,85 @@
+import pickle
+
+import pytest
+
+from job_ledger import JobLedger
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = JobLedger(str(tmp_path / "ledger.sqlite"))
+    yield ledger
+    ledger.close()
+
+
+def test_scenario_stages(ledger):
+    assert ledger.scenario_stage("s1") is None
+    ledger.set_scenario_stage("s1", "written", template="t.json")
+    ledger.set_scenario_stage("s1", "post_processed", seconds=4.0)
+    assert ledger.scenario_stage("s1") == "post_processed"
+    with pytest.raises(ValueError):
+        ledger.set_scenario_stage("s1", "finished")
+
+
+def test_outstanding_jobs(ledger):
+    ledger.reopt_submitted("a.json", "uuid-a", payload_hash="hash-a")
+    ledger.reopt_submitted("b.json", "uuid-b")
+    ledger.reopt_submitted("c.json", "uuid-c")
+    ledger.reopt_written("b.json", seconds=10.0)
+    ledger.reopt_failed("c.json", "not optimal")
+
+    assert ledger.reopt_stage("a.json") == "submitted"
+    assert ledger.reopt_stage("b.json") == "written"
+    assert ledger.reopt_stage("c.json") == "failed"
+    assert ledger.reopt_stage("d.json") is None
+    assert ledger.outstanding() == [
+        {"output_path": "a.json", "run_uuid": "uuid-a",
+         "payload_hash": "hash-a"},
+    ]
+
+
+def test_written_keeps_run_uuid_and_hash(ledger):
+    ledger.reopt_submitted("a.json", "uuid-a", payload_hash="hash-a")
+    ledger.reopt_written("a.json")
+    ledger.reopt_submitted("a.json", "uuid-a2")
+    assert ledger.outstanding() == [
+        {"output_path": "a.json", "run_uuid": "uuid-a2",
+         "payload_hash": "hash-a"},
+    ]
+
+
+def test_durations_and_summary(ledger):
+    assert ledger.durations() == {
+        "scenarios": (0, None), "reopt_jobs": (0, None)}
+    ledger.set_scenario_stage("s1", "post_processed", seconds=2.0)
+    ledger.set_scenario_stage("s2", "post_processed", seconds=4.0)
+    ledger.set_scenario_stage("s3", "failed", error="rake failed")
+    ledger.reopt_submitted("a.json", "uuid-a")
+    ledger.reopt_written("a.json", seconds=30.0)
+
+    assert ledger.durations() == {
+        "scenarios": (2, 3.0), "reopt_jobs": (1, 30.0)}
+    assert ledger.summary() == (
+        "Job ledger: scenarios 1 failed, 2 post_processed; "
+        "REopt jobs 1 written")
+
+
+def test_survives_reopening(tmp_path):
+    path = str(tmp_path / "ledger.sqlite")
+    ledger = JobLedger(path)
+    ledger.reopt_submitted("a.json", "uuid-a")
+    ledger.close()
+
+    ledger = JobLedger(path)
+    assert ledger.reopt_stage("a.json") == "submitted"
+    ledger.close()
+
+
+def test_pickles_as_its_path(ledger):
+    copy = pickle.loads(pickle.dumps(ledger))
+    try:
+        assert copy.path == ledger.path
+        ledger.reopt_submitted("a.json", "uuid-a")
+        assert copy.reopt_stage("a.json") == "submitted"
+    finally:
+        copy.close()
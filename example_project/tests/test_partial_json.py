@@ -0,0 +1,94 @@
+import io
+import json
+
+import pytest
+
+import partial_json
+
+DOCUMENT = {
+    "inputs": {"Scenario": {"Site": {"latitude": 46.88}}},
+    "outputs": {
+        "Scenario": {
+            "status": "optimal",
+            "Site": {
+                "PV": {"size_kw": 12.5,
+                       "year_one_power_production_series_kw": [0.0, 1.5]},
+                "ElectricTariff": {"year_one_bill_us_dollars": 1234.5},
+                "Storage": {"size_kwh": 0},
+            },
+            "Profile": {"run_times": [{"a": 1}, {"b": [2, "}"]}]},
+        },
+    },
+    "messages": {"warnings": "quote \" brace } bracket ] backslash \\",
+                 "errors": {}},
+    "unicode": "café ☃",
+    "flags": [True, False, None, -1.5e-3],
+}
+TEXT = json.dumps(DOCUMENT, indent=2)
+
+
+def test_selects_nested_keys():
+    assert partial_json.loads(TEXT, [
+        ("outputs", "Scenario", "status"),
+        ("outputs", "Scenario", "Site", "PV", "size_kw"),
+    ]) == {"outputs": {"Scenario": {
+        "status": "optimal", "Site": {"PV": {"size_kw": 12.5}}}}}
+
+
+@pytest.mark.parametrize("path", [
+    ("inputs",),
+    ("outputs", "Scenario", "Site"),
+    ("outputs", "Scenario", "Profile"),
+    ("messages",),
+    ("unicode",),
+    ("flags",),
+])
+def test_matches_json_loads(path):
+    value = DOCUMENT
+    expected = {}
+    node = expected
+    for key in path[:-1]:
+        value = value[key]
+        node = node.setdefault(key, {})
+    node[path[-1]] = value[path[-1]]
+    assert partial_json.loads(TEXT, [path]) == expected
+
+
+def test_matches_compact_json():
+    text = json.dumps(DOCUMENT, separators=(",", ":"))
+    paths = [("messages", "warnings"), ("flags",), ("unicode",)]
+    assert partial_json.loads(text, paths) == partial_json.loads(TEXT, paths)
+
+
+def test_missing_keys_are_left_out():
+    assert partial_json.loads(TEXT, [
+        ("outputs", "Scenario", "Site", "Wind", "size_kw"),
+        ("missing",),
+        # status isn't an object, so the path can't continue.
+        ("outputs", "Scenario", "status", "code"),
+    ]) == {"outputs": {"Scenario": {"Site": {}}}}
+
+
+def test_shorter_path_selects_whole_value():
+    assert partial_json.loads(TEXT, [
+        ("outputs", "Scenario", "Site", "PV", "size_kw"),
+        ("outputs", "Scenario", "Site"),
+    ]) == {"outputs": {"Scenario": {
+        "Site": DOCUMENT["outputs"]["Scenario"]["Site"]}}}
+
+
+def test_load_reads_file():
+    paths = [("outputs", "Scenario", "status")]
+    assert partial_json.load(io.StringIO(TEXT), paths) == \
+        partial_json.loads(TEXT, paths)
+
+
+def test_empty_object():
+    assert partial_json.loads(" { } ", [("a",)]) == {}
+
+
+@pytest.mark.parametrize("text", ["[1, 2]", '"a"', "", '{"a": [1, 2}',
+                                  '{"a" 1}', '{"a": "b'])
+def test_invalid_documents_raise(text):
+    with pytest.raises(json.JSONDecodeError):
+        partial_json.loads(text, [("b",)])
@@ -0,0 +1,88 @@
+import itertools
+import threading
+
+import pytest
+
+from pipeline import Pipeline, Stage
+
+
+TEMPLATE = {
+    "location": {"city": "Fargo"},
+    "building": {"bedrooms": 3},
+    "reopt": {"tariff": "flat"},
+    "weatherfile": "fargo.epw",
+    "climate_zone": "7",
+    "latitude": 46.9,
+    "longitude": -96.8,
+    "timezone": "America/Chicago",
+    "num_simulations": 2,
+    "tag": "fargo",
+}
+
+
+@pytest.fixture
+def stub_simulation(scenarios, monkeypatch, tmp_path):
+    """
+    Stub out the file writing and rake calls of Simulation, recording the
+    steps each scenario went through.
+    """
+    calls = []
+    lock = threading.Lock()
+
+    def record(step):
+        def method(self, *args, **kwargs):
+            with lock:
+                calls.append((step, self.scenario_name))
+        return method
+
+    for step in ("write_mapper_csv", "write_scenario_json",
+                 "simulate_baseline", "post_process_baseline", "cleanup"):
+        monkeypatch.setattr(scenarios.Simulation, step, record(step))
+    monkeypatch.setattr(
+        scenarios.Simulation, "results_exist", lambda self: False)
+    monkeypatch.setattr(
+        scenarios, "WORKER_DIRECTORY", str(tmp_path / "workers"))
+    return calls
+
+
+def test_stage_passes_on_items():
+    pipeline = Pipeline([
+        Stage("double", lambda x: 2 * x, workers=2),
+        Stage("odd", lambda x: x if x % 4 else None),
+    ])
+    assert sorted(pipeline.run(range(6))) == [2, 6, 10]
+    assert pipeline.errors == []
+
+
+def test_fan_out_keeps_items_yielded_before_an_error():
+    def explode(n):
+        yield from range(n)
+        raise ValueError("boom")
+
+    pipeline = Pipeline([
+        Stage("explode", explode, fan_out=True),
+        Stage("square", lambda x: x * x),
+    ])
+    assert sorted(pipeline.run([3])) == [0, 1, 4]
+    [(stage, item, e)] = pipeline.errors
+    assert (stage, item, str(e)) == ("explode", 3, "boom")
+    assert pipeline.stages[0].outputs == 3
+
+
+def test_scenario_pipeline_skip_reopt(scenarios, stub_simulation):
+    templates = [
+        (f"template-{n}.json", {**TEMPLATE, "location": {"city": city}})
+        for n, city in enumerate(["Fargo", "Fargo", "Denver"])
+    ]
+    runner = scenarios.ScenarioPipeline(skip_reopt=True)
+    pipeline = runner.run(templates)
+
+    assert pipeline.errors == []
+    assert [stage.name for stage in pipeline.stages] == \
+        ["generate", "simulate", "post_process"]
+    # The two Fargo templates share a scenario.
+    steps = sorted(step for step, _ in stub_simulation)
+    assert steps == sorted(itertools.chain.from_iterable(
+        [step] * 2 for step in (
+            "write_mapper_csv", "write_scenario_json", "simulate_baseline",
+            "post_process_baseline", "cleanup")))
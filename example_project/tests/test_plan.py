@@ -0,0 +1,87 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from reopt_cache import ReoptCache, canonical_json
+
+
+TEMPLATE = {
+    "location": {"city": "Fargo"},
+    "building": {"bedrooms": 3},
+    "reopt": {"Scenario": {"Site": {
+        "ElectricTariff": {
+            "urdb_label": "5cd32d3d5457a3c79e5b4b0d",
+            "net_metering_limit_kw": 0,
+        },
+        "Storage": {"total_rebate_us_dollars_per_kwh": 0},
+    }}},
+    "weatherfile": "fargo.epw",
+    "climate_zone": "7",
+    "latitude": 46.9,
+    "longitude": -96.8,
+    "timezone": "America/Chicago",
+    "num_simulations": 3,
+    "tag": "fargo",
+}
+
+
+@pytest.fixture
+def group(scenarios, monkeypatch, tmp_path):
+    """
+    A simulated scenario of three buildings in an empty project folder.
+    """
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("run")
+    monkeypatch.setattr(
+        scenarios.Simulation, "results_exist", lambda self: True)
+    monkeypatch.setattr(
+        scenarios.Simulation, "get_loads_kw",
+        lambda self, building_num: np.full(8760, float(building_num)))
+    return scenarios.group_templates([("template.json", TEMPLATE)])[0]
+
+
+def write_results(simulation, building_num, payload):
+    """
+    Write results for the building that echo the payload's inputs.
+    """
+    output_path = simulation.reopt_output_path(building_num)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump({"inputs": json.loads(canonical_json(payload))}, f)
+
+
+def test_plan_counts_only_results_of_the_same_payload(scenarios, group):
+    simulation = group["simulations"][0]
+    write_results(simulation, 1, simulation.make_reopt_payload(1))
+    # Results of building 2 from before its loads changed.
+    write_results(
+        simulation, 2,
+        simulation.make_reopt_payload(2, np.full(8760, 20.0)))
+
+    plan = scenarios.plan_group(group)
+    assert plan == {"simulate": False, "submit": 2, "resume": 0, "done": 1}
+
+
+def test_plan_counts_cached_payloads(scenarios, group, tmp_path):
+    simulation = group["simulations"][0]
+    cache = ReoptCache(str(tmp_path / "cache"))
+    cache.put(simulation.make_reopt_payload(3), {"outputs": {}})
+    write_results(simulation, 1, simulation.make_reopt_payload(1))
+
+    plan = scenarios.plan_group(group, cache=cache)
+    assert plan == {"simulate": False, "submit": 1, "resume": 0, "done": 2}
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+def test_plan_submits_jobs_of_scenarios_to_simulate(
+        scenarios, group, monkeypatch):
+    simulation = group["simulations"][0]
+    write_results(simulation, 1, simulation.make_reopt_payload(1))
+    monkeypatch.setattr(
+        scenarios.Simulation, "results_exist", lambda self: False)
+
+    plan = scenarios.plan_group(group)
+    assert plan == {"simulate": True, "submit": 3, "resume": 0, "done": 0}
+    assert scenarios.plan_group(group, use_reopt_cache=False)["submit"] == 3
@@ -0,0 +1,127 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import reopt_cache
+from reopt_cache import ReoptCache, payload_hash, results_match
+
+
+def make_payload(load=1.0, latitude=46.9):
+    return {
+        "Scenario": {
+            "time_steps_per_hour": 1,
+            "Site": {
+                "latitude": latitude,
+                "longitude": -96.8,
+                "LoadProfile": {"loads_kw": np.full(24, load)},
+            },
+        },
+    }
+
+
+def make_results(payload, cost=100.0):
+    """
+    Results like REopt's, which echo the inputs with defaults filled in.
+    """
+    inputs = json.loads(reopt_cache.canonical_json(payload))
+    inputs["Scenario"]["Site"]["Financial"] = {"analysis_years": 25}
+    return {
+        "inputs": inputs,
+        "outputs": {"Scenario": {"status": "optimal", "lcc": cost}},
+    }
+
+
+def write_json(filename, data):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "w") as f:
+        json.dump(data, f)
+
+
+def test_payload_hash_ignores_key_order_and_array_type():
+    payload = make_payload()
+    reordered = {"Scenario": dict(reversed(list(payload["Scenario"].items())))}
+    listed = make_payload()
+    listed["Scenario"]["Site"]["LoadProfile"]["loads_kw"] = [1.0] * 24
+    assert payload_hash(payload) == payload_hash(reordered)
+    assert payload_hash(payload) == payload_hash(listed)
+    assert payload_hash(payload) != payload_hash(make_payload(load=1.5))
+
+
+def test_put_and_get(tmp_path):
+    cache = ReoptCache(str(tmp_path / "cache"))
+    payload = make_payload()
+    assert cache.get(payload) is None
+    cache.put(payload, make_results(payload))
+    assert payload in cache
+    assert cache.get(payload) == make_results(payload)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_index_survives_reopening(tmp_path):
+    cache = ReoptCache(str(tmp_path / "cache"))
+    payload = make_payload()
+    cache.put(payload, make_results(payload))
+    cache.close()
+    reopened = ReoptCache(str(tmp_path / "cache"))
+    assert len(reopened) == 1
+    assert reopened.get(payload) == make_results(payload)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    payloads = [make_payload(load) for load in (1.0, 2.0, 3.0)]
+    cache = ReoptCache(str(tmp_path / "cache"))
+    size = os.path.getsize(cache.object_filename(
+        cache.put(payloads[0], make_results(payloads[0]))))
+    cache.max_bytes = 2 * size
+    cache.put(payloads[1], make_results(payloads[1]))
+    # Using the first entry makes the second the least recently used.
+    cache._index["entries"][payload_hash(payloads[1])]["last_used"] -= 10
+    assert cache.get(payloads[0]) is not None
+    cache.put(payloads[2], make_results(payloads[2]))
+    assert payloads[0] in cache
+    assert payloads[1] not in cache
+    assert payloads[2] in cache
+    assert cache.size <= cache.max_bytes
+
+
+def test_fetch_copies_cached_results(tmp_path):
+    cache = ReoptCache(str(tmp_path / "cache"))
+    payload = make_payload()
+    cache.put(payload, make_results(payload))
+    output = str(tmp_path / "results" / "1" / "out.json")
+    assert cache.fetch(payload, output)
+    with open(output) as f:
+        assert json.load(f) == make_results(payload)
+
+
+def test_fetch_adopts_existing_results_of_the_same_payload(tmp_path):
+    cache = ReoptCache(str(tmp_path / "cache"))
+    payload = make_payload()
+    output = str(tmp_path / "results" / "out.json")
+    write_json(output, make_results(payload))
+    assert cache.fetch(payload, output)
+    assert payload in cache
+    assert cache.hits == 1
+
+
+@pytest.mark.parametrize("changed", [
+    make_payload(load=1.5),
+    make_payload(latitude=40.0),
+])
+def test_fetch_misses_existing_results_of_a_changed_payload(
+        tmp_path, changed):
+    cache = ReoptCache(str(tmp_path / "cache"))
+    output = str(tmp_path / "results" / "out.json")
+    write_json(output, make_results(make_payload()))
+    assert not cache.fetch(changed, output)
+    assert changed not in cache
+    assert (cache.hits, cache.misses) == (0, 1)
+
+
+def test_results_without_inputs_dont_match(tmp_path):
+    output = str(tmp_path / "out.json")
+    write_json(output, {"outputs": {}})
+    assert not results_match(make_payload(), output)
+    assert not results_match(make_payload(), str(tmp_path / "missing.json"))
@@ -0,0 +1,56 @@
+import pickle
+
+import pytest
+
+from results_processor import Results
+
+
+@pytest.fixture
+def results(tmp_path):
+    (tmp_path / "reopt_results").mkdir()
+    (tmp_path / "run").mkdir()
+    return Results(
+        str(tmp_path / "reopt_results"), str(tmp_path / "run"))
+
+
+def test_snapshot_round_trip(results, tmp_path):
+    results._results = {"a.json": {"lcc": 1.0}}
+    results._file_ids = {"a.json": (1, 2)}
+    results.to_snapshot(str(tmp_path / "results.pickle"))
+    reopened = Results.from_pickle(
+        str(tmp_path / "results.pickle"), refresh=False)
+    assert reopened._results == results._results
+    assert reopened._file_ids == results._file_ids
+    assert reopened.results_dir == results.results_dir
+
+
+def test_pickled_results_object_is_rejected(results, tmp_path):
+    # Pickles from before snapshots were the Results object itself, without
+    # the attributes added since.
+    old = Results.__new__(Results)
+    old.__dict__.update(
+        _results={}, results_dir=results.results_dir, run_dir=results.run_dir)
+    filepath = str(tmp_path / "old.pickle")
+    with open(filepath, "wb") as f:
+        pickle.dump(old, f)
+    with pytest.raises(ValueError, match="pickled Results, not a Results "
+                                         "snapshot.*to_snapshot"):
+        Results.from_pickle(filepath)
+
+
+def test_other_snapshot_version_is_rejected(tmp_path):
+    filepath = str(tmp_path / "old.pickle")
+    with open(filepath, "wb") as f:
+        pickle.dump({"version": 1, "results": {}}, f)
+    with pytest.raises(ValueError, match="snapshot version 1, expected"):
+        Results.from_pickle(filepath)
+
+
+def test_unreadable_pickle_is_rejected(tmp_path):
+    filepath = str(tmp_path / "old.pickle")
+    # A pickle of a class that no longer exists.
+    with open(filepath, "wb") as f:
+        f.write(b"\x80\x04\x95\x1b\x00\x00\x00\x00\x00\x00\x00\x8c\x11"
+                b"results_processor\x94\x8c\x03Old\x94\x93\x94.")
+    with pytest.raises(ValueError, match="isn't a Results snapshot"):
+        Results.from_pickle(filepath)
@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+import tariff
+
+
+class RateCache:
+    """
+    Stand-in for urdb.TariffCache that returns one rate.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+
+    def get_rate(self, rate, util=None):
+        return self.rate
+
+
+def make_rate(structure, weekday_period=0, weekend_period=None):
+    """
+    Make a Rate with the energy structure, with every weekday hour in
+    *weekday_period* and every weekend hour in *weekend_period*.
+    """
+    if weekend_period is None:
+        weekend_period = weekday_period
+    return tariff.Rate("test", cache=RateCache({
+        "energyratestructure": structure,
+        "energyweekdayschedule": [[weekday_period] * 24] * 12,
+        "energyweekendschedule": [[weekend_period] * 24] * 12,
+    }))
+
+
+def january(result):
+    return result["energy"][..., 0]
+
+
+def test_flat_rate():
+    rate = make_rate([[{"rate": 0.1, "adj": 0.01}]])
+    bill = rate.bill(np.full(8760, 2.0))
+    assert bill["energy_annual"] == pytest.approx(8760 * 2 * 0.11)
+    assert bill["demand_annual"] == 0
+
+
+def test_load_year_starts_on_a_monday():
+    compiled = make_rate([[{"rate": 0.1}]]).compile()
+    assert compiled.year == 2007
+    assert not compiled.weekend[:5 * 24].any()
+    assert compiled.weekend[5 * 24:7 * 24].all()
+
+
+def test_last_tier_has_no_upper_bound():
+    rate = make_rate([[{"max": 500, "rate": 0.1}, {"max": 1000, "rate": 0.2}]])
+    # 744 hours at 3 kW: 500 kWh in the first tier, the other 1732 kWh in the
+    # last tier even though that's above its max.
+    assert january(rate.bill(np.full(8760, 3.0))) == \
+        pytest.approx(500 * 0.1 + 1732 * 0.2)
+
+
+def test_tiers_apply_to_the_months_cumulative_usage():
+    rate = make_rate([
+        [{"max": 300, "rate": 0.1}, {"rate": 0.2}],
+        [{"max": 300, "rate": 0.15}, {"rate": 0.3}],
+    ], weekday_period=0, weekend_period=1)
+    # At 1 kW the month reaches 300 kWh at noon on Saturday January 13th.
+    # By then 240 weekday and 60 weekend hours are in the first tiers. The
+    # rest of January is 552 - 240 weekday and 192 - 60 weekend hours.
+    expected = 240 * 0.1 + 60 * 0.15 + 312 * 0.2 + 132 * 0.3
+    assert january(rate.bill(np.ones(8760))) == pytest.approx(expected)
+    assert rate.compile().tier_usage(np.ones(8760))[0].tolist() == \
+        pytest.approx([300, 444])
+
+
+def test_daily_tiers_scale_with_the_days_in_the_month():
+    rate = make_rate([
+        [{"max": 10, "unit": "kWh daily", "rate": 0.1}, {"rate": 0.2}],
+    ])
+    february = rate.bill(np.ones(8760))["energy"][1]
+    assert february == pytest.approx(280 * 0.1 + (672 - 280) * 0.2)
+
+
+def test_tier_boundary_inside_a_timestep():
+    rate = make_rate([[{"max": 1.5, "rate": 0.1}, {"rate": 0.2}]])
+    loads = np.zeros(8760)
+    loads[:2] = 1
+    assert january(rate.bill(loads)) == pytest.approx(1.5 * 0.1 + 0.5 * 0.2)
+    # The same kWh at four timesteps per hour.
+    assert january(rate.bill(np.repeat(loads, 4), timesteps_per_hour=4)) == \
+        pytest.approx(1.5 * 0.1 + 0.5 * 0.2)
+
+
+def test_net_negative_usage_is_credited_at_the_first_tier():
+    rate = make_rate([[{"max": 100, "rate": 0.1}, {"rate": 0.2}]])
+    assert january(rate.bill(np.full(8760, -1.0))) == pytest.approx(-744 * 0.1)
+
+
+def test_batch_matches_single_loads():
+    rate = make_rate([
+        [{"max": 200, "rate": 0.1}, {"max": 400, "rate": 0.15}, {"rate": 0.2}],
+        [{"max": 300, "rate": 0.12}, {"rate": 0.3}],
+    ], weekday_period=0, weekend_period=1)
+    loads = np.random.default_rng(0).normal(0.8, 1.5, (3, 8760))
+    batch = rate.bill(loads)
+    for row, row_loads in enumerate(loads):
+        single = rate.bill(row_loads)
+        np.testing.assert_allclose(batch["energy"][row], single["energy"])
+
+
+def test_unsupported_tier_unit():
+    rate = make_rate([[{"max": 10, "unit": "kW", "rate": 0.1}, {"rate": 0.2}]])
+    with pytest.raises(ValueError, match="Unsupported energy tier unit"):
+        rate.compile()
@@ -0,0 +1,323 @@
+"""
+Access to the Utility Rate Database (URDB), with an on-disk cache.
+
+Rates are cached by URDB label, and the rates of a utility by utility and rate
+name, so constructing a `tariff.Rate` doesn't need the network once its rate
+has been fetched. Entries older than the TTL are refreshed with a conditional
+request on their ETag. In offline mode the cache is never refreshed and rates
+that aren't cached raise an error.
+
+The defaults can be changed with environment variables:
+    URDB_CACHE_PATH     cache folder, ./urdb_cache
+    URDB_CACHE_TTL      seconds before an entry is refreshed, 30 days
+    URDB_OFFLINE        set to 1 to never call the URDB API
+
+To fetch all the rates in tariffs.csv ahead of a batch job:
+
+    python urdb.py templates/tariffs.csv --jobs 8
+
+Layout of the cache folder:
+    index.json          queries with their ETags, and the cached rates
+    rates/<label>.json  URDB rate dictionary
+"""
+import argparse
+import concurrent.futures
+import csv
+import json
+import logging
+import os
+import threading
+import time
+
+import http_session
+
+log = logging.getLogger(__name__)
+
+URDB_URL = "http://api.openei.org/utility_rates?"
+API_KEY = os.environ.get(
+    "URDB_API_KEY", "BLLsYv81d8y4w6UPYCfGFsuWlu4IujlZYliDmoq6")
+
+URDB_CACHE_PATH = os.environ.get("URDB_CACHE_PATH", "./urdb_cache")
+DEFAULT_TTL = float(os.environ.get("URDB_CACHE_TTL", 30 * 24 * 3600))
+OFFLINE = os.environ.get("URDB_OFFLINE", "") not in ("", "0")
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def is_rate_label(rate, util=None):
+    """
+    Return True if *rate* should be looked up as a URDB label instead of a
+    rate name of *util*. Labels have no spaces.
+    """
+    return " " not in rate or util is None
+
+
+def request_rates(rate, util=None, etag=None):
+    """
+    Ask the URDB API for a rate by label, or for all the rates of a utility.
+
+    :param str etag: ETag of a previous response, to only get the rates back
+        if they've changed.
+    :rtype: requests.Response
+    """
+    params = {
+        "version": "8",
+        "format": "json",
+        "detail": "full",
+        "api_key": API_KEY,
+    }
+    if is_rate_label(rate, util):
+        params["getpage"] = rate
+    else:
+        # have to replace '&' to handle url correctly
+        params["ratesforutility"] = util.replace("&", "%26")
+    headers = {"If-None-Match": etag} if etag else None
+
+    log.info('Checking URDB for {}...'.format(rate))
+    res = http_session.get_session("urdb").get(
+        URDB_URL, params=params, headers=headers, verify=False)
+    if not res.ok and res.status_code != 304:
+        log.debug('URDB response not OK. Code {} with message: {}'.format(
+            res.status_code, res.text))
+        raise Warning('URDB response not OK.')
+    return res
+
+
+def select_rate(rates_in_util, rate, util=None):
+    """
+    Pick the rate out of the rates returned by a URDB query.
+
+    :param lst rates_in_util: Rate dictionaries returned by the query
+    :return: Either rate dict or None
+    """
+    if len(rates_in_util) == 0:
+        log.info('Could not find {} in URDB.'.format(rate))
+        return None
+
+    if not is_rate_label(rate, util):
+        matched_rates = []
+        start_dates = []
+
+        for candidate in rates_in_util:
+
+            if candidate['name'] == rate:
+                matched_rates.append(candidate)  # urdb can contain multiple rates of same name
+
+                if 'startdate' in candidate:
+                    start_dates.append(candidate['startdate'])
+
+        # find the newest rate of those that match the rate
+        newest_index = 0
+
+        if len(start_dates) > 1 and len(start_dates) == len(matched_rates):
+            newest_index = start_dates.index(max(start_dates))
+
+        if len(matched_rates) > 0:
+            return matched_rates[newest_index]
+        else:
+            log.info('Could not find {} in URDB.'.format(rate))
+            return None
+
+    elif rates_in_util[0]['label'] == rate:
+        return rates_in_util[0]
+
+    else:
+        log.info('Could not find {} in URDB'.format(rate))
+        return None
+
+
+def download_rate(rate, util=None):
+    """
+    Get a rate from the URDB API without the cache.
+
+    :return: Either rate dict or None
+    """
+    res = request_rates(rate, util)
+    data = json.loads(res.text, strict=False)
+    return select_rate(data['items'], rate, util)
+
+
+class TariffCache:
+    """
+    On-disk store of URDB rates. Safe to use from multiple threads of one
+    process.
+    """
+
+    def __init__(self, path=URDB_CACHE_PATH, ttl=DEFAULT_TTL,
+                 offline=OFFLINE):
+        """
+        :param str path: Cache folder
+        :param float ttl: Seconds before a cached query is refreshed.
+        :param bool offline: Only use cached rates, even if they are stale.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.offline = offline
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.join(self.path, "rates"), exist_ok=True)
+        try:
+            with open(self.index_filename, "r") as f:
+                self._index = json.load(f)
+        except FileNotFoundError:
+            # queries: query key -> fetched time, ETag and labels returned.
+            # names: utility and rate name -> labels with that name.
+            self._index = {"queries": {}, "names": {}}
+
+    @property
+    def index_filename(self):
+        return os.path.join(self.path, "index.json")
+
+    def rate_filename(self, label):
+        return os.path.join(self.path, "rates", label + ".json")
+
+    @staticmethod
+    def query_key(rate, util=None):
+        if is_rate_label(rate, util):
+            return f"label:{rate}"
+        return f"utility:{util}"
+
+    @staticmethod
+    def name_key(util, name):
+        return f"{util}|{name}"
+
+    def get_rate(self, rate, util=None):
+        """
+        Return the rate dictionary for a URDB label, or a rate name of a
+        utility, fetching it if it isn't cached or is stale.
+
+        :return: Either rate dict or None if URDB doesn't have the rate.
+        """
+        key = self.query_key(rate, util)
+        with self._lock:
+            entry = self._index["queries"].get(key)
+        if entry is not None and (
+                self.offline or time.time() - entry["fetched"] < self.ttl):
+            return self._cached_rate(rate, util, entry)
+        if self.offline:
+            raise RuntimeError(
+                f"{rate} is not in the URDB cache at {self.path} and the "
+                "cache is offline")
+
+        res = request_rates(
+            rate, util, etag=entry.get("etag") if entry else None)
+        if res.status_code == 304 and entry is not None:
+            log.info('Cached {} is up to date.'.format(rate))
+            with self._lock:
+                entry["fetched"] = time.time()
+            self.flush()
+            return self._cached_rate(rate, util, entry)
+
+        rates_in_util = json.loads(res.text, strict=False)['items']
+        self._store(key, rates_in_util, res.headers.get("ETag"),
+                    None if is_rate_label(rate, util) else util)
+        return select_rate(rates_in_util, rate, util)
+
+    def _cached_rate(self, rate, util, entry):
+        if is_rate_label(rate, util):
+            labels = entry["labels"][:1]
+        else:
+            with self._lock:
+                labels = self._index["names"].get(
+                    self.name_key(util, rate), [])
+        rates_in_util = []
+        for label in labels:
+            with open(self.rate_filename(label), "r") as f:
+                rates_in_util.append(json.load(f))
+        return select_rate(rates_in_util, rate, util)
+
+    def _store(self, key, rates_in_util, etag=None, util=None):
+        """
+        Write the rates returned by a query and index them.
+
+        :param str util: Utility the query was for, to index the rate names
+            under. Defaults to the utility given by URDB.
+        """
+        for rate in rates_in_util:
+            filename = self.rate_filename(rate['label'])
+            temp_filename = \
+                f"{filename}.{os.getpid()}.{threading.get_ident()}"
+            with open(temp_filename, "w") as f:
+                json.dump(rate, f)
+            os.replace(temp_filename, filename)
+
+        with self._lock:
+            self._index["queries"][key] = {
+                "fetched": time.time(),
+                "etag": etag,
+                "labels": [rate['label'] for rate in rates_in_util],
+            }
+            for rate in rates_in_util:
+                utility = util if util is not None else rate.get('utility')
+                if 'name' not in rate or utility is None:
+                    continue
+                labels = self._index["names"].setdefault(
+                    self.name_key(utility, rate['name']), [])
+                if rate['label'] not in labels:
+                    labels.append(rate['label'])
+        self.flush()
+
+    def flush(self):
+        """
+        Write the index to disk.
+        """
+        with self._lock:
+            temp_filename = f"{self.index_filename}.{os.getpid()}"
+            with open(temp_filename, "w") as f:
+                json.dump(self._index, f)
+            os.replace(temp_filename, self.index_filename)
+
+    def prewarm(self, rates, jobs=8):
+        """
+        Fetch rates that aren't cached or are stale, *jobs* at a time.
+
+        :param rates: Iterable of URDB labels or (rate name, utility) tuples.
+        :return: dict of each rate to its rate dict, or None if URDB doesn't
+            have it.
+        """
+        rates = list(rates)
+        queries = [
+            (rate, None) if isinstance(rate, str) else tuple(rate)
+            for rate in rates
+        ]
+        with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+            found = pool.map(lambda query: self.get_rate(*query), queries)
+            return dict(zip(rates, found))
+
+
+def default_cache():
+    """
+    Return the cache shared by `tariff.Rate` objects, making it on first use.
+
+    :rtype: TariffCache
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = TariffCache()
+        return _default_cache
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Fetch the URDB rates of a tariffs CSV into the cache.")
+    parser.add_argument('tariffs', nargs='?', default='templates/tariffs.csv',
+                        help="CSV with a `urdb` column of rate labels.")
+    parser.add_argument('--jobs', default=8, type=int,
+                        help="Number of rates to fetch at once.")
+    parser.add_argument('--ttl', default=DEFAULT_TTL, type=float,
+                        help="Refetch rates cached longer ago than this many "
+                             "seconds.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    with open(args.tariffs, "r", newline="") as f:
+        labels = sorted(set(row['urdb'] for row in csv.DictReader(f)))
+    cache = TariffCache(ttl=args.ttl)
+    found = cache.prewarm(labels, jobs=args.jobs)
+    missing = [label for label, rate in found.items() if rate is None]
+    print(f"Cached {len(found) - len(missing)} of {len(found)} rates in "
+          f"{cache.path}")
+    for label in missing:
+        print(f"Not in URDB: {label}")